@@ -43,26 +43,115 @@ CORE_COUNT = -1
 # do we use the cached results? True=yes, False=no, go always to the db
 USE_CACHE = True
 
+# store the metrics in the cache with compact types, e.g. counts as the
+# smallest integer type that holds their values and ratios as float32,
+# see db/CacheSchema.py
+CACHE_TYPED_SCHEMA = True
+
+# compression of the cache files, options = [None, "uncompressed", "lz4", "zstd"]
+# None uses the default of feather (lz4)
+CACHE_COMPRESSION = None
+# e.g. zstd levels from 1 (fast) to 22 (small), None uses the default level
+CACHE_COMPRESSION_LEVEL = None
+
+# compute summary statistics of the columns of each cache file, e.g. min, max
+# and distinct count, and store them in the cache catalog, see
+# db/ColumnStats.py
+CACHE_COLUMN_STATS = True
+
+# limit the size of the cache directory, the least recently used cache files
+# are deleted, once the limit is exceeded. 0 -> no limit
+# use manage_cache.py to list, inspect and prune the cache
+CACHE_SIZE_LIMIT_GB = 0
+
+# cache each metric table only once and join the metrics of the instances
+# locally, instead of caching the metrics again with every instance query,
+# see db/LocalStore.py
+USE_LOCAL_STORE = False
+
+# the db to query, options = ["mysql", "sqlite", "duckdb"]
+# mysql connects to the server configured in dbconfig.ini, sqlite and duckdb
+# query the embedded db file EMBEDDED_DB_PATH, use import_dump.py to import
+# the db dump into it. duckdb requires the duckdb package.
+DB_BACKEND = "mysql"
+EMBEDDED_DB_PATH = "refactoring.db"
+
+# explain each query fetched for the cache and record its plan and the
+# execute and fetch times of the db in the cache catalog, see `python3 manage_cache.py indexes`
+CAPTURE_QUERY_PLANS = False
+
 # is the db available? sometimes it's not, but you have all the cache
 DB_AVAILABLE = True
+
+# maximum number of open db connections,
+# this also limits the number of queries executed concurrently
+DB_POOL_SIZE = 4
+
+# stream query results in batches of FETCH_BATCH_SIZE rows directly into the
+# cache file, instead of loading the whole result set into memory at once.
+# This requires USE_CACHE.
+STREAM_FETCH = False
+FETCH_BATCH_SIZE = 100000
+
+# number of queries the cache warm-up executes concurrently,
+# the db connections are limited by DB_POOL_SIZE
+WARM_UP_CONCURRENCY = 4
+
+# fetch the non-refactored instances of all commit thresholds of a level with
+# a single query on the first cache miss, instead of only the required
+# threshold. warm_cache.py always coalesces the thresholds.
+COALESCE_STABLE_THRESHOLDS = False
 # endregion
 
 # region Dataset scaling
 # scale using MinMaxScaler?
 SCALE_DATASET = True
+# fit the scaler to the min and max of the column statistics of the cache,
+# instead of the instances, see CACHE_COLUMN_STATS
+SCALE_FROM_CACHE_STATS = False
+# endregion
+
+# region Non-refactored instances pool
+# keep the cleaned non-refactored instances of the current level in memory,
+# they are shared by all refactorings of the level,
+# see ml/preprocessing/instance_pool.py
+POOL_NON_REFACTORED_INSTANCES = True
+# endregion
+
+# region Out-of-core preprocessing
+# preprocess the cached instances in batches, instead of loading them into
+# memory at once. A seeded sample of at most OUT_OF_CORE_MAX_ROWS instances
+# is written to a matrix on disk, the random undersampling and the sample
+# reduction are applied while sampling, see ml/preprocessing/out_of_core.py
+OUT_OF_CORE_PREPROCESSING = False
+OUT_OF_CORE_MAX_ROWS = 2000000
 # endregion
 
 # region Dataset balancing
 BALANCE_DATASET = True
 SHOW_SQL = True
 # how to balance the dataset
-# options = [random, cluster_centroids, nearmiss]
+# options = [random, cluster_centroids, nearmiss,
+#            cluster_centroids_approx, nearmiss_approx]
 BALANCE_DATASET_STRATEGY = "random"
+# the approximate strategies stop after BALANCING_TIME_BUDGET seconds and fit
+# on a random subsample of at most BALANCING_MAX_SAMPLES non-refactored
+# instances, see ml/preprocessing/approximate_sampling.py
+BALANCING_TIME_BUDGET = 300
+BALANCING_MAX_SAMPLES = 1000000
 PERM_PAR = -1
 PERM_REPEATS = 50
 # Ratio of the positive and negative samples for the training, e.g. 0.1 -> 10/% positive samples
 # SET BALANCE_DATASET to False, otherwise this setting will be skipped
 TRAINING_SAMPLE_RATIO = 0.1
+
+# sample the non-refactored instances in the db, instead of fetching all of
+# them and dropping most with the random balancing or the sample reduction.
+# The sample is drawn by a seeded hash of the instance ids and is about
+# SERVER_SIDE_SAMPLING_FACTOR times larger than required, to make up for
+# instances dropped later, e.g. duplicates or faulty process metrics.
+SERVER_SIDE_SAMPLING = False
+SERVER_SIDE_SAMPLING_FACTOR = 1.5
 # endregion
 SEED = 26
 # region Feature reduction
@@ -87,18 +176,69 @@ DROP_METRICS = []
 
 # number of folds for feature reduction
 N_CV_FEATURE_REDUCTION = 2
+
+# drop redundant features before the feature reduction and the search:
+# constant features, near constant features, whose most frequent value
+# covers FEATURE_FILTER_DOMINANT_RATIO of the instances, and features with an
+# absolute correlation of FEATURE_FILTER_CORRELATION to an earlier feature,
+# see ml/preprocessing/feature_filter.py
+FEATURE_FILTER = False
+FEATURE_FILTER_DOMINANT_RATIO = 0.999
+FEATURE_FILTER_CORRELATION = 0.98
+# the near constant and correlated features are found on a sample
+FEATURE_FILTER_SAMPLE_SIZE = 50000
+
+# how to select the features, see ml/preprocessing/feature_reduction.py
+# options = [rfecv, importance_threshold, mutual_information, subsample_rfe]
+# rfecv: recursive feature elimination with cross-validation
+# importance_threshold: keep the features with an importance of at least
+#   FEATURE_SELECTION_THRESHOLD, with a single fit of the estimator
+# mutual_information: keep the features with a mutual information with the
+#   label of at least FEATURE_SELECTION_THRESHOLD, independent of the model
+# subsample_rfe: rfecv on a stratified subsample of the training data
+FEATURE_SELECTION_METHOD = "rfecv"
+# features eliminated per rfe step, either a count (>= 1) or a fraction of
+# all features (< 1), e.g. 0.1
+FEATURE_SELECTION_STEP = 1
+# increase the rfe step, to finish the rfe within this time budget in
+# seconds, it is estimated from a single fit. None -> no budget
+FEATURE_SELECTION_TIME_BUDGET = None
+# the maximum number of instances of subsample_rfe and mutual_information
+FEATURE_SELECTION_MAX_SAMPLES = 20000
+# the threshold of importance_threshold and mutual_information,
+# options = ["mean", "median", a number]
+FEATURE_SELECTION_THRESHOLD = "mean"
+# cache the selected features per training data, estimator and feature
+# selection config in cache/feature_selection, reruns skip the selection
+CACHE_FEATURE_SELECTION = True
 # endregion
 
 # region Hyperparameter search
 # what type of search for the best hyper params?
-# options = [randomized, grid]
+# options = [randomized, grid, halving_grid, halving_randomized, bayesian]
 SEARCH = "grid"
+# the halving searches evaluate all candidates with a small resource, e.g.
+# few samples or n_estimators, see halving_resource of the models, and only
+# the best 1 / HALVING_FACTOR candidates with HALVING_FACTOR times more
+# resource in the next iteration
+HALVING_FACTOR = 3
 
 SCORING = "accuracy"
 
 # number of iterations (if Randomized strategy is chosen)
 N_ITER_RANDOM_SEARCH = 100
 
+# the bayesian search models the good and the bad candidates with a TPE and
+# proposes batches of candidates in the search_space of the models
+# the maximum number of candidates of the bayesian search
+N_ITER_BAYESIAN_SEARCH = 50
+# the number of random candidates before the TPE proposes candidates
+N_INITIAL_BAYESIAN_SEARCH = 10
+# the number of candidates evaluated in parallel
+BAYESIAN_BATCH_SIZE = 4
+# stop after this many batches without a better score, None -> never stop early
+BAYESIAN_PATIENCE = 5
+
 # number of folds in the search for best parameters
 N_CV_SEARCH = 7
 # endregion
@@ -127,6 +267,13 @@ MODELS = [
 ]
 
 DATASETS = ["industry"]
+
+# count the instances of all refactorings and commit thresholds with a single
+# query, before fetching the instances, and skip refactorings with less than
+# PREFLIGHT_MIN_INSTANCES refactored or non-refactored instances.
+# The counts are an upper bound, e.g. instances without metrics are counted.
+PREFLIGHT_COUNTS = False
+PREFLIGHT_MIN_INSTANCES = 1
 # endregion
 
 # region refactorings
@@ -0,0 +1,323 @@
+import glob
+import json
+import os.path
+import sqlite3
+import time
+from typing import Iterable, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+from pandas.core.frame import DataFrame
+
+from configs import CACHE_DIR_PATH, CACHE_COLUMN_STATS
+from db import ColumnStats
+from utils.log import log
+
+"""
+The catalog of the query cache.
+
+It is an sqlite database next to the cache files and stores for each cache
+entry: the query that created it, its row and column count, schema, size,
+creation and last access time, whether the write of the file finished and
+the largest instance id of its rows, to refresh it with newer rows.
+With CAPTURE_QUERY_PLANS it stores the plan of the query and the time the db
+took to execute it and to send its rows, see QueryPlan. With CACHE_COLUMN_STATS it stores summary statistics of the
+columns, see ColumnStats.
+"""
+
+CATALOG_PATH = os.path.join(CACHE_DIR_PATH, "cache", "catalog.sqlite")
+
+# the columns of the catalog, new columns are added to existing catalogs
+_COLUMNS = [
+    ("query_hash", "TEXT PRIMARY KEY"),
+    ("query", "TEXT"),
+    ("file_path", "TEXT"),
+    ("rows", "INTEGER"),
+    ("columns", "INTEGER"),
+    ("schema", "TEXT"),
+    ("bytes", "INTEGER"),
+    ("created_at", "REAL"),
+    ("last_access", "REAL"),
+    ("complete", "INTEGER"),
+    ("max_id", "INTEGER"),
+    ("plan", "TEXT"),
+    ("plan_backend", "TEXT"),
+    ("query_seconds", "REAL"),
+    ("fetch_seconds", "REAL"),
+    ("stats", "TEXT")]
+
+
+# the catalogs whose schema was set up by this process
+_schema_ready = set()
+
+
+def _create_schema(cnx: sqlite3.Connection):
+    with cnx:
+        cnx.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            + ", ".join(f"{name} {data_type}" for name, data_type in _COLUMNS)
+            + ")")
+        existing = [row[1] for row in cnx.execute("PRAGMA table_info(entries)")]
+        for name, data_type in _COLUMNS:
+            if name not in existing:
+                cnx.execute(f"ALTER TABLE entries ADD COLUMN {name} {data_type}")
+
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(CATALOG_PATH), exist_ok=True)
+    # several processes share the catalog, wait for their writes
+    cnx = sqlite3.connect(CATALOG_PATH, timeout=60)
+    # set up the schema only once per process, not with every cache hit
+    if CATALOG_PATH not in _schema_ready:
+        _create_schema(cnx)
+        _schema_ready.add(CATALOG_PATH)
+    return cnx
+
+
+def _execute(sql: str, parameters: Iterable = ()):
+    cnx = _connect()
+    try:
+        with cnx:
+            return cnx.execute(sql, tuple(parameters)).fetchall()
+    finally:
+        cnx.close()
+
+
+def query_hash_of(file_path: str) -> str:
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def start_entry(sql_query: str, file_path: str):
+    """
+    Register a cache file before it is written, the entry stays incomplete
+    until finish_entry is called.
+    """
+    now = time.time()
+    _execute(
+        "INSERT OR REPLACE INTO entries "
+        "(query_hash, query, file_path, created_at, last_access, complete) "
+        "VALUES (?, ?, ?, ?, ?, 0)",
+        (query_hash_of(file_path), sql_query, file_path, now, now))
+
+
+def finish_entry(file_path: str):
+    """
+    Mark the entry of a written cache file as complete and record its
+    metadata, e.g. row count and schema.
+    """
+    schema = pa.ipc.open_file(file_path).schema
+    stats = ColumnStats.compute(file_path) if CACHE_COLUMN_STATS else None
+    _execute(
+        "UPDATE entries SET rows = ?, columns = ?, schema = ?, bytes = ?, "
+        "max_id = ?, stats = ?, complete = 1 WHERE query_hash = ?",
+        (ds.dataset(file_path, format="feather").count_rows(),
+         len(schema.names),
+         json.dumps({field.name: str(field.type) for field in schema}),
+         os.path.getsize(file_path),
+         _max_id(file_path, schema),
+         json.dumps(stats) if stats is not None else None,
+         query_hash_of(file_path)))
+
+
+def _max_id(file_path: str, schema: pa.Schema):
+    # the largest id of the index column, either the id itself or the
+    # instance id, e.g. StableCommit.2541; None for queries without index
+    if "index" not in schema.names:
+        return None
+    ids = feather.read_table(file_path, columns=["index"]).column(0).to_pandas()
+    if len(ids.index) == 0:
+        return 0
+    if not pd.api.types.is_integer_dtype(ids):
+        ids = ids.str.rsplit(".", n=1).str[-1].astype("int64")
+    return int(ids.max())
+
+
+def high_water_mark(file_path: str):
+    """
+    Get the largest instance id of a cache file, see refresh_query in
+    DBConnector. Entries from before the id was recorded get it recorded now.
+
+    Returns:
+        the largest id or None, if the query has no instance id, e.g. a count
+    """
+    rows = _execute(
+        "SELECT max_id FROM entries WHERE query_hash = ?",
+        (query_hash_of(file_path),))
+    if len(rows) > 0 and rows[0][0] is not None:
+        return rows[0][0]
+    max_id = _max_id(file_path, pa.ipc.open_file(file_path).schema)
+    _execute(
+        "UPDATE entries SET max_id = ? WHERE query_hash = ?",
+        (max_id, query_hash_of(file_path)))
+    return max_id
+
+
+def column_stats(file_path: str) -> dict:
+    """
+    Get the column statistics of a cache file, see ColumnStats.compute.
+    Entries from before the statistics were recorded get them recorded now.
+    """
+    rows = _execute(
+        "SELECT stats FROM entries WHERE query_hash = ?",
+        (query_hash_of(file_path),))
+    if len(rows) > 0 and rows[0][0] is not None:
+        return json.loads(rows[0][0])
+    stats = ColumnStats.compute(file_path)
+    _execute(
+        "UPDATE entries SET stats = ? WHERE query_hash = ?",
+        (json.dumps(stats), query_hash_of(file_path)))
+    return stats
+
+
+def derived_files(file_path: str) -> List[str]:
+    """
+    Get the files derived from a cache file, e.g. <query hash>.rowhash.ftr,
+    they are stored next to the cache file and share its query hash.
+    """
+    directory = os.path.dirname(file_path)
+    return [path for path in glob.glob(
+        os.path.join(directory, glob.escape(query_hash_of(file_path)) + ".*"))
+        if os.path.abspath(path) != os.path.abspath(file_path)
+        and ".tmp-" not in os.path.basename(path)]
+
+
+def derived_bytes(file_path: str) -> int:
+    """
+    Get the total size of the files derived from a cache file.
+    """
+    return sum(os.path.getsize(path) for path in derived_files(file_path))
+
+
+def remove_temp_files():
+    """
+    Delete the temporary files of cache writes, they are left behind by
+    killed processes. Make sure no other process is filling the cache.
+    """
+    cache_dir = os.path.dirname(CATALOG_PATH)
+    for path in glob.glob(os.path.join(cache_dir, "*.tmp-*")):
+        log(f"Remove temporary file {path}")
+        os.remove(path)
+
+
+def invalidate_derived(file_path: str):
+    """
+    Delete the files derived from a cache file, e.g. after its rows changed.
+    """
+    for path in derived_files(file_path):
+        log(f"Invalidate {path}")
+        os.remove(path)
+
+
+def record_plan(
+        file_path: str,
+        plan: str,
+        backend: str,
+        seconds: float,
+        fetch_seconds: float):
+    """
+    Record the query plan and the timing of the query of a cache entry.
+
+    Parameter:
+        seconds (float): the execute of the query on the cursor, until the
+         db returns its first result
+        fetch_seconds (float): the fetch of the rows from the cursor, without
+         the conversion and the write of the cache file
+    """
+    _execute(
+        "UPDATE entries SET plan = ?, plan_backend = ?, query_seconds = ?, "
+        "fetch_seconds = ? WHERE query_hash = ?",
+        (plan, backend, seconds, fetch_seconds, query_hash_of(file_path)))
+
+
+def touch(file_path: str):
+    """
+    Update the last access time of a cache entry.
+    """
+    _execute(
+        "UPDATE entries SET last_access = ? WHERE query_hash = ?",
+        (time.time(), query_hash_of(file_path)))
+
+
+def entries() -> DataFrame:
+    """
+    Get all entries of the catalog, the least recently used entry first.
+    """
+    cnx = _connect()
+    try:
+        return pd.read_sql_query(
+            "SELECT * FROM entries ORDER BY last_access", cnx,
+            index_col="query_hash")
+    finally:
+        cnx.close()
+
+
+def remove_entry(query_hash: str):
+    """
+    Delete a cache file, its derived files and its entry.
+    """
+    rows = _execute(
+        "SELECT file_path FROM entries WHERE query_hash = ?", (query_hash,))
+    for (file_path,) in rows:
+        if file_path is None:
+            continue
+        invalidate_derived(file_path)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    _execute("DELETE FROM entries WHERE query_hash = ?", (query_hash,))
+
+
+def evict(size_limit: int, keep: Iterable[str] = ()):
+    """
+    Delete the least recently used complete entries, until the cache is
+    smaller than the size limit. The size of an entry includes its derived
+    files.
+
+    Parameter:
+        size_limit (int): the size limit in bytes
+        keep (Iterable[str]) (optional): never evict these query hashes
+    """
+    rows = [(query_hash, (size or 0) + (
+        derived_bytes(file_path) if file_path is not None else 0))
+        for query_hash, size, file_path in _execute(
+            "SELECT query_hash, bytes, file_path FROM entries "
+            "WHERE complete = 1 ORDER BY last_access")]
+    total = sum(size for _, size in rows)
+    for query_hash, size in rows:
+        if total <= size_limit:
+            break
+        if query_hash in keep:
+            continue
+        log(f"Evict cache entry {query_hash} ({size} bytes)")
+        remove_entry(query_hash)
+        total -= size
+
+
+def sync():
+    """
+    Bring the catalog in line with the cache directory: register cache files
+    written without a catalog, e.g. by an older version, with an unknown
+    query, and drop entries whose file was deleted.
+    """
+    known = {query_hash: file_path for query_hash, file_path in _execute(
+        "SELECT query_hash, file_path FROM entries")}
+    cache_dir = os.path.dirname(CATALOG_PATH)
+    for file_path in glob.glob(os.path.join(cache_dir, "*.ftr")):
+        # skip derived files, e.g. <query hash>.rowhash.ftr
+        if "." in query_hash_of(file_path):
+            continue
+        if query_hash_of(file_path) not in known:
+            modified = os.path.getmtime(file_path)
+            _execute(
+                "INSERT INTO entries (query_hash, file_path, created_at, "
+                "last_access, complete) VALUES (?, ?, ?, ?, 0)",
+                (query_hash_of(file_path), file_path, modified, modified))
+            try:
+                finish_entry(file_path)
+            except (pa.ArrowInvalid, OSError):
+                log(f"Unreadable cache file {file_path}, kept incomplete.")
+    for query_hash, file_path in known.items():
+        if file_path is None or not os.path.exists(file_path):
+            _execute(
+                "DELETE FROM entries WHERE query_hash = ?", (query_hash,))
@@ -0,0 +1,105 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from configs import CLASS_METRICS_Fields, METHOD_METRICS_FIELDS, \
+    VARIABLE_METRICS_FIELDS, FIELD_METRICS_FIELDS, PROCESS_METRICS_FIELDS, \
+    REFACTORING_COMMIT_FIELDS, STABLE_COMMIT_FIELDS
+
+"""
+The column types of cached query results.
+
+The db returns all metrics as int64, float64 or decimal columns. The schema
+registry maps each field of the metric field lists in configs.py onto a
+compact type: ratios are stored as float32, flags as int8 and all other
+metrics are counts, stored in the smallest integer type that holds their
+values.
+"""
+
+# metrics with values between 0 and 1
+RATIO_FIELDS = ["classLCC", "classTCC", "authorOwnership"]
+# metrics and instance fields with a few distinct small values
+SMALL_FIELDS = ["isInnerClass", "isTest", "level"]
+
+# smallest first
+_INTEGER_TYPES = [pa.int8(), pa.int16(), pa.int32()]
+
+
+def _field_type(field: str) -> pa.DataType:
+    if field in RATIO_FIELDS:
+        return pa.float32()
+    if field in SMALL_FIELDS:
+        return pa.int8()
+    # counts
+    return pa.int32()
+
+
+# maps each known field onto its widest type in the cache
+FIELD_TYPES = {
+    field: _field_type(field) for field in
+    CLASS_METRICS_Fields + METHOD_METRICS_FIELDS + VARIABLE_METRICS_FIELDS +
+    FIELD_METRICS_FIELDS + PROCESS_METRICS_FIELDS +
+    REFACTORING_COMMIT_FIELDS + STABLE_COMMIT_FIELDS + ["commitThreshold"]
+    if field not in ["className", "filePath"]}
+
+
+def _is_castable(source: pa.DataType, target: pa.DataType) -> bool:
+    # never turn fractional numbers into integers
+    if pa.types.is_integer(target):
+        return pa.types.is_integer(source) or pa.types.is_decimal(source) \
+            or pa.types.is_null(source)
+    return pa.types.is_integer(source) or pa.types.is_floating(source) \
+        or pa.types.is_decimal(source) or pa.types.is_null(source)
+
+
+def stream_schema(schema: pa.Schema) -> pa.Schema:
+    """
+    Get the registered types for the schema of a streamed query result.
+    The schema is fixed by the first batch, thus counts get their widest
+    registered type.
+    """
+    return pa.schema([
+        pa.field(field.name, FIELD_TYPES[field.name])
+        if field.name in FIELD_TYPES and
+        _is_castable(field.type, FIELD_TYPES[field.name])
+        else field
+        for field in schema])
+
+
+def apply_schema(table: pa.Table) -> pa.Table:
+    """
+    Cast the known fields of the table to their registered types, counts are
+    narrowed to the smallest integer type that holds all their values.
+    Fields that cannot be cast without loss keep their type.
+    """
+    for index, field in enumerate(table.schema):
+        if field.name not in FIELD_TYPES or \
+                not _is_castable(field.type, FIELD_TYPES[field.name]):
+            continue
+        column = table.column(index)
+        target = FIELD_TYPES[field.name]
+        if pa.types.is_integer(target):
+            target = _smallest_integer_type(column, target)
+        try:
+            column = column.cast(target, safe=True)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            continue
+        table = table.set_column(index, field.name, column)
+    return table
+
+
+def _smallest_integer_type(
+        column: pa.ChunkedArray,
+        widest: pa.DataType) -> pa.DataType:
+    if column.null_count == len(column):
+        return _INTEGER_TYPES[0]
+    min_max = pc.min_max(column)
+    low, high = min_max["min"].as_py(), min_max["max"].as_py()
+    for integer_type in _INTEGER_TYPES:
+        info = np.iinfo(integer_type.to_pandas_dtype())
+        if info.min <= low and high <= info.max:
+            return integer_type
+        if integer_type == widest:
+            break
+    # does not fit, let the safe cast fail
+    return widest
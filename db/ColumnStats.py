@@ -0,0 +1,145 @@
+import math
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+"""
+Summary statistics of the columns of a cache file.
+
+The statistics are computed in a single pass over the record batches of the
+file, when it is written, and stored in the cache catalog. For each column:
+the count of values, the count of NAs and the number of distinct values,
+estimated with a KMV (k minimum values) sketch. Numeric columns have their
+min, max and mean as well.
+
+The statistics of several cache files are combined with combine, e.g. of
+the refactored and the non-refactored instances. The sketches are combined
+as well, thus the distinct count of the combination is estimated correctly.
+"""
+
+# the size of the KMV sketches, the relative error of the distinct count
+# is about 1 / sqrt(SKETCH_SIZE)
+SKETCH_SIZE = 256
+
+# the largest hash value, the hashes are uniform in [0, 2^64)
+_HASH_RANGE = 2.0 ** 64
+
+
+def _is_numeric(data_type: pa.DataType) -> bool:
+    return pa.types.is_integer(data_type) or pa.types.is_floating(data_type) \
+        or pa.types.is_boolean(data_type) or pa.types.is_decimal(data_type)
+
+
+def _sketch(sketch: np.ndarray, values: np.ndarray) -> np.ndarray:
+    # keep the SKETCH_SIZE smallest distinct hashes
+    hashes = pd.util.hash_array(values)
+    return np.unique(np.concatenate([sketch, hashes]))[:SKETCH_SIZE]
+
+
+def distinct_count(sketch: Iterable[int]) -> int:
+    """
+    Estimate the number of distinct values from a KMV sketch.
+    """
+    sketch = np.sort(np.asarray(sketch, dtype=np.uint64))
+    if len(sketch) < SKETCH_SIZE:
+        # the sketch holds all distinct values
+        return len(sketch)
+    return int(round((SKETCH_SIZE - 1) * _HASH_RANGE / (float(sketch[-1]) + 1)))
+
+
+def compute(file_path: str) -> Dict[str, dict]:
+    """
+    Compute the statistics of all columns of a cache file, except the index.
+
+    Returns:
+        the statistics by column, a dict of count, na_count, distinct, min,
+        max, mean and the sketch, min, max and mean are None for non-numeric
+        and empty columns
+    """
+    dataset = ds.dataset(file_path, format="feather")
+    accumulators = {
+        field.name: {"numeric": _is_numeric(field.type), "count": 0,
+                     "na_count": 0, "min": None, "max": None, "sum": 0.0,
+                     "sketch": np.empty(0, dtype=np.uint64)}
+        for field in dataset.schema if field.name != "index"}
+    for batch in dataset.to_batches(columns=list(accumulators)):
+        for name, column in zip(batch.schema.names, batch.columns):
+            accumulator = accumulators[name]
+            values = column.drop_null()
+            accumulator["na_count"] += column.null_count
+            accumulator["count"] += len(values)
+            if len(values) == 0:
+                continue
+            if accumulator["numeric"]:
+                values = pc.cast(values, pa.float64())
+                min_max = pc.min_max(values)
+                accumulator["min"] = _min(accumulator["min"], min_max["min"].as_py())
+                accumulator["max"] = _max(accumulator["max"], min_max["max"].as_py())
+                accumulator["sum"] += pc.sum(values).as_py()
+            accumulator["sketch"] = _sketch(
+                accumulator["sketch"], values.to_numpy(zero_copy_only=False))
+    return {name: _stats(accumulator)
+            for name, accumulator in accumulators.items()}
+
+
+def _min(a, b):
+    return b if a is None else min(a, b)
+
+
+def _max(a, b):
+    return b if a is None else max(a, b)
+
+
+def _stats(accumulator: dict) -> dict:
+    count = accumulator["count"]
+    mean = accumulator["sum"] / count \
+        if accumulator["numeric"] and count > 0 else None
+    return {"count": count,
+            "na_count": accumulator["na_count"],
+            "distinct": distinct_count(accumulator["sketch"]),
+            "min": _finite(accumulator["min"]),
+            "max": _finite(accumulator["max"]),
+            "mean": _finite(mean),
+            "sketch": [int(value) for value in accumulator["sketch"]]}
+
+
+def _finite(value):
+    # json has no NaN or infinity
+    if value is None or not math.isfinite(value):
+        return None
+    return value
+
+
+def combine(stats_list: Iterable[Dict[str, dict]]) -> Dict[str, dict]:
+    """
+    Combine the statistics of several cache files, e.g. of the refactored and
+    non-refactored instances. Only the columns of all files are combined.
+    """
+    stats_list = list(stats_list)
+    columns = [column for column in stats_list[0]
+               if all(column in stats for stats in stats_list)]
+    combined = {}
+    for column in columns:
+        parts = [stats[column] for stats in stats_list]
+        count = sum(part["count"] for part in parts)
+        means = [(part["mean"], part["count"]) for part in parts
+                 if part["mean"] is not None]
+        sketch = np.unique(np.concatenate(
+            [np.asarray(part["sketch"], dtype=np.uint64) for part in parts]))
+        sketch = sketch[:SKETCH_SIZE]
+        mins = [part["min"] for part in parts if part["min"] is not None]
+        maxs = [part["max"] for part in parts if part["max"] is not None]
+        combined[column] = {
+            "count": count,
+            "na_count": sum(part["na_count"] for part in parts),
+            "distinct": distinct_count(sketch),
+            "min": min(mins) if len(mins) > 0 else None,
+            "max": max(maxs) if len(maxs) > 0 else None,
+            "mean": sum(mean * part_count for mean, part_count in means) / count
+            if len(means) > 0 and count > 0 else None,
+            "sketch": [int(value) for value in sketch]}
+    return combined
@@ -0,0 +1,113 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+from utils.log import log
+
+
+class ConnectionPool:
+    """
+    A bounded pool of database connections.
+
+    Connections are opened on demand until the pool holds `size` of them.
+    Afterwards a checkout blocks until another thread returns its connection.
+    Dropped connections are replaced on checkout and queries failing with one
+    of the given connection errors are retried on a fresh connection.
+    """
+
+    def __init__(
+            self,
+            connect,
+            size: int,
+            is_alive=None,
+            connection_errors=(),
+            retries: int = 1):
+        """
+        Parameter:
+            connect (callable): opens a new connection
+            size (int): maximum number of open connections
+            is_alive (callable) (optional): checks if a connection is usable
+            connection_errors (tuple) (optional): exceptions that indicate a
+             dropped connection
+            retries (int) (optional): retry a query this often on a dropped
+             connection
+        """
+        self._connect = connect
+        self._is_alive = is_alive
+        self._connection_errors = tuple(connection_errors)
+        self._retries = retries
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        try:
+            cnx = self._idle.get_nowait()
+        except queue.Empty:
+            return self._open()
+        if self._is_alive is not None and not self._is_alive(cnx):
+            log("Reconnecting a dropped db connection.")
+            self._discard(cnx)
+            return self._open()
+        return cnx
+
+    def _open(self):
+        cnx = self._connect()
+        with self._lock:
+            self._connections.append(cnx)
+        return cnx
+
+    def _discard(self, cnx):
+        with self._lock:
+            if cnx in self._connections:
+                self._connections.remove(cnx)
+        try:
+            cnx.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the duration of the with block.
+        """
+        self._slots.acquire()
+        try:
+            cnx = self._checkout()
+            try:
+                yield cnx
+            except BaseException:
+                # the connection might be left in an undefined state, e.g.
+                # with an interrupted fetch, thus do not hand it out again
+                self._discard(cnx)
+                raise
+            self._idle.put(cnx)
+        finally:
+            self._slots.release()
+
+    def run(self, task):
+        """
+        Run task(connection) on a checked out connection and return its result.
+        The task is retried on a new connection, if the connection dropped.
+        """
+        for attempt in range(self._retries + 1):
+            try:
+                with self.connection() as cnx:
+                    return task(cnx)
+            except self._connection_errors as e:
+                if attempt >= self._retries:
+                    raise
+                log(f"Lost the db connection ({e}), retrying the query.")
+
+    def close(self):
+        """
+        Close all connections of this pool.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for cnx in connections:
+            try:
+                cnx.close()
+            except Exception:
+                pass
@@ -1,36 +1,47 @@
 import mysql.connector
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
 import hashlib
 import os.path
 import configparser
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from typing import Any, Dict, Iterable, List
 
 from pandas.core.frame import DataFrame
-from configs import USE_CACHE, DB_AVAILABLE, CACHE_DIR_PATH, SHOW_SQL
+from configs import USE_CACHE, DB_AVAILABLE, CACHE_DIR_PATH, SHOW_SQL, \
+    DB_POOL_SIZE, STREAM_FETCH, FETCH_BATCH_SIZE, CACHE_SIZE_LIMIT_GB, \
+    CACHE_TYPED_SCHEMA, CACHE_COMPRESSION, CACHE_COMPRESSION_LEVEL, \
+    DB_BACKEND, EMBEDDED_DB_PATH, CAPTURE_QUERY_PLANS
+from db import CacheCatalog, CacheSchema, EmbeddedBackend, QueryPlan
+from db.ConnectionPool import ConnectionPool
+from db.FileLock import FileLock
+from db.QueryBuilder import get_delta_query
 from utils.log import log
-import sshtunnel
 
 config = configparser.ConfigParser()
 config.read(os.path.join(os.getcwd(), 'dbconfig.ini'))
 
-# connect to the mysql database either via ssh tunnel or directly
-mydb, tunnel = None, None
-if DB_AVAILABLE and config["db"].getboolean("use_tunnel"):
-    tunnel = sshtunnel.SSHTunnelForwarder(
-        (config["ssh_tunnel"]["host"], int(config["ssh_tunnel"]["port"])),
-        ssh_username=config["ssh_tunnel"]["user"],
-        ssh_password=config["ssh_tunnel"]["pwd"],
-        remote_bind_address=(config["db"]["host"], int(config["db"]["port"]))
-    )
-    tunnel.start()
-    mydb = mysql.connector.connect(
-        user=config["db"]["user"],
-        password=config["db"]["pwd"],
-        host="127.0.0.1",
-        port=tunnel.local_bind_port,
-        database=config["db"]["database"],
-    )
-elif DB_AVAILABLE:
-    mydb = mysql.connector.connect(
+
+def _connect():
+    """
+    Open a new connection to the mysql database,
+    either via the ssh tunnel or directly.
+    """
+    if tunnel is not None:
+        return mysql.connector.connect(
+            user=config["db"]["user"],
+            password=config["db"]["pwd"],
+            host="127.0.0.1",
+            port=tunnel.local_bind_port,
+            database=config["db"]["database"],
+        )
+    return mysql.connector.connect(
         host=config['db']["host"],
         user=config['db']["user"],
         passwd=config['db']["pwd"],
@@ -38,6 +49,51 @@ elif DB_AVAILABLE:
     )
 
 
+# the connection pool and ssh tunnel are created on the first cache miss,
+# fully cached runs never touch the network
+pool, tunnel = None, None
+_connect_lock = threading.Lock()
+
+
+def _get_pool() -> ConnectionPool:
+    """
+    Get the connection pool, start the ssh tunnel and create the pool
+    on the first call.
+    """
+    global pool, tunnel
+    with _connect_lock:
+        if pool is not None:
+            return pool
+        if DB_BACKEND != "mysql":
+            log(f"Query the {DB_BACKEND} db at {EMBEDDED_DB_PATH}.")
+            pool = ConnectionPool(
+                partial(EmbeddedBackend.connect, DB_BACKEND, EMBEDDED_DB_PATH),
+                DB_POOL_SIZE)
+            return pool
+        if config["db"].getboolean("use_tunnel"):
+            # sshtunnel is slow to import, only load it when it is needed
+            import sshtunnel
+            log("Starting the ssh tunnel to the db.")
+            tunnel = sshtunnel.SSHTunnelForwarder(
+                (config["ssh_tunnel"]["host"],
+                 int(config["ssh_tunnel"]["port"])),
+                ssh_username=config["ssh_tunnel"]["user"],
+                ssh_password=config["ssh_tunnel"]["pwd"],
+                remote_bind_address=(config["db"]["host"],
+                                     int(config["db"]["port"]))
+            )
+            tunnel.start()
+        # connect to the mysql database either via ssh tunnel or directly,
+        # all connections of the pool share the same tunnel
+        pool = ConnectionPool(
+            _connect,
+            DB_POOL_SIZE,
+            is_alive=lambda cnx: cnx.is_connected(),
+            connection_errors=(mysql.connector.errors.OperationalError,
+                               mysql.connector.errors.InterfaceError))
+        return pool
+
+
 # this method executes the query and stores the result in a local cache.
 # we do not want to re-execute large queries.
 # derived from
@@ -57,46 +113,615 @@ def execute_query(sql_query) -> DataFrame:
     if SHOW_SQL:
         log(f"Fetch data from the db with this query: \n\n{sql_query}\n\n")
 
-    # Hash the query
-    query_hash = hashlib.sha1(sql_query.encode()).hexdigest()
-
-    # Create the filepath
-    cache_dir = os.path.join(CACHE_DIR_PATH, "cache")
-    file_path = os.path.join(cache_dir, f"{query_hash}.ftr")
-    df: DataFrame
+    file_path = cache_file_path(sql_query)
+    df: DataFrame = None
     # Read the file or execute query
     if DB_AVAILABLE and not os.path.exists(file_path):
-        try:
-            if not os.path.isdir(cache_dir):
-                os.makedirs(cache_dir)
-            # split large tables into smaller chunks, to avoid MemoryErrors on
-            # small machines
-            df = pd.read_sql_query(
-                sql_query, mydb, coerce_float=False, index_col="index")
-            if USE_CACHE:
-                log(f"saving cache to {file_path}")
-                df.reset_index().to_feather(file_path)
-        except (KeyboardInterrupt):
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            close_connection()
-            exit()
+        with _cache_locks([file_path]):
+            # another process might have cached the query in the meantime
+            if not (USE_CACHE and os.path.exists(file_path)):
+                df = _fetch(sql_query, {None: sql_query}).get(None)
+    elif USE_CACHE and os.path.exists(file_path):
+        CacheCatalog.touch(file_path)
 
     if USE_CACHE and os.path.exists(file_path):
         # log(f"using cache at {file_path}")
         df = pd.read_feather(file_path)
-        df.set_index("index", inplace=True)
-    else:
+        _set_index(df)
+    elif df is None:
         raise RuntimeError(
             "Cache not found, and db connection is not available")
     return df
 
 
+def cache_query(sql_query: str) -> str:
+    """
+    Make sure the result of the query is cached, without loading it.
+
+    Parameter:
+        sql_query (str): the query to cache
+    Returns:
+        the path of the cache file
+    """
+    file_path = cache_file_path(sql_query)
+    if not os.path.exists(file_path):
+        if not (DB_AVAILABLE and USE_CACHE):
+            raise RuntimeError(
+                "Cache not found, and db connection is not available")
+        with _cache_locks([file_path]):
+            if not os.path.exists(file_path):
+                _fetch(sql_query, {None: sql_query})
+    else:
+        CacheCatalog.touch(file_path)
+    return file_path
+
+
+def cache_partitioned_query(
+        build_query,
+        partition_column: str,
+        partition_queries: Dict[Any, str]):
+    """
+    Cache the results of several queries, which only differ in their filter on
+    the partition column, with a single coalesced query. The coalesced result
+    is split by the partition column and each partition is stored as the
+    cache of its own query. Only partitions that are not cached yet are
+    fetched. Without db or cache this does nothing.
+
+    Parameter:
+        build_query (callable): builds the coalesced query for a list of
+         partition values, e.g. QueryBuilder.get_level_stable_thresholds
+        partition_column (str): the column the coalesced query selects
+         additionally, it is dropped from the partitions
+        partition_queries (dict): maps each partition value onto its query
+    """
+    missing = {value: sql_query
+               for value, sql_query in partition_queries.items()
+               if not os.path.exists(cache_file_path(sql_query))}
+    if len(missing) == 0 or not (DB_AVAILABLE and USE_CACHE):
+        return
+    with _cache_locks(cache_file_path(sql_query)
+                      for sql_query in missing.values()):
+        # other processes might have cached some partitions in the meantime
+        missing = {value: sql_query for value, sql_query in missing.items()
+                   if not os.path.exists(cache_file_path(sql_query))}
+        if len(missing) == 0:
+            return
+        sql_query = build_query(sorted(missing))
+        if SHOW_SQL:
+            log(f"Fetch data from the db with this query: \n\n{sql_query}\n\n")
+        _fetch(sql_query, missing, partition_column)
+
+
+def refresh_query(sql_query: str) -> int:
+    """
+    Bring the cached result of the query up to date with the db.
+    Only the rows added to the db since the query was cached are fetched,
+    they are identified by their instance id and appended to the cache file.
+    Queries without instance id, e.g. counts, are fetched again completely.
+    If rows were added, the files derived from the cache file are deleted.
+
+    Note:
+        This assumes that the rows of the db are never changed and new rows
+        get larger ids, like the instances of the data collection.
+
+    Parameter:
+        sql_query (str): the cached query
+    Returns:
+        the number of added rows
+    """
+    file_path = cache_file_path(sql_query)
+    if not os.path.exists(file_path):
+        cache_query(sql_query)
+        return cached_row_count(sql_query)
+    with _cache_locks([file_path]):
+        return _refresh(sql_query, file_path)
+
+
+def _refresh(sql_query: str, file_path: str) -> int:
+    last_id = CacheCatalog.high_water_mark(file_path)
+    cached_rows = cached_row_count(sql_query)
+    if last_id is None:
+        _fetch(sql_query, {None: sql_query})
+        CacheCatalog.invalidate_derived(file_path)
+        return cached_row_count(sql_query) - cached_rows
+
+    delta_query = get_delta_query(sql_query, last_id)
+    if SHOW_SQL:
+        log(f"Fetch new rows from the db with this query: \n\n{delta_query}\n\n")
+    new_rows = _get_pool().run(lambda cnx: _read_sql(cnx, delta_query))
+    CacheCatalog.touch(file_path)
+    if len(new_rows.index) == 0:
+        return 0
+
+    cached = feather.read_table(file_path)
+    new_table = pa.Table.from_pandas(new_rows, preserve_index=False)
+    try:
+        merged = pa.concat_tables([cached, new_table.cast(cached.schema)])
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # e.g. the new rows do not fit the narrowed types of the cache
+        merged = pa.concat_tables(
+            [cached.replace_schema_metadata(), new_table],
+            promote_options="permissive")
+    _write_table(merged, file_path)
+    CacheCatalog.invalidate_derived(file_path)
+    CacheCatalog.finish_entry(file_path)
+    log(f"Added {len(new_rows.index)} rows to {file_path}")
+    return len(new_rows.index)
+
+
+@contextmanager
+def _cache_locks(file_paths: Iterable[str]):
+    """
+    Hold the locks of the given cache files, only one process or thread fills
+    a cache file at a time. Without cache nothing is locked.
+    """
+    with ExitStack() as locks:
+        if USE_CACHE:
+            # always lock in the same order, to avoid deadlocks
+            for file_path in sorted(set(file_paths)):
+                locks.enter_context(FileLock(_lock_path(file_path)))
+        yield
+
+
+def _lock_path(file_path: str) -> str:
+    return os.path.join(os.path.dirname(file_path), "locks",
+                        CacheCatalog.query_hash_of(file_path) + ".lock")
+
+
+def _temp_path(file_path: str) -> str:
+    # unique per process and thread, see CacheCatalog.remove_temp_files
+    return f"{file_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+
+
+def cached_row_count(sql_query: str) -> int:
+    """
+    Count the rows of a cached query result, without loading it.
+    """
+    return ds.dataset(
+        cache_file_path(sql_query), format="feather").count_rows()
+
+
+def cache_file_path(sql_query: str) -> str:
+    """
+    Get the path of the cache file for the given query.
+    """
+    # Hash the query
+    query_hash = hashlib.sha1(sql_query.encode()).hexdigest()
+    return os.path.join(CACHE_DIR_PATH, "cache", f"{query_hash}.ftr")
+
+
+def get_column_stats(sql_query: str) -> Dict[str, dict]:
+    """
+    Get the column statistics of a cached query result, without loading it,
+    see ColumnStats.
+
+    Returns:
+        the statistics by column or None, if the query is not cached
+    """
+    file_path = cache_file_path(sql_query)
+    if not (USE_CACHE and os.path.exists(file_path)):
+        return None
+    return CacheCatalog.column_stats(file_path)
+
+
+def derived_file_path(
+        sql_query: str,
+        name: str,
+        extension: str = "ftr") -> str:
+    """
+    Get the path of a file derived from the cached query result,
+    e.g. <query hash>.rowhash.ftr, see CacheCatalog.derived_files.
+    """
+    return cache_file_path(sql_query)[:-len(".ftr")] + f".{name}.{extension}"
+
+
+def read_derived(sql_query: str, name: str) -> DataFrame:
+    """
+    Read a file derived from the cached query result.
+
+    Returns:
+        the derived data or None, if it was not stored or got invalidated
+    """
+    file_path = derived_file_path(sql_query, name)
+    if not (USE_CACHE and os.path.exists(file_path)):
+        return None
+    df = pd.read_feather(file_path)
+    _set_index(df)
+    return df
+
+
+def write_derived(df: DataFrame, sql_query: str, name: str):
+    """
+    Store data derived from the cached query result next to its cache file,
+    it is deleted once the cache file changes.
+    """
+    if not (USE_CACHE and os.path.exists(cache_file_path(sql_query))):
+        return
+    file_path = derived_file_path(sql_query, name)
+    temp_path = _temp_path(file_path)
+    try:
+        feather.write_feather(
+            _reset_index(df), temp_path, compression=CACHE_COMPRESSION,
+            compression_level=CACHE_COMPRESSION_LEVEL)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _fetch(
+        sql_query: str,
+        partition_queries: Dict[Any, str],
+        partition_column: str = None) -> Dict[Any, DataFrame]:
+    """
+    Execute the query and store the result in the cache.
+
+    Parameter:
+        sql_query (str): the query to execute
+        partition_queries (dict): maps each partition value onto the query
+         whose cache stores the partition, for an unpartitioned query this is
+         {None: sql_query}
+        partition_column (str) (optional): split the result by this column
+    Returns:
+        the fetched DataFrames for each partition value, if the result was
+        loaded into memory, or an empty dict if it was streamed to the cache
+    """
+    file_paths = {value: cache_file_path(partition_query)
+                  for value, partition_query in partition_queries.items()}
+    finished = set()
+    try:
+        _start_entries(partition_queries, file_paths)
+        plan = _explain(sql_query) if CAPTURE_QUERY_PLANS else None
+        # the time the db takes to execute the query and to send its rows,
+        # without the conversion and the write of the cache files
+        timing = {}
+        if USE_CACHE and STREAM_FETCH:
+            # split large tables into smaller chunks, to avoid
+            # MemoryErrors on small machines
+            log(f"streaming to cache at {', '.join(file_paths.values())}")
+            _get_pool().run(lambda cnx: _stream_to_feather(
+                cnx, sql_query, file_paths, partition_column, timing))
+            frames = {}
+        else:
+            df = _get_pool().run(lambda cnx: _read_sql(cnx, sql_query, timing))
+            _set_index(df)
+            frames = _partition(df, partition_column, file_paths)
+            if USE_CACHE:
+                for value, frame in frames.items():
+                    log(f"saving cache to {file_paths[value]}")
+                    _write_feather(_reset_index(frame), file_paths[value])
+        if USE_CACHE:
+            _finish_entries(file_paths.values(), plan, timing, finished)
+        return frames
+    except (KeyboardInterrupt):
+        _abort_fetch(file_paths.values(), finished)
+        close_connection()
+        exit()
+
+
+def _start_entries(partition_queries: Dict[Any, str], file_paths: Dict[Any, str]):
+    for value, file_path in file_paths.items():
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if USE_CACHE:
+            CacheCatalog.start_entry(partition_queries[value], file_path)
+
+
+def _explain(sql_query: str) -> str:
+    plan = _get_pool().run(lambda cnx: QueryPlan.explain(
+        cnx, _backend_sql(sql_query), DB_BACKEND))
+    if SHOW_SQL:
+        log(f"Query plan:\n{plan}")
+    return plan
+
+
+def _finish_entries(
+        file_paths: Iterable[str],
+        plan: str,
+        timing: dict,
+        finished: set):
+    """
+    Complete the catalog entries of the written cache files, with the query
+    plan, if captured, and evict the least recently used entries beyond the
+    cache size limit.
+
+    Parameter:
+        finished (set): add the cache files whose entry is complete
+    """
+    for file_path in file_paths:
+        CacheCatalog.finish_entry(file_path)
+        finished.add(file_path)
+        if plan is not None:
+            CacheCatalog.record_plan(
+                file_path, plan, DB_BACKEND,
+                timing["execute"], timing["fetch"])
+    if CACHE_SIZE_LIMIT_GB > 0:
+        CacheCatalog.evict(
+            int(CACHE_SIZE_LIMIT_GB * 1024 ** 3),
+            keep=[CacheCatalog.query_hash_of(file_path)
+                  for file_path in file_paths])
+
+
+def _abort_fetch(file_paths: Iterable[str], finished: set):
+    """
+    Clean up an interrupted fetch: remove the temporary files in progress and
+    the catalog entries of the cache files that were not written. Cache files
+    that were written completely are kept, with a complete entry.
+
+    Parameter:
+        finished (set): the cache files whose entry is already complete
+    """
+    for file_path in file_paths:
+        if file_path in finished:
+            continue
+        if os.path.exists(_temp_path(file_path)):
+            os.remove(_temp_path(file_path))
+        if not USE_CACHE:
+            continue
+        if os.path.exists(file_path):
+            # the cache files are replaced at once, an existing one is whole
+            CacheCatalog.finish_entry(file_path)
+        else:
+            CacheCatalog.remove_entry(CacheCatalog.query_hash_of(file_path))
+
+
+def _backend_sql(sql_query: str) -> str:
+    # the queries are written for mysql, see EmbeddedBackend
+    if DB_BACKEND == "mysql":
+        return sql_query
+    return EmbeddedBackend.translate(sql_query)
+
+
+def _read_sql(cnx, sql_query: str, timing: dict = None) -> DataFrame:
+    """
+    Execute the query on the connection and load its result.
+
+    Parameter:
+        timing (dict) (optional): set the seconds of the execute and of the
+         fetch of the rows on the cursor, as "execute" and "fetch"
+    """
+    timing = {} if timing is None else timing
+    cursor = cnx.cursor()
+    try:
+        start_time = time.time()
+        cursor.execute(_backend_sql(sql_query))
+        timing["execute"] = time.time() - start_time
+        columns = [column[0] for column in cursor.description]
+        start_time = time.time()
+        rows = cursor.fetchall()
+        timing["fetch"] = time.time() - start_time
+        return pd.DataFrame.from_records(
+            rows, columns=columns, coerce_float=False)
+    finally:
+        cursor.close()
+
+
+def _partition(
+        df: DataFrame,
+        partition_column: str,
+        values: Iterable[Any]) -> Dict[Any, DataFrame]:
+    """
+    Split the DataFrame into one DataFrame per value of the partition column,
+    without the partition column. Without a partition column, the DataFrame
+    is the only partition, with None as key.
+    """
+    if partition_column is None:
+        return {None: df}
+    return {value: df[df[partition_column] == value].drop(
+        columns=partition_column) for value in values}
+
+
+def _set_index(df: DataFrame):
+    # instance queries select their instance id as index, e.g.
+    # StableCommit.2541, count queries have no index column
+    if "index" in df.columns:
+        df.set_index("index", inplace=True)
+
+
+def _reset_index(df: DataFrame) -> DataFrame:
+    # the inverse of _set_index, do not store the row numbers of queries
+    # without index column
+    if df.index.name == "index":
+        return df.reset_index()
+    return df
+
+
+def _stream_to_feather(
+        cnx,
+        sql_query: str,
+        file_paths: Dict[Any, str],
+        partition_column: str = None,
+        timing: dict = None):
+    """
+    Fetch the result of the query in batches of FETCH_BATCH_SIZE rows and
+    append each batch as an arrow record batch to the feather file of its
+    partition. The cursor is unbuffered, thus the server streams the rows on
+    demand and at most one batch is held in memory.
+
+    Parameter:
+        cnx: an open db connection
+        sql_query (str): the query to fetch
+        file_paths (dict): maps each partition value onto its cache file,
+         see _fetch
+        partition_column (str) (optional): split the result by this column
+        timing (dict) (optional): set the seconds of the execute and of the
+         fetches of the rows on the cursor, see _read_sql
+    """
+    timing = {} if timing is None else timing
+    cursor = cnx.cursor()
+    writers, schemas = {}, {}
+    # write to temporary files and move them to the cache at the end,
+    # readers never see a partial cache file
+    temp_paths = {value: _temp_path(file_path)
+                  for value, file_path in file_paths.items()}
+    try:
+        start_time = time.time()
+        cursor.execute(_backend_sql(sql_query))
+        timing["execute"] = time.time() - start_time
+        columns = [column[0] for column in cursor.description]
+        timing["fetch"] = 0.0
+        while True:
+            start_time = time.time()
+            rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+            timing["fetch"] += time.time() - start_time
+            if not rows:
+                break
+            batch = pd.DataFrame.from_records(
+                rows, columns=columns, coerce_float=False)
+            _write_batch(_partition(batch, partition_column, file_paths),
+                         temp_paths, writers, schemas)
+        _close_writers(writers)
+        for value, file_path in file_paths.items():
+            if value in schemas:
+                os.replace(temp_paths[value], file_path)
+            else:
+                # empty result, keep the columns
+                _write_feather(pd.DataFrame(columns=[
+                    column for column in columns
+                    if column != partition_column]), file_path)
+    except BaseException:
+        _close_writers(writers)
+        for temp_path in temp_paths.values():
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+    finally:
+        _close_writers(writers)
+        cursor.close()
+
+
+def _write_batch(
+        parts: Dict[Any, DataFrame],
+        temp_paths: Dict[Any, str],
+        writers: dict,
+        schemas: dict):
+    """
+    Append the partitions of a batch to the files of their partition, the
+    writer and the schema of a file are created with its first partition.
+    """
+    for value, part in parts.items():
+        if len(part.index) == 0:
+            continue
+        table = pa.Table.from_pandas(part, preserve_index=False)
+        if value not in writers:
+            schemas[value] = _stream_schema(table.schema)
+            writers[value] = pa.ipc.new_file(
+                temp_paths[value], schemas[value],
+                options=_ipc_write_options())
+        writers[value].write_table(table.cast(schemas[value]))
+
+
+def _close_writers(writers: dict):
+    while len(writers) > 0:
+        writers.popitem()[1].close()
+
+
+def _write_feather(df: DataFrame, file_path: str):
+    """
+    Write a query result to its cache file, with the types of the cache schema.
+    """
+    _write_table(pa.Table.from_pandas(df, preserve_index=False), file_path)
+
+
+def _write_table(table: pa.Table, file_path: str):
+    if CACHE_TYPED_SCHEMA:
+        table = CacheSchema.apply_schema(table)
+    # replace the cache file at once, readers never see a partial file
+    temp_path = _temp_path(file_path)
+    try:
+        feather.write_feather(
+            table, temp_path, compression=CACHE_COMPRESSION,
+            compression_level=CACHE_COMPRESSION_LEVEL)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _stream_schema(schema: pa.Schema) -> pa.Schema:
+    """
+    Derive the schema of a streamed cache file from its first batch.
+    The types inferred from a single batch are not stable across batches,
+    decimals differ in their precision and columns without any value have no
+    type at all. Both are stored as doubles, unless the cache schema
+    registers a type for them.
+    """
+    if CACHE_TYPED_SCHEMA:
+        schema = CacheSchema.stream_schema(schema)
+    return pa.schema([
+        pa.field(field.name, pa.float64())
+        if pa.types.is_decimal(field.type) or pa.types.is_null(field.type)
+        else field
+        for field in schema])
+
+
+def _ipc_write_options() -> pa.ipc.IpcWriteOptions:
+    compression = CACHE_COMPRESSION
+    if compression is None:
+        # the same default as write_feather
+        compression = "lz4" if pa.Codec.is_available("lz4") else None
+    if compression is None or compression == "uncompressed":
+        return pa.ipc.IpcWriteOptions(compression=None)
+    return pa.ipc.IpcWriteOptions(compression=pa.Codec(
+        compression, compression_level=CACHE_COMPRESSION_LEVEL))
+
+
+def table_indexes(table_names: Iterable[str]) -> Dict[str, List[List[str]]]:
+    """
+    Get the columns of the existing indexes of the given tables,
+    see QueryPlan.existing_indexes.
+    """
+    return _get_pool().run(lambda cnx: {
+        table_name: QueryPlan.existing_indexes(cnx, DB_BACKEND, table_name)
+        for table_name in table_names})
+
+
+def cancel_futures(executor: ThreadPoolExecutor, futures: Iterable[Future]):
+    """
+    Cancel the pending futures and shut down the executor without waiting
+    for the running ones, shutdown(cancel_futures=True) requires python 3.9.
+    """
+    for future in futures:
+        future.cancel()
+    executor.shutdown(wait=False)
+
+
+def execute_queries(sql_queries: Iterable[str]) -> List[DataFrame]:
+    """
+    Execute independent queries concurrently on the connection pool.
+    Cached queries are read from the cache, see execute_query.
+
+    Parameter:
+        sql_queries (Iterable[str]): the queries to execute
+    Returns:
+        a list with the DataFrame of each query, in the order of the queries
+    """
+    sql_queries = list(sql_queries)
+    # do not fetch the same query twice
+    unique_queries = list(dict.fromkeys(sql_queries))
+    executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE)
+    futures = [executor.submit(execute_query, sql_query)
+               for sql_query in unique_queries]
+    try:
+        results = dict(zip(unique_queries,
+                           [future.result() for future in futures]))
+    except (KeyboardInterrupt):
+        cancel_futures(executor, futures)
+        close_connection()
+        exit()
+    executor.shutdown()
+    return [results[sql_query] for sql_query in sql_queries]
+
+
 def close_connection():
     """
     Close the connections with the database and tunnel, if necessary.
     """
-    if mydb is not None:
-        mydb.close()
-    if tunnel is not None:
-        tunnel.close()
+    global pool, tunnel
+    with _connect_lock:
+        if pool is not None:
+            pool.close()
+        if tunnel is not None:
+            tunnel.close()
+        pool, tunnel = None, None
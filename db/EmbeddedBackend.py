@@ -0,0 +1,115 @@
+import sqlite3
+
+"""
+Embedded databases as a stand-in for the mysql database.
+
+The queries of the QueryBuilder are written in the mysql dialect. They run
+on a SQLite or DuckDB file after a translation of the quoting: mysql quotes
+string literals with double quotes and identifiers with backticks, both
+embedded databases use single quotes for literals and double quotes for
+identifiers. SQLite lacks CONCAT_WS before 3.44, it is registered as a
+function.
+
+Use import_dump.py to import the db dump into an embedded database.
+"""
+
+BACKENDS = ["sqlite", "duckdb"]
+
+
+def translate(sql_query: str) -> str:
+    """
+    Translate the quoting of a mysql query for the embedded databases.
+
+    Parameter:
+        sql_query (str): a query in the mysql dialect, e.g. from QueryBuilder
+    """
+    translated = []
+    position = 0
+    while position < len(sql_query):
+        char = sql_query[position]
+        if char in "'\"`":
+            end = _closing_quote(sql_query, position)
+            content = sql_query[position + 1:end]
+            if char == "`":
+                translated.append('"' + content.replace('"', '""') + '"')
+            else:
+                translated.append(_string_literal(content, char))
+            position = end + 1
+        else:
+            translated.append(char)
+            position += 1
+    return "".join(translated)
+
+
+def _closing_quote(sql_query: str, start: int) -> int:
+    quote = sql_query[start]
+    position = start + 1
+    while position < len(sql_query):
+        char = sql_query[position]
+        if char == "\\" and quote != "`":
+            position += 2
+        elif char == quote:
+            # a doubled quote is an escaped quote
+            if sql_query[position + 1:position + 2] == quote:
+                position += 2
+            else:
+                return position
+        else:
+            position += 1
+    raise ValueError(f"Unterminated quote in query: {sql_query}")
+
+
+def _string_literal(content: str, quote: str) -> str:
+    # unescape the mysql literal and quote it with single quotes
+    value = []
+    position = 0
+    while position < len(content):
+        char = content[position]
+        if char == "\\" and position + 1 < len(content):
+            value.append(_ESCAPES.get(content[position + 1], content[position + 1]))
+            position += 2
+        elif char == quote and content[position + 1:position + 2] == quote:
+            value.append(quote)
+            position += 2
+        else:
+            value.append(char)
+            position += 1
+    return "'" + "".join(value).replace("'", "''") + "'"
+
+
+# the escape sequences of mysql string literals
+_ESCAPES = {"0": "\0", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a",
+            "b": "\b"}
+
+
+def _concat_ws(separator, *values):
+    # like mysql, skip NULL values and return NULL for a NULL separator
+    if separator is None:
+        return None
+    return separator.join(str(value) for value in values if value is not None)
+
+
+def connect(backend: str, path: str, read_only: bool = True):
+    """
+    Open a connection to an embedded database file.
+
+    Parameter:
+        backend (str): either sqlite or duckdb
+        path (str): path of the database file
+        read_only (bool) (optional): open the database only for queries,
+         this allows several processes to share a DuckDB file
+    """
+    if backend == "sqlite":
+        if read_only:
+            cnx = sqlite3.connect(
+                f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            cnx = sqlite3.connect(path, check_same_thread=False)
+        cnx.create_function("CONCAT_WS", -1, _concat_ws, deterministic=True)
+        return cnx
+    elif backend == "duckdb":
+        # duckdb is optional, only required for this backend
+        import duckdb
+        return duckdb.connect(path, read_only=read_only)
+    raise ValueError(
+        f"Unknown embedded db backend {backend}, options are {BACKENDS}")
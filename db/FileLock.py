@@ -0,0 +1,85 @@
+import os
+
+from utils.log import log
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    An exclusive lock on a file, shared by all processes and threads.
+
+    The lock is held by an open handle of the lock file, thus it is released
+    by the operating system, if the process is killed. The lock file itself
+    is kept.
+    """
+
+    def __init__(self, path: str):
+        """
+        Parameter:
+            path (str): the lock file, it is created if necessary
+        """
+        self._path = path
+        self._file = None
+
+    def acquire(self):
+        """
+        Acquire the lock, block until the current holder releases it.
+        """
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        self._file = open(self._path, "a+")
+        # msvcrt locks the bytes from the current position
+        self._file.seek(0)
+        if not self._try_lock():
+            log(f"Waiting for the lock {self._path}")
+            self._lock()
+
+    def _try_lock(self) -> bool:
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _lock(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            return
+        # LK_LOCK gives up after 10 seconds
+        while True:
+            try:
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+    def release(self):
+        """
+        Release the lock.
+        """
+        if self._file is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,78 @@
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas.core.frame import DataFrame
+
+from db.DBConnector import execute_query
+from db.QueryBuilder import get_metrics_level, get_table_rows, \
+    instance_reference
+from utils.log import log
+
+"""
+A local store of the metric tables.
+
+Instead of caching the metrics of the instances once per query, each metric
+table is fetched and cached only once, with all its rows indexed by their id.
+The instance queries select the ids of the metric rows instead of the metrics,
+see QueryBuilder.get_level_refactorings(references_only=True), and the
+metrics are joined locally by looking up these ids.
+
+Note:
+    In order to use this feature, enable USE_LOCAL_STORE in the config.
+"""
+
+# the metric tables loaded by this process, by table name
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def load_table(table_name: str) -> DataFrame:
+    """
+    Get all rows of the given metric table, indexed by their id.
+    The table is fetched from the db only once and then read from the cache.
+
+    Parameter:
+        table_name (str): the metric table, e.g. ClassMetric
+    """
+    with _tables_lock:
+        if table_name not in _tables:
+            log(f"Load the table {table_name} into the local store.")
+            _tables[table_name] = execute_query(get_table_rows(table_name))
+        return _tables[table_name]
+
+
+def join_metrics(instances: DataFrame, level: int) -> DataFrame:
+    """
+    Replace the metric row ids of the given instances with the metrics of the
+    given level. Instances referencing a missing metric row are dropped, like
+    with the inner joins of the db.
+
+    Parameter:
+        instances (DataFrame): the instances with their metric row ids, e.g.
+         the result of QueryBuilder.get_level_stable(references_only=True)
+        level (int): join the metrics of this level
+
+    Returns:
+        the instances with the same columns as the instance query without
+        references_only
+    """
+    metric_tables = get_metrics_level(level)
+    references = [instance_reference(table_name)
+                  for table_name, _ in metric_tables]
+    keep = np.ones(len(instances.index), dtype=bool)
+    positions = []
+    for table_name, _ in metric_tables:
+        ids = instances[instance_reference(table_name)]
+        ids = ids.fillna(-1).to_numpy(dtype=np.int64)
+        table_positions = load_table(table_name).index.get_indexer(ids)
+        keep &= table_positions >= 0
+        positions.append(table_positions)
+
+    if not keep.all():
+        log(f"Dropped {(~keep).sum()} instances without metrics in the local store.")
+    index = instances.index[keep]
+    metrics = [load_table(table_name).iloc[table_positions[keep]].set_axis(index)
+               for (table_name, _), table_positions in zip(metric_tables, positions)]
+    return pd.concat(
+        [instances.loc[keep].drop(columns=references)] + metrics, axis=1)
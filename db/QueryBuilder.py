@@ -1,5 +1,6 @@
+import re
 from typing import Iterable
-from configs import FILE_TYPE, CLASS_METRICS_Fields, METHOD_METRICS_FIELDS, \
+from configs import SEED, FILE_TYPE, CLASS_METRICS_Fields, METHOD_METRICS_FIELDS, \
     VARIABLE_METRICS_FIELDS, FIELD_METRICS_FIELDS, PROCESS_METRICS_FIELDS,\
     COMMIT_METADATA_FIELDS, PROJECT_FIELDS, REFACTORING_COMMIT_FIELDS, \
     STABLE_COMMIT_FIELDS, FileType
@@ -61,14 +62,31 @@ tableMap = {
 # region tables utils
 # returns a sql condition to join instances with the given table
 def join_table(instance_name: str, table_name: str) -> str:
-    join_collumn = tableMap[table_name][0]
-
     return " INNER JOIN " + table_name + \
-           " ON " + instance_name + "." + \
-           join_collumn[0].lower() + join_collumn[1:] + \
+           " ON " + instance_name + "." + instance_reference(table_name) + \
         " = " + table_name + ".id"
 
 
+# returns the column of the instances referencing the given table,
+# e.g. classMetrics_id for ClassMetric
+def instance_reference(table_name: str) -> str:
+    join_collumn = tableMap[table_name][0]
+    return join_collumn[0].lower() + join_collumn[1:]
+
+
+def get_level_references(level: int):
+    """
+    Get the columns of the instances referencing the metric tables of the
+    given level, e.g. classMetrics_id, methodMetrics_id and processMetrics_id
+    for level 2 method level
+
+    Parameters:
+        level (int):   get the references for this level
+    """
+    return [instance_reference(table_name)
+            for table_name, _ in get_metrics_level(level)]
+
+
 def get_metrics_level(level: int):
     """
     Get a list of all metrics for the given level, e.g. classMetricsFields,
@@ -212,7 +230,8 @@ def get_level_refactorings(
         level: int,
         m_refactoring: str,
         datasets: Iterable[str] = [],
-        projects: Iterable[str] = []) -> str:
+        projects: Iterable[str] = [],
+        references_only: bool = False) -> str:
     """
     Get all refactoring instances with the given refactoring type and metrics in regard to the level
 
@@ -220,6 +239,8 @@ def get_level_refactorings(
         level (int):                    the refactoring instances are filtered for this level
         m_refactoring (str) (optional): filter for a specific refactoring type, e.g. "Push Down Attribute"
         dataset (str) (optional):       filter the project dataset for this
+        references_only (bool) (optional):  select the ids of the metric rows instead of the metrics,
+                                        see db.LocalStore
     """
     # only select valid refactorings from the database, if refactorings are
     # selected
@@ -229,9 +250,9 @@ def get_level_refactorings(
         refactoring_condition += f" AND {refactoringCommits}.refactoring = \"{m_refactoring}\""
     return get_instance_fields(instance_name=refactoringCommits,
                                fields=[(refactoringCommits,
-                                        []),
+                                        get_level_references(level) if references_only else []),
                                        (commitMetaData,
-                                        [])] + get_metrics_level(level),
+                                        [])] + _level_metrics(level, references_only),
                                conditions=refactoring_condition,
                                datasets=datasets,
                                get_instance_id=True,
@@ -243,7 +264,9 @@ def get_level_stable(
         commit_threshold: int,
         dataset: Iterable[str],
         conditions: str = "",
-        projects: Iterable[str] = []) -> str:
+        projects: Iterable[str] = [],
+        references_only: bool = False,
+        sample_fraction: float = 1.0) -> str:
     """
     Get all stable instances with the given level and the corresponding metrics
 
@@ -253,18 +276,109 @@ def get_level_stable(
         dataset (str) (optional):       filter the project dataset for this
         conditions (str) (optional):    additional sql conditions for this refactoring, e.g. (commitDate BETWEEN A and B).
                                         DON'T add filter for the level or test; this is already done.
+        references_only (bool) (optional):  select the ids of the metric rows instead of the metrics,
+                                        see db.LocalStore
+        sample_fraction (float) (optional): only select a reproducible sample of about this fraction
+                                        of the instances, see sample_filter
+    """
+    threshold_condition = f"{stableCommits}.commitThreshold = {commit_threshold}"
+    if sample_fraction < 1:
+        threshold_condition += f" AND {sample_filter(stableCommits, sample_fraction)}"
+    return _level_stable(
+        level,
+        threshold_condition,
+        [],
+        dataset,
+        conditions,
+        projects,
+        references_only)
+
+
+def get_level_stable_count(
+        level: int,
+        commit_threshold: int,
+        dataset: Iterable[str],
+        projects: Iterable[str] = []) -> str:
+    """
+    Get the count of all stable instances returned by get_level_stable
+
+    Parameters:
+        level (int):                    count the stable instances for this level
+        commit_threshold (int):    filter for this specific commit threshold
+        dataset (str) (optional):       filter the project dataset for this
+    """
+    return "SELECT COUNT(*) AS total FROM (" + \
+        get_level_stable(level, commit_threshold, dataset, projects=projects, references_only=True) + \
+        ") t"
+
+
+def sample_filter(instance_name: str, fraction: float) -> str:
+    """
+    Get a filter to select a sample of about the given fraction of the instances.
+    The instances are selected by a hash of their id, seeded with SEED, thus the sample is reproducible
+    and the sample of a smaller fraction is a subset of the sample of a larger fraction.
+
+    Parameter:
+        instance_name (str): name of the instance table to sample, e.g. StableCommit
+        fraction (float): the fraction of the instances to select, between 0 and 1
     """
+    # multiplicative hashing, a bijection on the ids modulo 2^32
+    threshold = int(fraction * 4294967296)
+    return f"((({instance_name}.id + {SEED}) * 2654435761) % 4294967296) < {threshold}"
+
+
+def get_level_stable_thresholds(
+        level: int,
+        commit_thresholds: Iterable[int],
+        dataset: Iterable[str],
+        conditions: str = "",
+        projects: Iterable[str] = [],
+        references_only: bool = False) -> str:
+    """
+    Get all stable instances with the given level and the corresponding metrics
+    for several commit thresholds at once. The commitThreshold of each instance
+    is selected as well, in order to split the result per threshold,
+    see DBConnector.cache_partitioned_query.
+
+    Parameters:
+        level (int):                    get the stable instances for this level
+        commit_thresholds (Iterable[int]):  filter for these commit thresholds
+        dataset (str) (optional):       filter the project dataset for this
+        conditions (str) (optional):    additional sql conditions, see get_level_stable
+        references_only (bool) (optional):  see get_level_stable
+    """
+    thresholds = ", ".join(str(k) for k in commit_thresholds)
+    return _level_stable(
+        level,
+        f"{stableCommits}.commitThreshold IN ({thresholds})",
+        ["commitThreshold"],
+        dataset,
+        conditions,
+        projects,
+        references_only)
+
+
+def _level_stable(
+        level: int,
+        threshold_condition: str,
+        stable_fields: Iterable[str],
+        dataset: Iterable[str],
+        conditions: str,
+        projects: Iterable[str],
+        references_only: bool = False) -> str:
     # only select valid refactorings from the database, if refactorings are
     # selected
-    stable_condition: str = f"{stableCommits}.commitThreshold = {commit_threshold} AND {__stable_level_filter(level)} AND {file_type_filter(stableCommits)}"
+    stable_condition: str = f"{threshold_condition} AND {__stable_level_filter(level)} AND {file_type_filter(stableCommits)}"
 
     if len(conditions) > 0:
         stable_condition += f" AND {conditions} AND {methodMetrics}.methodLoc > 5"
+    if references_only:
+        stable_fields = list(stable_fields) + get_level_references(level)
     return get_instance_fields(stableCommits,
                                [(stableCommits,
-                                 []),
+                                 stable_fields),
                                    (commitMetaData,
-                                    [])] + get_metrics_level(level),
+                                    [])] + _level_metrics(level, references_only),
                                stable_condition,
                                dataset,
                                "",
@@ -272,6 +386,48 @@ def get_level_stable(
                                projects=projects)
 
 
+def _level_metrics(level: int, references_only: bool):
+    # without the metric fields the metric tables are still joined, thus the
+    # query selects the same instances and the conditions can use the metrics
+    if references_only:
+        return [(table_name, []) for table_name, _ in get_metrics_level(level)]
+    return get_metrics_level(level)
+
+
+def get_table_rows(table_name: str) -> str:
+    """
+    Get all rows of the given table with their fields, indexed by their id,
+    e.g. all rows of ClassMetric
+
+    Parameter:
+        table_name (str): the table to select, e.g. ClassMetric
+    """
+    fields = ", ".join(f"{table_name}.{field_name}" for field_name in tableMap[table_name][1])
+    return f"SELECT {table_name}.id AS `index`, {fields} FROM {table_name}"
+
+
+def get_delta_query(sql_query: str, last_id: int) -> str:
+    """
+    Restrict a query to the rows added after the given id, e.g. to refresh a
+    cached instance query with the instances added to the db since.
+    The rows are identified by the id of the first table of the query, e.g.
+    StableCommit for get_level_stable.
+
+    Parameter:
+        sql_query (str): an instance query, e.g. from get_level_stable, or a
+         query from get_table_rows
+        last_id (int): only select rows with a larger id
+    """
+    if re.search(r"\b(GROUP|ORDER) BY\b|\bLIMIT\b", sql_query, re.IGNORECASE):
+        raise ValueError(f"Cannot restrict an aggregated or ordered query to new rows: {sql_query}")
+    table_name = re.search(r"\bFROM (\w+)", sql_query).group(1)
+    delta_condition = f"{table_name}.id > {int(last_id)}"
+    select, where, conditions = sql_query.partition(" WHERE ")
+    if len(where) == 0:
+        return f"{sql_query} WHERE {delta_condition}"
+    return f"{select} WHERE {delta_condition} AND ({conditions})"
+
+
 def file_type_filter(instance_name: str) -> str:
     """
     Add restriction whether to use only production, test or both files
@@ -298,6 +454,36 @@ def valid_refactorings_filter(instance_name: str) -> str:
         return ""
 
 
+def get_instance_counts(datasets: Iterable[str]) -> str:
+    """
+    Count the valid refactoring instances per level, refactoring type and dataset and the stable instances per
+    level, commit threshold and dataset, with a single query. The metrics are not joined, thus the counts are an
+    upper bound of the instances returned by get_level_refactorings and get_level_stable.
+
+    Parameter:
+        datasets (Iterable[str]): count the instances of these datasets
+
+    Returns:
+        a query for the columns kind (refactoring or stable), level, refactoring, commitThreshold, datasetName
+        and total
+    """
+    dataset_filter = "datasetName IN (" + ','.join([f'"{dataset}"' for dataset in datasets]) + ")"
+    refactoring_conditions = " AND ".join(condition for condition in [
+        valid_refactorings_filter(refactoringCommits), file_type_filter(refactoringCommits), dataset_filter]
+        if len(condition) > 0)
+    stable_conditions = " AND ".join(condition for condition in [
+        file_type_filter(stableCommits), dataset_filter] if len(condition) > 0)
+    return f"SELECT 'refactoring' AS kind, {refactoringCommits}.`level`, {refactoringCommits}.refactoring, " \
+           f"NULL AS commitThreshold, datasetName, COUNT(*) AS total " \
+           f"FROM {refactoringCommits}{join_table(refactoringCommits, project)} WHERE {refactoring_conditions} " \
+           f"GROUP BY {refactoringCommits}.`level`, {refactoringCommits}.refactoring, datasetName " \
+           f"UNION ALL " \
+           f"SELECT 'stable' AS kind, {stableCommits}.`level`, NULL AS refactoring, " \
+           f"{stableCommits}.commitThreshold, datasetName, COUNT(*) AS total " \
+           f"FROM {stableCommits}{join_table(stableCommits, project)} WHERE {stable_conditions} " \
+           f"GROUP BY {stableCommits}.`level`, {stableCommits}.commitThreshold, datasetName"
+
+
 def get_level_refactorings_count(level: int, dataset: str = "") -> str:
     """
     Get the count of all refactorings for the given level
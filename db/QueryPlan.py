@@ -0,0 +1,182 @@
+import json
+import re
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+from db.QueryBuilder import tableMap
+
+"""
+Query plans of the cached queries and an index advisor.
+
+With CAPTURE_QUERY_PLANS each query fetched for the cache is explained first,
+its plan and the execute and fetch times of the cursor are recorded in the
+cache catalog. The advisor
+derives the columns each query filters for equality per table, e.g.
+(level, isValid, isTest, refactoring) of RefactoringCommit, and suggests a
+composite index for them, unless an existing index already starts with these
+columns. Suggestions are ranked by the time of the queries they could speed
+up and flagged, if the plans show a full scan of the table.
+"""
+
+# the explain statement of each backend, it returns the plan as text
+_EXPLAIN = {
+    "mysql": "EXPLAIN FORMAT=JSON ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "duckdb": "EXPLAIN (FORMAT json) "}
+
+# an equality filter on a column, e.g. StableCommit.`level` = 1 or
+# datasetName IN ("a", "b"), the table is optional
+_EQUALITY = re.compile(
+    r"(?:\b(\w+)\.)?`?(\w+)`?\s*(?:=\s*(?:\"[^\"]*\"|'[^']*'|[\w.-]+)|\bIN\s*\()",
+    re.IGNORECASE)
+# the join conditions, e.g. ON StableCommit.project_id = project.id
+_JOIN = re.compile(r"\bON\s+\w+\.\w+\s*=\s*\w+\.\w+", re.IGNORECASE)
+
+
+def explain(cnx, sql_query: str, backend: str) -> str:
+    """
+    Get the plan of the query on the given connection.
+
+    Parameter:
+        cnx: an open db connection
+        sql_query (str): the query in the dialect of the backend
+        backend (str): mysql, sqlite or duckdb
+    """
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(_EXPLAIN[backend] + sql_query)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    if backend == "sqlite":
+        # (id, parent, not used, detail), e.g. SCAN StableCommit
+        return "\n".join(row[3] for row in rows)
+    # a single row with the json plan, duckdb returns (type, plan)
+    return rows[0][-1]
+
+
+def full_scans(plan: str, backend: str) -> List[str]:
+    """
+    Get the tables the plan reads completely.
+    """
+    if backend == "sqlite":
+        return re.findall(r"^SCAN (?:TABLE )?(\w+)", plan, re.MULTILINE)
+    tables = []
+    for node in _nodes(json.loads(plan)):
+        if backend == "mysql" and node.get("access_type") == "ALL":
+            tables.append(node.get("table_name"))
+        elif backend == "duckdb" and \
+                str(node.get("name", "")).strip() == "SEQ_SCAN":
+            table = node.get("extra_info", {}).get("Table", "")
+            tables.append(table.split(".")[-1])
+    return tables
+
+
+def _nodes(plan):
+    # all objects of a json plan
+    if isinstance(plan, dict):
+        yield plan
+        plan = list(plan.values())
+    if isinstance(plan, list):
+        for child in plan:
+            yield from _nodes(child)
+
+
+# maps unqualified fields onto their table, e.g. datasetName onto project
+_FIELD_TABLES = {field: table_name
+                 for table_name, (_, fields) in tableMap.items()
+                 for field in fields}
+
+
+def filtered_columns(sql_query: str) -> Dict[str, List[str]]:
+    """
+    Get the columns the query filters for equality, per table and in the
+    order of the query, e.g. {"StableCommit": ["commitThreshold", "level", "isTest"]}
+    """
+    columns = OrderedDict()
+    for table_name, column in _EQUALITY.findall(_JOIN.sub("", sql_query)):
+        if len(table_name) == 0:
+            table_name = _FIELD_TABLES.get(column)
+        if table_name is None or column.upper() in ["AND", "OR", "WHERE"]:
+            continue
+        table_columns = columns.setdefault(table_name, [])
+        if column not in table_columns:
+            table_columns.append(column)
+    return columns
+
+
+def is_covered(columns: List[str], indexes: Iterable[List[str]]) -> bool:
+    """
+    Check if one of the indexes starts with the given columns, in any order.
+    """
+    return any(set(index[:len(columns)]) == set(columns) for index in indexes)
+
+
+def suggest_indexes(
+        queries: Iterable[Tuple[str, float, str, str]],
+        indexes: Dict[str, List[List[str]]]):
+    """
+    Suggest composite indexes for the equality filters of the queries.
+
+    Parameter:
+        queries (Iterable): (query, db time in seconds, plan, backend)
+         tuples, the plan and time might be None
+        indexes (dict): the columns of the existing indexes of each table,
+         see existing_indexes
+    Returns:
+        a list of dicts with table, columns, the number of queries and their
+        total time and whether a plan shows a full scan of the table,
+        the slowest first
+    """
+    suggestions = {}
+    for sql_query, seconds, plan, backend in queries:
+        scanned = full_scans(plan, backend) if plan else []
+        for table_name, columns in filtered_columns(sql_query).items():
+            if is_covered(columns, indexes.get(table_name, [])):
+                continue
+            suggestion = suggestions.setdefault(
+                (table_name, tuple(columns)),
+                {"table": table_name, "columns": columns, "queries": 0,
+                 "seconds": 0.0, "full_scan": False})
+            suggestion["queries"] += 1
+            suggestion["seconds"] += seconds or 0.0
+            suggestion["full_scan"] |= table_name in scanned
+    return sorted(suggestions.values(),
+                  key=lambda s: (s["seconds"], s["queries"]), reverse=True)
+
+
+def create_index_statement(table_name: str, columns: List[str]) -> str:
+    return f"CREATE INDEX idx_{table_name}_{'_'.join(columns)} " \
+           f"ON {table_name} ({', '.join(f'`{column}`' for column in columns)});"
+
+
+def existing_indexes(cnx, backend: str, table_name: str) -> List[List[str]]:
+    """
+    Get the columns of all indexes of the table, in index order.
+    """
+    cursor = cnx.cursor()
+    try:
+        if backend == "mysql":
+            cursor.execute(f"SHOW INDEX FROM `{table_name}`")
+            names = [column[0] for column in cursor.description]
+            indexes = OrderedDict()
+            for row in cursor.fetchall():
+                row = dict(zip(names, row))
+                indexes.setdefault(row["Key_name"], []).append(
+                    (row["Seq_in_index"], row["Column_name"]))
+            return [[column for _, column in sorted(index)]
+                    for index in indexes.values()]
+        elif backend == "sqlite":
+            cursor.execute(f'PRAGMA index_list("{table_name}")')
+            index_names = [row[1] for row in cursor.fetchall()]
+            indexes = []
+            for index_name in index_names:
+                cursor.execute(f'PRAGMA index_info("{index_name}")')
+                indexes.append([row[2] for row in sorted(cursor.fetchall())])
+            return indexes
+        cursor.execute(
+            "SELECT expressions FROM duckdb_indexes() WHERE table_name = ?",
+            [table_name])
+        return [re.findall(r"\w+", str(row[0])) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
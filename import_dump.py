@@ -0,0 +1,204 @@
+import argparse
+import gzip
+import os
+import re
+import time
+
+import pandas as pd
+
+from configs import DB_BACKEND, EMBEDDED_DB_PATH
+from db import EmbeddedBackend
+
+"""
+Import the mysql dump of the refactoring db, e.g. the dump published on
+Zenodo, into an embedded SQLite or DuckDB file. Afterwards the ml pipeline
+runs without a db server, set DB_BACKEND and EMBEDDED_DB_PATH in configs.py.
+
+Examples:
+    python3 import_dump.py refactoring-dump.sql.gz
+    python3 import_dump.py refactoring-dump.sql --backend duckdb --db refactoring.duckdb
+
+The importer reads the CREATE TABLE and INSERT statements of the dump as
+written by mysqldump, all other statements are skipped. The indexes of the
+tables are created after all rows were imported.
+"""
+
+# maps the mysql column types onto the types of the embedded dbs
+_TYPES = [
+    (r"^(bit\(1\)|tinyint\(1\)|bool|boolean)", "SMALLINT"),
+    (r"^(tinyint|smallint|mediumint|int|integer)\b", "INTEGER"),
+    (r"^bigint\b", "BIGINT"),
+    (r"^(float|double|real|decimal|numeric)\b", "DOUBLE"),
+    (r"^(date|datetime|timestamp)\b", "TIMESTAMP"),
+]
+
+# the values of an extended insert, see _parse_values
+_VALUE = re.compile(r"""
+    (?P<open>\() |
+    (?P<close>\)) |
+    (?P<string>(?:_binary\s*)?'(?:[^'\\]|\\.|'')*') |
+    (?P<bits>b'[01]*') |
+    (?P<hex>0x[0-9A-Fa-f]+) |
+    (?P<null>NULL) |
+    (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?) |
+    (?P<separator>[,;\s]+)
+    """, re.VERBOSE)
+
+_ESCAPES = {"0": "\0", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a",
+            "b": "\b"}
+
+
+def _column_type(mysql_type: str) -> str:
+    for pattern, column_type in _TYPES:
+        if re.match(pattern, mysql_type, re.IGNORECASE):
+            return column_type
+    return "VARCHAR"
+
+
+def _unquote(literal: str) -> str:
+    literal = literal[literal.index("'") + 1:-1]
+    return re.sub(r"\\(.)|''",
+                  lambda m: _ESCAPES.get(m.group(1), m.group(1)) if m.group(1) else "'",
+                  literal)
+
+
+def parse_create_table(statement: str):
+    """
+    Parse a CREATE TABLE statement of mysqldump.
+
+    Returns:
+        the table name, a list of (column, type) tuples and a list of
+        (index name, unique, columns) tuples
+    """
+    table_name = re.search(r"CREATE TABLE `([^`]+)`", statement).group(1)
+    columns, indexes = [], []
+    for line in statement.splitlines()[1:]:
+        line = line.strip().rstrip(",")
+        column = re.match(r"`([^`]+)` (\S+)", line)
+        key = re.match(r"(?:UNIQUE )?KEY `([^`]+)` \(([^)]+)\)", line)
+        if column:
+            columns.append((column.group(1), _column_type(column.group(2))))
+        elif line.startswith("PRIMARY KEY"):
+            indexes.append((f"{table_name}_pk", True, _key_columns(line)))
+        elif key:
+            indexes.append((f"{table_name}_{key.group(1)}",
+                            line.startswith("UNIQUE"), _key_columns(line)))
+    return table_name, columns, indexes
+
+
+def _key_columns(line: str):
+    # e.g. KEY `FK1` (`project_id`,`level`) or with prefix lengths (`name`(20))
+    return re.findall(r"`([^`]+)`(?:\(\d+\))?", line[line.index("("):])
+
+
+def _parse_values(values: str):
+    """
+    Parse the rows of an extended insert, e.g. (1,'a',NULL),(2,'b',0.5);
+    """
+    rows, row = [], None
+    for match in _VALUE.finditer(values):
+        kind = match.lastgroup
+        token = match.group()
+        if kind == "open":
+            row = []
+        elif kind == "close":
+            rows.append(tuple(row))
+        elif kind == "string":
+            value = _unquote(token)
+            if token.startswith("_binary") and value in ["\0", "\x01"]:
+                # a bit(1) value
+                value = ord(value)
+            row.append(value)
+        elif kind == "bits":
+            row.append(int(token[2:-1] or "0", 2))
+        elif kind == "hex":
+            row.append(int(token, 16))
+        elif kind == "null":
+            row.append(None)
+        elif kind == "number":
+            row.append(float(token) if re.search(r"[.eE]", token) else int(token))
+    return rows
+
+
+def _statements(dump_path: str):
+    # mysqldump ends each statement at the end of a line and escapes the
+    # line breaks of strings
+    opener = gzip.open if dump_path.endswith(".gz") else open
+    with opener(dump_path, "rt", encoding="utf-8", errors="replace") as dump:
+        statement = []
+        for line in dump:
+            if len(statement) == 0 and (line.startswith("--") or len(line.strip()) == 0):
+                continue
+            statement.append(line)
+            if line.rstrip().endswith(";"):
+                yield "".join(statement)
+                statement = []
+
+
+def _insert(cnx, backend: str, table_name: str, columns, rows):
+    if backend == "duckdb":
+        cnx.register("dump_rows", pd.DataFrame.from_records(
+            rows, columns=[name for name, _ in columns]))
+        cnx.execute(f'INSERT INTO "{table_name}" SELECT * FROM dump_rows')
+        cnx.unregister("dump_rows")
+    else:
+        placeholders = ", ".join("?" for _ in columns)
+        cnx.executemany(
+            f'INSERT INTO "{table_name}" VALUES ({placeholders})', rows)
+
+
+def import_dump(dump_path: str, backend: str, db_path: str):
+    """
+    Import the tables of a mysql dump into an embedded db.
+
+    Parameter:
+        dump_path (str): the dump, either plain or gzip compressed (.gz)
+        backend (str): the embedded db, either sqlite or duckdb
+        db_path (str): the db file, existing tables are replaced
+    """
+    cnx = EmbeddedBackend.connect(backend, db_path, read_only=False)
+    tables, indexes = {}, []
+    row_count, start_time = 0, time.time()
+    try:
+        for statement in _statements(dump_path):
+            if statement.startswith("CREATE TABLE"):
+                table_name, columns, table_indexes = parse_create_table(statement)
+                print(("\n" if row_count > 0 else "") + f"Import table {table_name}")
+                cnx.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+                cnx.execute(f'CREATE TABLE "{table_name}" (' + ", ".join(
+                    f'"{name}" {column_type}' for name, column_type in columns) + ")")
+                tables[table_name] = columns
+                indexes += [(table_name,) + index for index in table_indexes]
+            elif statement.startswith("INSERT INTO"):
+                table_name = re.match(r"INSERT INTO `([^`]+)`", statement).group(1)
+                rows = _parse_values(statement[statement.index(" VALUES ") + 8:])
+                _insert(cnx, backend, table_name, tables[table_name], rows)
+                row_count += len(rows)
+                print(f"\r{row_count} rows imported", end="", flush=True)
+        print()
+        for table_name, name, unique, index_columns in indexes:
+            print(f"Create index {name}")
+            cnx.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS "{name}" ON "{table_name}" (' +
+                        ", ".join(f'"{column}"' for column in index_columns) + ")")
+        cnx.commit()
+    finally:
+        cnx.close()
+    print(f"Imported {len(tables)} tables with {row_count} rows into {db_path} "
+          f"in {time.time() - start_time:.0f} seconds.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import a mysql dump of the refactoring db into an embedded db.")
+    parser.add_argument("dump", help="the mysql dump, e.g. dump.sql or dump.sql.gz")
+    parser.add_argument(
+        "--backend", choices=EmbeddedBackend.BACKENDS,
+        default=DB_BACKEND if DB_BACKEND in EmbeddedBackend.BACKENDS else "sqlite",
+        help="the embedded db, default: DB_BACKEND of the config or sqlite")
+    parser.add_argument(
+        "--db", default=EMBEDDED_DB_PATH,
+        help="the db file, default: EMBEDDED_DB_PATH of the config")
+    arguments = parser.parse_args()
+    if not os.path.exists(arguments.dump):
+        parser.error(f"No dump at {arguments.dump}")
+    import_dump(arguments.dump, arguments.backend, arguments.db)
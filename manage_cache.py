@@ -0,0 +1,179 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from configs import DB_POOL_SIZE
+from db import CacheCatalog, QueryPlan
+from db.DBConnector import refresh_query, close_connection, table_indexes
+
+"""
+List, inspect and prune the query cache.
+
+Examples:
+    python3 manage_cache.py list
+    python3 manage_cache.py inspect <query hash>
+    python3 manage_cache.py prune --max-size-gb 50
+    python3 manage_cache.py prune --unused-days 30 --incomplete
+    python3 manage_cache.py refresh
+    python3 manage_cache.py indexes
+
+Cache files written before the catalog existed are registered with `sync`,
+their query is unknown.
+
+`refresh` appends the instances added to the db since an entry was cached,
+see DBConnector.refresh_query, instead of rebuilding the cache.
+
+`indexes` suggests indexes for the cached queries, with the plans and times
+recorded with CAPTURE_QUERY_PLANS, see QueryPlan.
+"""
+
+
+def _format_time(timestamp) -> str:
+    if timestamp is None:
+        return "-"
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp))
+
+
+def list_entries(args):
+    entries = CacheCatalog.entries()
+    # the size of the cache files with their derived files
+    entries["bytes"] = entries["bytes"].fillna(0) + [
+        CacheCatalog.derived_bytes(file_path) if file_path is not None else 0
+        for file_path in entries["file_path"]]
+    print(f"{'query hash':<40}  {'rows':>10}  {'cols':>4}  {'MB':>9}  "
+          f"{'created':<16}  {'last access':<16}  complete  query")
+    for query_hash, entry in entries.iterrows():
+        size = entry["bytes"] / 1024 ** 2
+        query = (entry["query"] or "unknown")[:args.width]
+        print(f"{query_hash:<40}  {entry['rows'] or 0:>10.0f}  "
+              f"{entry['columns'] or 0:>4.0f}  {size:>9.1f}  "
+              f"{_format_time(entry['created_at']):<16}  "
+              f"{_format_time(entry['last_access']):<16}  "
+              f"{'yes' if entry['complete'] else 'no':<8}  {query}")
+    total = entries["bytes"].sum() / 1024 ** 3
+    print(f"{len(entries.index)} entries, {total:.2f} GB")
+
+
+def inspect_entry(args):
+    entries = CacheCatalog.entries()
+    if args.query_hash not in entries.index:
+        print(f"No cache entry {args.query_hash}")
+        return
+    entry = entries.loc[args.query_hash]
+    for column, value in entry.items():
+        if column in ["created_at", "last_access"]:
+            value = _format_time(value)
+        print(f"{column}:\n  {value}")
+
+
+def prune(args):
+    entries = CacheCatalog.entries()
+    if args.incomplete:
+        for query_hash in entries.index[entries["complete"] != 1]:
+            print(f"Remove incomplete entry {query_hash}")
+            CacheCatalog.remove_entry(query_hash)
+        CacheCatalog.remove_temp_files()
+    if args.unused_days is not None:
+        unused_since = time.time() - args.unused_days * 24 * 60 * 60
+        for query_hash in entries.index[
+                (entries["complete"] == 1) &
+                (entries["last_access"] < unused_since)]:
+            print(f"Remove unused entry {query_hash}")
+            CacheCatalog.remove_entry(query_hash)
+    if args.max_size_gb is not None:
+        CacheCatalog.evict(int(args.max_size_gb * 1024 ** 3))
+
+
+def refresh(args):
+    entries = CacheCatalog.entries()
+    entries = entries[(entries["complete"] == 1) & entries["query"].notna()]
+    if len(args.query_hashes) > 0:
+        entries = entries[entries.index.isin(args.query_hashes)]
+    executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE)
+    try:
+        added = executor.map(refresh_query, entries["query"])
+        for query_hash, rows in zip(entries.index, added):
+            print(f"{query_hash}: {rows} new rows")
+    finally:
+        executor.shutdown()
+        close_connection()
+
+
+def indexes(args):
+    entries = CacheCatalog.entries()
+    entries = entries[entries["query"].notna()]
+    # the db time of each query, with the fetch of its rows
+    seconds = entries["query_seconds"].fillna(0) + \
+        entries["fetch_seconds"].fillna(0)
+    queries = list(zip(entries["query"], seconds,
+                       entries["plan"], entries["plan_backend"]))
+    tables = set(table_name for sql_query in entries["query"]
+                 for table_name in QueryPlan.filtered_columns(sql_query))
+    try:
+        existing = table_indexes(tables)
+    finally:
+        close_connection()
+    suggestions = QueryPlan.suggest_indexes(queries, existing)
+    if len(suggestions) == 0:
+        print("The existing indexes cover the filters of all cached queries.")
+    for suggestion in suggestions:
+        print(f"-- {suggestion['queries']} queries, "
+              f"{suggestion['seconds']:.1f} seconds"
+              f"{', full table scan' if suggestion['full_scan'] else ''}")
+        print(QueryPlan.create_index_statement(
+            suggestion["table"], suggestion["columns"]))
+
+
+def sync(args):
+    CacheCatalog.sync()
+    print(f"Synced the catalog at {CacheCatalog.CATALOG_PATH}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the query cache.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = commands.add_parser(
+        "list", help="list all cache entries, least recently used first")
+    list_parser.add_argument(
+        "--width", type=int, default=80, help="truncate the queries")
+    list_parser.set_defaults(run=list_entries)
+
+    inspect_parser = commands.add_parser(
+        "inspect", help="show the query and schema of a cache entry")
+    inspect_parser.add_argument("query_hash")
+    inspect_parser.set_defaults(run=inspect_entry)
+
+    prune_parser = commands.add_parser(
+        "prune", help="delete cache entries")
+    prune_parser.add_argument(
+        "--max-size-gb", type=float,
+        help="evict least recently used entries down to this size")
+    prune_parser.add_argument(
+        "--unused-days", type=float,
+        help="delete entries not used for this many days")
+    prune_parser.add_argument(
+        "--incomplete", action="store_true",
+        help="delete entries and temporary files whose write did not "
+             "finish, make sure no other process is filling the cache")
+    prune_parser.set_defaults(run=prune)
+
+    refresh_parser = commands.add_parser(
+        "refresh", help="fetch the rows added to the db since the entries "
+                        "were cached")
+    refresh_parser.add_argument(
+        "query_hashes", nargs="*",
+        help="only refresh these entries, default: all complete entries")
+    refresh_parser.set_defaults(run=refresh)
+
+    indexes_parser = commands.add_parser(
+        "indexes", help="suggest db indexes for the filters of the cached "
+                        "queries")
+    indexes_parser.set_defaults(run=indexes)
+
+    sync_parser = commands.add_parser(
+        "sync", help="register untracked cache files, drop deleted ones")
+    sync_parser.set_defaults(run=sync)
+
+    arguments = parser.parse_args()
+    arguments.run(arguments)
@@ -3,6 +3,8 @@ from typing import Dict
 
 from sklearn.base import BaseEstimator
 
+from ml.search.distributions import Categorical
+
 
 class MLModel(ABC):
     def name(self) -> str:
@@ -23,6 +25,8 @@ class SupervisedMLRefactoringModel(MLModel):
     If params is passed, with the configured params.
     - persist: Persists the best found estimator as well as the final model.
     - feature_reduction: Should we perform feature reduction for this model?
+    - halving_resource: The resource of the halving searches (optional).
+    - search_space: The distributions of the bayesian search (optional).
 
     Note: Whenever you create a new model,
     do not forget to add it to `builder.py`.
@@ -39,3 +43,21 @@ class SupervisedMLRefactoringModel(MLModel):
     @abstractmethod
     def model(self, params: Dict[str, any] = None) -> BaseEstimator:
         ...
+
+    def halving_resource(self) -> str:
+        """
+        The resource of the halving searches, all candidates start with a
+        small amount of it and only the best candidates get more.
+        Either "n_samples" or a parameter of params_to_tune, e.g. n_estimators,
+        its smallest and largest value are the min and max resource.
+        """
+        return "n_samples"
+
+    def search_space(self) -> Dict[str, any]:
+        """
+        The distributions of the parameters for the bayesian search, by
+        default a Categorical of each list of params_to_tune.
+        Override it with Float and Integer distributions for numeric params.
+        """
+        return {name: Categorical(values)
+                for name, values in self.params_to_tune().items()}
@@ -4,6 +4,7 @@ from sklearn.linear_model import LogisticRegression
 
 from configs import CORE_COUNT, SEED
 from ml.models.base import SupervisedMLRefactoringModel
+from ml.search.distributions import Float, Integer
 
 
 class LogisticRegressionRefactoringModel(SupervisedMLRefactoringModel):
@@ -15,6 +16,10 @@ class LogisticRegressionRefactoringModel(SupervisedMLRefactoringModel):
             "max_iter": [100, 500, 1000, 2000, 5000, 10000],
             "C": [uniform(0.01, 100) for i in range(0, 5)]}
 
+    def search_space(self):
+        return {"max_iter": Integer(100, 10000, log=True),
+                "C": Float(0.01, 100, log=True)}
+
     def model(self, best_params=None):
         if best_params is not None:
             return LogisticRegression(
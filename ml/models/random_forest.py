@@ -2,6 +2,7 @@ from sklearn.ensemble import RandomForestClassifier
 
 from configs import CORE_COUNT, SEED
 from ml.models.base import SupervisedMLRefactoringModel
+from ml.search.distributions import Integer
 
 
 class RandomForestRefactoringModel(SupervisedMLRefactoringModel):
@@ -18,6 +19,15 @@ class RandomForestRefactoringModel(SupervisedMLRefactoringModel):
             "n_estimators": [10, 50, 100, 150, 200]
         }
 
+    def halving_resource(self) -> str:
+        return "n_estimators"
+
+    def search_space(self):
+        space = super().search_space()
+        space.update({"min_samples_split": Integer(2, 10),
+                      "n_estimators": Integer(10, 200, log=True)})
+        return space
+
     def model(self, best_params=None):
         if best_params is not None:
             return RandomForestClassifier(
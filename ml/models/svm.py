@@ -4,6 +4,7 @@ from random import uniform
 from sklearn.svm import SVC, LinearSVC
 
 from ml.models.base import SupervisedMLRefactoringModel
+from ml.search.distributions import Float, Integer
 
 
 class LinearSVMRefactoringModel(SupervisedMLRefactoringModel):
@@ -19,6 +20,11 @@ class LinearSVMRefactoringModel(SupervisedMLRefactoringModel):
                 "tol": [1e-04]
                 }
 
+    def search_space(self):
+        space = super().search_space()
+        space["C"] = Float(0.01, 10, log=True)
+        return space
+
     def model(self, best_params=None):
         if best_params is not None:
             return LinearSVC(dual=best_params["dual"], C=best_params["C"],
@@ -41,6 +47,13 @@ class NonLinearSVMRefactoringModel(SupervisedMLRefactoringModel):
                 "gamma": [uniform(0.01, 10) for i in range(0, 4)],
                 "decision_function_shape": ["ovo", "ovr"]}
 
+    def search_space(self):
+        space = super().search_space()
+        space.update({"C": Float(0.01, 10, log=True),
+                      "degree": Integer(2, 10),
+                      "gamma": Float(0.01, 10, log=True)})
+        return space
+
     def model(self, best_params=None):
         if best_params is not None:
             return SVC(
@@ -1,6 +1,6 @@
 from os import path
 from statistics import mean
-from typing import Iterable
+from typing import Dict, Iterable
 from utils.log import log
 
 from configs import (
@@ -33,7 +33,8 @@ class TrainedRefactoringMLModel:
             time_path_friendly: str,
             commit_threshold: int,
             production_model: bool,
-            feature_reduction: bool) -> None:
+            feature_reduction: bool,
+            dropped_features: Dict[str, str] = None) -> None:
         self._model_name = model_name
         self._dataset_name = dataset_name
         self._target_refactoring = target_refactoring
@@ -47,6 +48,8 @@ class TrainedRefactoringMLModel:
         self.validation_prediction_results = None
         self._is_production_model = production_model
         self.feature_reduction = feature_reduction
+        # the features dropped by the pre-filter and why, see feature_filter
+        self._dropped_features = dropped_features or {}
 
     def persist_model(self):
         """
@@ -60,6 +63,9 @@ class TrainedRefactoringMLModel:
         feature_names = self._feature_names
         store_collection(feature_names, path.join(
             results_dir, 'feature_names'))
+        if len(self._dropped_features) > 0:
+            store_json(self._dropped_features, path.join(
+                results_dir, 'dropped_features.json'))
 
         if scaler is not None:
             pipeline = make_pipeline(scaler, model)
@@ -169,6 +175,7 @@ class TrainedRefactoringMLModel:
             metadata["balanced_strategy"] = BALANCE_DATASET_STRATEGY
         else:
             metadata["balanced"] = False
+        metadata["dropped_features"] = self._dropped_features
 
         # coefficients is nested in a list so we get the first element.
         if hasattr(model, "coef_"):
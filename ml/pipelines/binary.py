@@ -4,10 +4,18 @@ from typing import Iterable
 import pandas as pd
 from sklearn.utils import shuffle
 from configs import (
+    BAYESIAN_BATCH_SIZE,
+    BAYESIAN_PATIENCE,
     CORE_COUNT,
     DATASETS,
+    FEATURE_FILTER,
+    HALVING_FACTOR,
     N_CV_SEARCH,
+    N_INITIAL_BAYESIAN_SEARCH,
+    N_ITER_BAYESIAN_SEARCH,
     N_ITER_RANDOM_SEARCH,
+    OUT_OF_CORE_PREPROCESSING,
+    PREFLIGHT_COUNTS,
     SCORING,
     SEARCH,
     SEED,
@@ -16,12 +24,20 @@ from configs import (
 from ml.models.base import SupervisedMLRefactoringModel
 from ml.models.trained_refactoring_model import TrainedRefactoringMLModel
 from ml.pipelines.pipelines import MLPipeline
+from ml.preflight import has_enough_instances
+from ml.preprocessing.feature_filter import redundant_features
 from ml.preprocessing.feature_reduction import perform_feature_reduction
-from ml.preprocessing.preprocessing import retrieve_labelled_instances
+from ml.preprocessing import out_of_core, preprocessing
+from ml.preprocessing.row_hashes import log_overlap, row_hashes
+from ml.preprocessing.scaling import select_scaler_columns
 from ml.refactoring import LowLevelRefactoring
+from ml.search.tpe_search import TPESearchCV
 from pandas.core.frame import DataFrame
-from sklearn.base import TransformerMixin
+from sklearn.base import TransformerMixin, clone
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
 from sklearn.model_selection import (GridSearchCV, RandomizedSearchCV,
+                                     HalvingGridSearchCV,
+                                     HalvingRandomSearchCV, ParameterGrid,
                                      StratifiedKFold, train_test_split)
 from utils.classifier_utils import format_best_parameters
 from utils.date_utils import now
@@ -29,6 +45,38 @@ from utils.log import log
 from utils.date_utils import windows_path_friendly_now
 
 
+def _halving_min_resources(
+        min_resources: int,
+        max_resources: int,
+        candidates: int = None) -> int:
+    """
+    Get the resource of the first iteration of a halving search, such that
+    the last iteration gets about max_resources: max_resources divided by
+    HALVING_FACTOR once per iteration after the first, but at least
+    min_resources.
+
+    Parameter:
+        candidates (int) (optional): the number of candidates, the search
+         stops once fewer than HALVING_FACTOR candidates are left
+    """
+    iterations = 0
+    while min_resources * HALVING_FACTOR ** (iterations + 1) <= max_resources \
+            and (candidates is None
+                 or HALVING_FACTOR ** (iterations + 1) <= candidates):
+        iterations += 1
+    return max(min_resources, max_resources // HALVING_FACTOR ** iterations)
+
+
+def retrieve_labelled_instances(*args, **kwargs):
+    """
+    Retrieve the labelled instances in memory or out-of-core,
+    see OUT_OF_CORE_PREPROCESSING.
+    """
+    if OUT_OF_CORE_PREPROCESSING:
+        return out_of_core.retrieve_labelled_instances(*args, **kwargs)
+    return preprocessing.retrieve_labelled_instances(*args, **kwargs)
+
+
 class BinaryClassificationPipeline(MLPipeline):
     """
     Train models for binary classification
@@ -58,6 +106,10 @@ class BinaryClassificationPipeline(MLPipeline):
 
         for refactoring in self._refactorings:
             log(f"**** Refactoring Type: {refactoring.name()}")
+            # skip refactorings without instances, before fetching them
+            if PREFLIGHT_COUNTS and \
+                    not has_enough_instances(refactoring, DATASETS):
+                continue
             # we have two options to select a val set,
             # 1.) Predefined in the database
             if (VAL_SPLIT_SIZE < 0 and len(VALIDATION_DATASETS)
@@ -76,6 +128,7 @@ class BinaryClassificationPipeline(MLPipeline):
                         refactoring.name())
                     continue
                 x_train, y_train = shuffle(x_train, y_train, random_state=SEED)
+                train_hashes = row_hashes(x_train)
                 x_val_list, y_val_list, dataset_names = [], [], []
                 if len(val_proj) >= 1:
                     print(f'getting val data for project {val_proj}')
@@ -87,6 +140,7 @@ class BinaryClassificationPipeline(MLPipeline):
                             (val_proj[0], refactoring.name()))
                         continue
                     x_val, y_val = shuffle(x_val, y_val, random_state=SEED)
+                    log_overlap(train_hashes, x_val, val_proj[0])
 
                     dataset_names.append(val_proj[0])
 
@@ -94,6 +148,9 @@ class BinaryClassificationPipeline(MLPipeline):
                     y_val_list.append(y_val)
                 else:
                     for validation_dataset in VALIDATION_DATASETS:
+                        if PREFLIGHT_COUNTS and not has_enough_instances(
+                                refactoring, validation_dataset):
+                            continue
                         dataset_names.append(validation_dataset)
                         x_val, y_val, _, = retrieve_labelled_instances(
                             validation_dataset, refactoring, False, scaler,
@@ -105,6 +162,7 @@ class BinaryClassificationPipeline(MLPipeline):
                                 (validation_dataset, refactoring.name()))
                             continue
                         x_val, y_val = shuffle(x_val, y_val, random_state=SEED)
+                        log_overlap(train_hashes, x_val, validation_dataset)
                         x_val_list.append(x_val)
                         y_val_list.append(y_val)
                 if len(x_val_list) == 0:
@@ -146,6 +204,7 @@ class BinaryClassificationPipeline(MLPipeline):
                 x_train, x_val, y_train, y_val = train_test_split(
                     x, y, test_size=VAL_SPLIT_SIZE, random_state=SEED,
                     stratify=y)
+                log_overlap(row_hashes(x_train), x_val, "random split")
                 results.append(
                     self._run_all_models(
                         refactoring,
@@ -178,6 +237,18 @@ class BinaryClassificationPipeline(MLPipeline):
         """
         results = {}
         refactoring_name = refactoring.name()
+        # drop the redundant features of the training set for all models
+        dropped_features = {}
+        if FEATURE_FILTER:
+            dropped_features = redundant_features(x_train)
+            dropped = list(dropped_features)
+            columns = x_train.columns
+            X = X.drop(columns=dropped)
+            x_train = x_train.drop(columns=dropped)
+            x_val_list = [x_val.drop(columns=dropped) for x_val in x_val_list]
+            # the persisted pipeline scales the remaining features only
+            if scaler is not None and len(dropped) > 0:
+                scaler = select_scaler_columns(scaler, columns, x_train.columns)
         for model in self._models_to_run:
             try:
                 log("\nBuilding Model {}".format(model.name()))
@@ -185,7 +256,7 @@ class BinaryClassificationPipeline(MLPipeline):
                 production_model, trained_model = self._run_single_model(
                     model, X, y, x_train, y_train, val_names, x_val_list,
                     y_val_list, refactoring_name, scaler,
-                    refactoring.commit_threshold())
+                    refactoring.commit_threshold(), dropped_features)
 
                 # we save the best estimator we had during the search
                 # Also, store the predictions with labels and db_ids, to
@@ -203,6 +274,101 @@ class BinaryClassificationPipeline(MLPipeline):
                 exit(-1)
         return results
 
+    def _refit_largest_resource(
+            self,
+            trainer: SupervisedMLRefactoringModel,
+            search,
+            x_train,
+            y_train):
+        """
+        Refit the best candidate of a halving search over a parameter, e.g.
+        n_estimators, with the largest value of the parameter in
+        params_to_tune. The last iteration of the search ends close to it,
+        e.g. 198 of 200 estimators.
+        """
+        resource = trainer.halving_resource()
+        # best_params_ is the entry of the best candidate in cv_results_
+        best_params = {**search.best_params_,
+                       resource: max(trainer.params_to_tune()[resource])}
+        search.best_params_ = best_params
+        search.best_estimator_ = clone(search.estimator).set_params(
+            **best_params).fit(x_train, y_train)
+
+    def _build_search(
+            self,
+            trainer: SupervisedMLRefactoringModel,
+            model,
+            param_dist):
+        """
+        Create the hyperparameter search configured by SEARCH.
+        """
+        cv = StratifiedKFold(n_splits=N_CV_SEARCH, shuffle=True)
+        # choose which search to apply
+        if SEARCH == 'randomized':
+            return RandomizedSearchCV(
+                model,
+                param_dist,
+                n_iter=N_ITER_RANDOM_SEARCH,
+                cv=cv,
+                scoring=SCORING,
+                n_jobs=CORE_COUNT,
+                verbose=1)
+        elif SEARCH == 'grid':
+            return GridSearchCV(
+                model,
+                param_dist,
+                cv=cv,
+                scoring=SCORING,
+                n_jobs=CORE_COUNT,
+                verbose=1)
+        elif SEARCH in ['halving_grid', 'halving_randomized']:
+            # the candidates start with few samples or e.g. estimators, only
+            # the best 1 / HALVING_FACTOR candidates continue with
+            # HALVING_FACTOR times more of it
+            resource = trainer.halving_resource()
+            resources = {}
+            if resource != "n_samples":
+                param_dist = dict(param_dist)
+                values = param_dist.pop(resource)
+                # the randomized search samples the lists of params_to_tune
+                # without replacement, thus at most the whole grid as well
+                candidates = len(ParameterGrid(param_dist))
+                # the best candidate is refit with the largest resource,
+                # see _refit_largest_resource
+                resources = {"min_resources": _halving_min_resources(
+                                 min(values), max(values), candidates),
+                             "max_resources": max(values),
+                             "refit": False}
+            # the halving searches need the same folds in each iteration
+            cv = StratifiedKFold(
+                n_splits=N_CV_SEARCH, shuffle=True, random_state=SEED)
+            search_type = HalvingGridSearchCV if SEARCH == 'halving_grid' \
+                else HalvingRandomSearchCV
+            return search_type(
+                model,
+                param_dist,
+                factor=HALVING_FACTOR,
+                resource=resource,
+                cv=cv,
+                scoring=SCORING,
+                n_jobs=CORE_COUNT,
+                random_state=SEED,
+                verbose=1,
+                **resources)
+        elif SEARCH == 'bayesian':
+            return TPESearchCV(
+                model,
+                trainer.search_space(),
+                n_iter=N_ITER_BAYESIAN_SEARCH,
+                batch_size=BAYESIAN_BATCH_SIZE,
+                n_initial_points=N_INITIAL_BAYESIAN_SEARCH,
+                patience=BAYESIAN_PATIENCE,
+                cv=cv,
+                scoring=SCORING,
+                n_jobs=CORE_COUNT,
+                random_state=SEED)
+        raise ValueError(f"search {SEARCH} not found")
+
     def _run_single_model(
             self,
             trainer: SupervisedMLRefactoringModel,
@@ -215,7 +381,8 @@ class BinaryClassificationPipeline(MLPipeline):
             y_val_list,
             refactoring_name: str,
             scaler: TransformerMixin,
-            commit_threshold: int) -> TrainedRefactoringMLModel:
+            commit_threshold: int,
+            dropped_features=None) -> TrainedRefactoringMLModel:
         model = trainer.model()
 
         # perform the search for the best hyper parameters
@@ -233,28 +400,7 @@ class BinaryClassificationPipeline(MLPipeline):
         else:
             features = X.columns.values
 
-        # choose which search to apply
-        if SEARCH == 'randomized':
-            search = RandomizedSearchCV(
-                model,
-                param_dist,
-                n_iter=N_ITER_RANDOM_SEARCH,
-                cv=StratifiedKFold(
-                    n_splits=N_CV_SEARCH,
-                    shuffle=True),
-                scoring=SCORING,
-                n_jobs=CORE_COUNT,
-                verbose=1)
-        elif SEARCH == 'grid':
-            search = GridSearchCV(
-                model,
-                param_dist,
-                cv=StratifiedKFold(
-                    n_splits=N_CV_SEARCH,
-                    shuffle=True),
-                scoring=SCORING,
-                n_jobs=CORE_COUNT,
-                verbose=1)
+        search = self._build_search(trainer, model, param_dist)
 
         log("val search started at %s\n" % now())
 
@@ -263,6 +409,9 @@ class BinaryClassificationPipeline(MLPipeline):
             test size={len(x_val_list[0].index)}')
 
         search.fit(x_train, y_train)
+        if SEARCH in ['halving_grid', 'halving_randomized'] and \
+                trainer.halving_resource() != "n_samples":
+            self._refit_largest_resource(trainer, search, x_train, y_train)
         log(format_best_parameters(search))
         windows_path_friendly_timestamp = windows_path_friendly_now()
         training_model = TrainedRefactoringMLModel(
@@ -275,7 +424,8 @@ class BinaryClassificationPipeline(MLPipeline):
             windows_path_friendly_timestamp,
             commit_threshold,
             False,
-            trainer.feature_reduction())
+            trainer.feature_reduction(),
+            dropped_features)
 
         training_model.persist_model_parameters(),
 
@@ -294,7 +444,8 @@ class BinaryClassificationPipeline(MLPipeline):
             trainer.name(), '-'.join(self._datasets),
             refactoring_name, production_model, scaler,
             features, windows_path_friendly_timestamp,
-            commit_threshold, True, trainer.feature_reduction())
+            commit_threshold, True, trainer.feature_reduction(),
+            dropped_features)
         production_model.persist_model()
         production_model.persist_model_parameters()
         return production_model, training_model
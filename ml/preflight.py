@@ -0,0 +1,97 @@
+from typing import Iterable
+
+from pandas.core.frame import DataFrame
+
+from configs import DATASETS, VALIDATION_DATASETS, PREFLIGHT_MIN_INSTANCES, \
+    Level
+from db.DBConnector import execute_query
+from db.QueryBuilder import get_instance_counts
+from ml.refactoring import LowLevelRefactoring
+from utils.log import log
+
+"""
+Pre-flight checks of the refactorings, before their instances are fetched.
+
+The instances of all refactoring types and commit thresholds of all datasets
+are counted with a single grouped query, which is cached. Refactorings without
+enough refactored or non-refactored instances are skipped, without fetching
+their instances.
+"""
+
+_counts = {}
+
+
+def instance_counts() -> DataFrame:
+    """
+    Get the instance counts of all training and validation datasets,
+    see QueryBuilder.get_instance_counts.
+
+    Returns:
+        the counts or None, if neither the db nor the cache is available
+    """
+    datasets = tuple(DATASETS + VALIDATION_DATASETS)
+    if datasets not in _counts:
+        try:
+            _counts[datasets] = execute_query(get_instance_counts(datasets))
+        except RuntimeError as e:
+            log(f"Skip the pre-flight counts: {e}")
+            _counts[datasets] = None
+    return _counts[datasets]
+
+
+def _datasets(datasets) -> Iterable[str]:
+    # the pipeline passes a single validation dataset as string
+    return [datasets] if isinstance(datasets, str) else datasets
+
+
+def refactored_count(
+        counts: DataFrame,
+        refactoring: LowLevelRefactoring,
+        datasets: Iterable[str]) -> int:
+    selection = counts[(counts["kind"] == "refactoring") &
+                       (counts["level"] == refactoring.level_number()) &
+                       (counts["refactoring"] == refactoring.name()) &
+                       (counts["datasetName"].isin(_datasets(datasets)))]
+    return int(selection["total"].sum())
+
+
+def non_refactored_count(
+        counts: DataFrame,
+        refactoring: LowLevelRefactoring,
+        datasets: Iterable[str]) -> int:
+    # the other level uses the stable instances of the class level,
+    # see QueryBuilder.__stable_level_filter
+    level = refactoring.level_number()
+    if level == Level.Other:
+        level = Level.Class
+    selection = counts[(counts["kind"] == "stable") &
+                       (counts["level"] == level) &
+                       (counts["commitThreshold"] == refactoring.commit_threshold()) &
+                       (counts["datasetName"].isin(_datasets(datasets)))]
+    return int(selection["total"].sum())
+
+
+def has_enough_instances(
+        refactoring: LowLevelRefactoring,
+        datasets: Iterable[str]) -> bool:
+    """
+    Check if the refactoring has at least PREFLIGHT_MIN_INSTANCES refactored
+    and non-refactored instances in the given datasets. Without counts, all
+    refactorings pass.
+
+    Parameter:
+        refactoring (LowLevelRefactoring): the refactoring to check
+        datasets (Iterable[str]): count the instances of these datasets
+    """
+    counts = instance_counts()
+    if counts is None:
+        return True
+    refactored = refactored_count(counts, refactoring, datasets)
+    non_refactored = non_refactored_count(counts, refactoring, datasets)
+    if refactored < PREFLIGHT_MIN_INSTANCES or \
+            non_refactored < PREFLIGHT_MIN_INSTANCES:
+        log(f"Pre-flight: skip {refactoring.name()} with K={refactoring.commit_threshold()} "
+            f"for the datasets {datasets}, found {refactored} refactored and "
+            f"{non_refactored} non-refactored instances.")
+        return False
+    return True
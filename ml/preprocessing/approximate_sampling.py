@@ -0,0 +1,194 @@
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.neighbors import KDTree
+
+from utils.log import log
+
+"""
+Approximate variants of the informed undersampling of imblearn, for millions
+of non-refactored instances.
+
+ClusterCentroids runs a full KMeans and NearMiss an exact kNN search over all
+instances of the majority class. Both variants here are bounded by a time
+budget and by the number of majority samples they fit on. Like the samplers
+of imblearn they implement fit_resample, but they return the selected
+instances themselves, with their ids.
+"""
+
+
+def _majority_classes(y: np.ndarray):
+    # the classes to undersample and the number of samples to keep per class
+    classes, counts = np.unique(y, return_counts=True)
+    target = counts.min()
+    return [label for label, count in zip(classes, counts) if count > target], \
+        target
+
+
+def _subsample(rows: np.ndarray, max_samples: int, random_state) -> np.ndarray:
+    if len(rows) <= max_samples:
+        return rows
+    return np.sort(random_state.choice(rows, max_samples, replace=False))
+
+
+def _resample(x, y, selected: np.ndarray):
+    selected = np.sort(selected)
+    if isinstance(x, pd.DataFrame):
+        return x.iloc[selected], y.iloc[selected]
+    return x[selected], y[selected]
+
+
+class ApproximateClusterCentroids:
+    """
+    Undersample the majority class to the centroids of a MiniBatchKMeans,
+    with the hard voting of imblearn: each centroid is replaced by the
+    majority sample of its cluster closest to it.
+
+    The KMeans is fit with partial_fit on batches of the majority samples,
+    until the time budget is exhausted or after max_epochs passes.
+    """
+
+    def __init__(
+            self,
+            time_budget: float = 300,
+            max_samples: int = 1000000,
+            batch_size: int = 10000,
+            max_epochs: int = 10,
+            random_state=None):
+        """
+        Parameter:
+            time_budget (float): the time budget to fit the KMeans in seconds
+            max_samples (int): fit the KMeans on a random subsample of at most
+             this many majority samples
+            batch_size (int): the mini batch size of the KMeans
+            max_epochs (int): the maximum number of passes over the samples
+            random_state (int): the seed of the subsample and the KMeans
+        """
+        self.time_budget = time_budget
+        self.max_samples = max_samples
+        self.batch_size = batch_size
+        self.max_epochs = max_epochs
+        self.random_state = random_state
+
+    def fit_resample(self, x, y):
+        values = np.asarray(x, dtype=np.float64)
+        labels = np.asarray(y)
+        random_state = np.random.RandomState(self.random_state)
+        majority_classes, target = _majority_classes(labels)
+        selected = [np.flatnonzero(~np.isin(labels, majority_classes))]
+        for label in majority_classes:
+            rows = np.flatnonzero(labels == label)
+            selected.append(self._centroid_samples(values, rows, target, random_state))
+        return _resample(x, y, np.concatenate(selected))
+
+    def _centroid_samples(
+            self,
+            values: np.ndarray,
+            rows: np.ndarray,
+            n_clusters: int,
+            random_state) -> np.ndarray:
+        fit_rows = _subsample(rows, self.max_samples, random_state)
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters, random_state=self.random_state,
+            batch_size=max(self.batch_size, n_clusters), n_init=1)
+        start_time = time.time()
+        batch_size = kmeans.batch_size
+        for epoch in range(self.max_epochs):
+            order = random_state.permutation(fit_rows)
+            for start in range(0, len(order), batch_size):
+                # the batches hold at least n_clusters samples, except for
+                # the last one, thus the first batch initializes all clusters
+                kmeans.partial_fit(values[order[start:start + batch_size]])
+                if time.time() - start_time > self.time_budget:
+                    break
+            if time.time() - start_time > self.time_budget:
+                log(f"Stopped the cluster centroids after {epoch + 1} epochs, "
+                    f"the time budget of {self.time_budget} seconds is exhausted.")
+                break
+
+        # the sample closest to the centroid of each cluster
+        clusters = np.empty(len(rows), dtype=np.int64)
+        distances = np.empty(len(rows), dtype=np.float64)
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            clusters[start:start + len(batch)] = kmeans.predict(values[batch])
+            distances[start:start + len(batch)] = np.linalg.norm(
+                values[batch] - kmeans.cluster_centers_[
+                    clusters[start:start + len(batch)]], axis=1)
+        order = np.lexsort((distances, clusters))
+        first = np.r_[True, clusters[order][1:] != clusters[order][:-1]]
+        selected = order[first]
+        shortfall = n_clusters - len(selected)
+        if shortfall > 0:
+            # clusters without samples, e.g. of an early stopped KMeans, are
+            # replaced with the samples closest to the other centroids
+            log(f"{shortfall} clusters are empty, they are replaced with the "
+                f"next closest samples.")
+            rest = order[~first]
+            rest = rest[np.argsort(distances[rest], kind="stable")[:shortfall]]
+            selected = np.concatenate([selected, rest])
+        return rows[selected]
+
+
+class ApproximateNearMiss:
+    """
+    Undersample the majority class like NearMiss version 1, it keeps the
+    majority samples with the smallest average distance to their
+    n_neighbors closest minority samples.
+
+    The minority samples are indexed with a KDTree. At most max_samples
+    majority samples are scored, in batches, until the time budget is
+    exhausted. The samples are selected among the scored ones.
+    """
+
+    def __init__(
+            self,
+            n_neighbors: int = 3,
+            time_budget: float = 300,
+            max_samples: int = 1000000,
+            batch_size: int = 10000,
+            random_state=None):
+        """
+        Parameter:
+            n_neighbors (int): the number of minority neighbours
+            time_budget (float): the time budget to score the samples in seconds
+            max_samples (int): score a random subsample of at most this many
+             majority samples
+            batch_size (int): the number of samples scored at once
+            random_state (int): the seed of the subsample
+        """
+        self.n_neighbors = n_neighbors
+        self.time_budget = time_budget
+        self.max_samples = max_samples
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+    def fit_resample(self, x, y):
+        values = np.asarray(x, dtype=np.float64)
+        labels = np.asarray(y)
+        random_state = np.random.RandomState(self.random_state)
+        majority_classes, target = _majority_classes(labels)
+        minority_rows = np.flatnonzero(~np.isin(labels, majority_classes))
+        tree = KDTree(values[minority_rows])
+        n_neighbors = min(self.n_neighbors, len(minority_rows))
+
+        selected = [minority_rows]
+        start_time = time.time()
+        for label in majority_classes:
+            rows = random_state.permutation(_subsample(
+                np.flatnonzero(labels == label), self.max_samples, random_state))
+            scores = np.full(len(rows), np.inf)
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                distances, _ = tree.query(values[batch], k=n_neighbors)
+                scores[start:start + len(batch)] = distances.mean(axis=1)
+                if time.time() - start_time > self.time_budget and \
+                        start + len(batch) >= target:
+                    log(f"Stopped the near miss after scoring {start + len(batch)} "
+                        f"samples, the time budget of {self.time_budget} "
+                        f"seconds is exhausted.")
+                    break
+            selected.append(rows[np.argsort(scores, kind="stable")[:target]])
+        return _resample(x, y, np.concatenate(selected))
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+from typing import Dict
+
+import numpy as np
+from pandas.core.frame import DataFrame
+
+from configs import FEATURE_FILTER_CORRELATION, \
+    FEATURE_FILTER_DOMINANT_RATIO, FEATURE_FILTER_SAMPLE_SIZE, SEED
+from utils.log import log
+
+"""
+A cheap pre-filter of the features, before the feature reduction and the
+hyperparameter search.
+
+It drops constant features, near constant features, whose most frequent
+value covers at least FEATURE_FILTER_DOMINANT_RATIO of the instances, and
+features correlated with an earlier feature by at least
+FEATURE_FILTER_CORRELATION, e.g. the lines of code and the unique words.
+The filter is fit on the training set and the same features are dropped from
+the validation sets. The dropped features are stored with the trained models,
+see TrainedRefactoringMLModel.
+"""
+
+
+def redundant_features(x: DataFrame) -> Dict[str, str]:
+    """
+    Find the redundant features of x, the near constant and correlated
+    features are found on a sample of FEATURE_FILTER_SAMPLE_SIZE instances.
+
+    Returns:
+        the redundant features and why they are redundant, in column order
+    """
+    dropped = OrderedDict()
+    values = x.to_numpy(dtype=np.float64)
+    constant = np.nanmin(values, axis=0) == np.nanmax(values, axis=0)
+    for column in x.columns[constant]:
+        dropped[column] = "constant"
+
+    if len(values) > FEATURE_FILTER_SAMPLE_SIZE:
+        rows = np.random.RandomState(SEED).choice(
+            len(values), FEATURE_FILTER_SAMPLE_SIZE, replace=False)
+        values = values[np.sort(rows)]
+    candidates = np.flatnonzero(~constant)
+    varying = []
+    for position in candidates:
+        _, counts = np.unique(values[:, position], return_counts=True)
+        if counts.max() >= FEATURE_FILTER_DOMINANT_RATIO * len(values):
+            dropped[x.columns[position]] = "near constant"
+        else:
+            varying.append(position)
+
+    if len(varying) > 1:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            correlation = np.abs(np.corrcoef(values[:, varying], rowvar=False))
+        # keep the first of each group of correlated features
+        kept = []
+        for index, position in enumerate(varying):
+            correlated = [other for other in kept
+                          if correlation[index, other] >= FEATURE_FILTER_CORRELATION]
+            if len(correlated) > 0:
+                dropped[x.columns[position]] = \
+                    f"correlated with {x.columns[varying[correlated[0]]]}"
+            else:
+                kept.append(index)
+
+    log(f"Pre-filter dropped {len(dropped)} of {len(x.columns)} features: "
+        f"{', '.join(f'{column} ({reason})' for column, reason in dropped.items())}")
+    return dropped
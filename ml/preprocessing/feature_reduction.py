@@ -1,9 +1,96 @@
-from sklearn.feature_selection import RFECV
-from sklearn.svm import SVR
-from configs import N_CV_FEATURE_REDUCTION, CORE_COUNT
+import math
+import time
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.feature_selection import RFECV, SelectFromModel, \
+    mutual_info_classif
+from sklearn.model_selection import train_test_split
+from sklearn.svm import LinearSVC
+from configs import N_CV_FEATURE_REDUCTION, CORE_COUNT, SEED, \
+    FEATURE_SELECTION_METHOD, FEATURE_SELECTION_STEP, \
+    FEATURE_SELECTION_TIME_BUDGET, FEATURE_SELECTION_MAX_SAMPLES, \
+    FEATURE_SELECTION_THRESHOLD, CACHE_FEATURE_SELECTION
+from ml.preprocessing import feature_selection_cache
 from utils.log import log
 
 
+def grid_scores(selector: RFECV):
+    """
+    Get the mean cross-validation score of each number of features,
+    newer scikit-learn versions removed grid_scores_.
+    """
+    if hasattr(selector, "cv_results_"):
+        return selector.cv_results_["mean_test_score"]
+    return selector.grid_scores_
+
+
+def _subsample(X, y, max_samples: int):
+    # a stratified subsample of at most max_samples instances
+    if max_samples is None or len(X.index) <= max_samples:
+        return X, y
+    X, _, y, _ = train_test_split(
+        X, y, train_size=max_samples, random_state=SEED, stratify=y)
+    return X, y
+
+
+def _fit_probe(estimator, X, y):
+    """
+    Fit the estimator once, to measure its fit time. Estimators without
+    coef_ or feature_importances_ are replaced with a linear SVM.
+
+    :return: the fitted estimator and its fit time in seconds
+    """
+    start_time = time.time()
+    probe = clone(estimator).fit(X, y)
+    if not (hasattr(probe, "coef_") or hasattr(probe, "feature_importances_")):
+        log("The classifier does not expose coef_ or feature_importances_, \
+            thus we use a linear SVM \
+             as a replacement for feature reduction.")
+        start_time = time.time()
+        probe = LinearSVC(dual=False, random_state=SEED).fit(X, y)
+    return probe, time.time() - start_time
+
+
+def _lacks_importances(error: Exception) -> bool:
+    # is it the error of RFECV for estimators without coef_ or
+    # feature_importances_? a RuntimeError or a ValueError, depending on the
+    # scikit-learn version
+    return "coef_" in str(error) or "feature_importances_" in str(error)
+
+
+def _budget_step(feature_count: int, fit_seconds: float):
+    """
+    Get the elimination step of the RFE, either FEATURE_SELECTION_STEP or a
+    larger step, to finish the cross-validated RFE within the time budget.
+    The budget includes the probe fit, that measured fit_seconds.
+    """
+    step = FEATURE_SELECTION_STEP
+    if FEATURE_SELECTION_TIME_BUDGET is None or fit_seconds <= 0:
+        return step
+    # the probe fit is spent, the selector refits the estimator on all
+    # features once at the end. Each elimination refits the estimator once
+    # per fold and once more for the final elimination on all instances.
+    remaining_fits = (FEATURE_SELECTION_TIME_BUDGET - fit_seconds) / fit_seconds - 1
+    eliminations = remaining_fits / (N_CV_FEATURE_REDUCTION + 1)
+    budget_step = math.ceil(feature_count / max(eliminations, 1))
+    configured_step = step if step >= 1 else math.ceil(step * feature_count)
+    if budget_step > configured_step:
+        log(f"Eliminate {budget_step} features per step, to stay in the time "
+            f"budget of {FEATURE_SELECTION_TIME_BUDGET} seconds.")
+        return budget_step
+    return step
+
+
+def _fit_rfecv(estimator, step, X, y) -> RFECV:
+    selector = RFECV(
+        estimator,
+        step=step,
+        cv=N_CV_FEATURE_REDUCTION,
+        n_jobs=CORE_COUNT)
+    return selector.fit(X, y)
+
+
 def feature_selection_rfecv(estimator, X, y):
     """
     Performs feature reduction on X with y labels
@@ -14,20 +101,108 @@ def feature_selection_rfecv(estimator, X, y):
     :param X: feature values
     :param y: labels
 
-    :return: x, where x only contains the relevant features.
+    :return: x, where x only contains the relevant features, and the
+    ranking and grid scores of the features
     """
-    selector = RFECV(
-        estimator,
-        step=1,
-        cv=N_CV_FEATURE_REDUCTION,
-        n_jobs=CORE_COUNT)
-
-    selector.fit(X, y)
+    if FEATURE_SELECTION_TIME_BUDGET is None:
+        # no fit time to measure, RFECV fails for estimators without
+        # coef_ or feature_importances_ instead
+        try:
+            selector = _fit_rfecv(estimator, FEATURE_SELECTION_STEP, X, y)
+        except (RuntimeError, ValueError) as e:
+            if not _lacks_importances(e):
+                raise
+            log("The classifier does not expose coef_ or feature_importances_, \
+            thus we use a linear SVM \
+             as a replacement for feature reduction.")
+            selector = _fit_rfecv(
+                LinearSVC(dual=False, random_state=SEED),
+                FEATURE_SELECTION_STEP, X, y)
+    else:
+        probe, fit_seconds = _fit_probe(estimator, X, y)
+        selector = _fit_rfecv(
+            probe, _budget_step(len(X.columns), fit_seconds), X, y)
     log(f"Feature ranking: {', '.join(str(e) for e in selector.ranking_)}")
     log(f"Feature grid scores: \
-    {', '.join(str(e) for e in selector.grid_scores_)}")
+    {', '.join(str(e) for e in grid_scores(selector))}")
     # keeping the column names
-    return X[X.columns[selector.get_support(indices=True)]]
+    return X[X.columns[selector.get_support(indices=True)]], \
+        {"ranking": selector.ranking_.tolist(),
+         "grid_scores": np.asarray(grid_scores(selector)).tolist()}
+
+
+def feature_selection_subsample_rfe(estimator, X, y):
+    """
+    Performs the RFE-CV on a stratified subsample of at most
+    FEATURE_SELECTION_MAX_SAMPLES instances, see feature_selection_rfecv.
+    """
+    x_sample, y_sample = _subsample(X, y, FEATURE_SELECTION_MAX_SAMPLES)
+    log(f"Select the features on a subsample of {len(x_sample.index)} instances.")
+    selected, details = feature_selection_rfecv(estimator, x_sample, y_sample)
+    return X[selected.columns], details
+
+
+def feature_selection_importance(estimator, X, y):
+    """
+    Keep the features with an importance (feature_importances_ or the
+    absolute coef_) of at least FEATURE_SELECTION_THRESHOLD,
+    the estimator is fit only once.
+    """
+    probe, _ = _fit_probe(estimator, X, y)
+    selector = SelectFromModel(
+        probe, threshold=FEATURE_SELECTION_THRESHOLD, prefit=True)
+    support = selector.get_support()
+    importances = getattr(probe, "feature_importances_", None)
+    if importances is None:
+        importances = np.abs(probe.coef_).ravel()
+    log(f"Feature importances: {', '.join(str(e) for e in importances)}")
+    return X[X.columns[support]], {"importances": importances.tolist()}
+
+
+def feature_selection_mutual_information(estimator, X, y):
+    """
+    Keep the features with a mutual information with the labels of at least
+    FEATURE_SELECTION_THRESHOLD, e.g. "mean" or "median" of all features.
+    The mutual information is estimated on a subsample of at most
+    FEATURE_SELECTION_MAX_SAMPLES instances, the estimator is not used.
+    """
+    x_sample, y_sample = _subsample(X, y, FEATURE_SELECTION_MAX_SAMPLES)
+    scores = mutual_info_classif(x_sample, y_sample, random_state=SEED)
+    log(f"Feature mutual information: {', '.join(str(e) for e in scores)}")
+    if FEATURE_SELECTION_THRESHOLD == "mean":
+        threshold = scores.mean()
+    elif FEATURE_SELECTION_THRESHOLD == "median":
+        threshold = np.median(scores)
+    else:
+        threshold = float(FEATURE_SELECTION_THRESHOLD)
+    return X[X.columns[scores >= threshold]], \
+        {"mutual_information": scores.tolist()}
+
+
+# the feature selection methods, see FEATURE_SELECTION_METHOD, they return
+# the selected features and details of the selection, e.g. the ranking
+FEATURE_SELECTION_METHODS = {
+    "rfecv": feature_selection_rfecv,
+    "importance_threshold": feature_selection_importance,
+    "mutual_information": feature_selection_mutual_information,
+    "subsample_rfe": feature_selection_subsample_rfe}
+
+
+def _select_features(estimator, X, y):
+    # reuse the features selected for the same data, estimator and config
+    key = feature_selection_cache.fingerprint(estimator, X, y) \
+        if CACHE_FEATURE_SELECTION else None
+    cached = feature_selection_cache.load(key) if key is not None else None
+    if cached is not None:
+        log(f"Use the features selected at {cached['created_at']}, "
+            f"see {feature_selection_cache.cache_path(key)}")
+        return X[cached["features"]]
+
+    X, details = FEATURE_SELECTION_METHODS[FEATURE_SELECTION_METHOD](
+        estimator, X, y)
+    if key is not None:
+        feature_selection_cache.store(key, list(X.columns), details)
+    return X
 
 
 def perform_feature_reduction(estimator, X, y, allowed_features=None):
@@ -52,15 +227,10 @@ def perform_feature_reduction(estimator, X, y, allowed_features=None):
                   {', '.join(X.columns.values)}")
     # let's reduce the number of features in the set
     if allowed_features is None:
-        # not all estimators expose coef_ or feature_importances, thus we
-        # handle these cases with a default estimator
-        try:
-            X = feature_selection_rfecv(estimator, X, y)
-        except(RuntimeError):
-            log("The classifier does not expose coef_ or feature_importances_, \
-                thus we use an SVR estimator \
-                 as a replacement for feature reduction.")
-            X = feature_selection_rfecv(SVR(kernel="linear"), X, y)
+        if FEATURE_SELECTION_METHOD not in FEATURE_SELECTION_METHODS:
+            raise ValueError(
+                f"feature selection method {FEATURE_SELECTION_METHOD} not found")
+        X = _select_features(estimator, X, y)
 
     # enforce the specified feature set
     elif allowed_features is not None:
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from configs import CACHE_DIR_PATH, FEATURE_SELECTION_MAX_SAMPLES, \
+    FEATURE_SELECTION_METHOD, FEATURE_SELECTION_STEP, \
+    FEATURE_SELECTION_THRESHOLD, FEATURE_SELECTION_TIME_BUDGET, \
+    N_CV_FEATURE_REDUCTION, SEED
+from ml.preprocessing.row_hashes import row_hashes
+
+"""
+A persistent cache of the selected features.
+
+The features selected by perform_feature_reduction are stored in
+cache/feature_selection/<fingerprint>.json, with the details of the
+selection, e.g. the RFECV ranking and grid scores. The fingerprint covers
+the training data (the row hashes, the feature names and the labels), the
+estimator class and its parameters and the feature selection config. Thus
+reruns with the same data, estimator and config skip the selection, e.g.
+while iterating on the search spaces.
+
+Note:
+    With a FEATURE_SELECTION_TIME_BUDGET the selection depends on the fit
+    time as well, a cached selection is reused anyway.
+"""
+
+
+def cache_path(key: str) -> str:
+    return os.path.join(
+        CACHE_DIR_PATH, "cache", "feature_selection", f"{key}.json")
+
+
+def fingerprint(estimator, X, y) -> str:
+    """
+    Get the fingerprint of a feature selection for the estimator on X and y.
+    """
+    fingerprint_hash = hashlib.sha1()
+    fingerprint_hash.update(row_hashes(X).tobytes())
+    fingerprint_hash.update(np.asarray(y, dtype=np.int64).tobytes())
+    config = {
+        "features": [str(column) for column in X.columns],
+        "estimator": f"{type(estimator).__module__}.{type(estimator).__name__}",
+        "params": {name: repr(value) for name, value
+                   in sorted(estimator.get_params().items())},
+        "method": FEATURE_SELECTION_METHOD,
+        "step": FEATURE_SELECTION_STEP,
+        "time_budget": FEATURE_SELECTION_TIME_BUDGET,
+        "max_samples": FEATURE_SELECTION_MAX_SAMPLES,
+        "threshold": FEATURE_SELECTION_THRESHOLD,
+        "cv": N_CV_FEATURE_REDUCTION,
+        "seed": SEED}
+    fingerprint_hash.update(json.dumps(config, sort_keys=True).encode())
+    return fingerprint_hash.hexdigest()
+
+
+def load(key: str) -> dict:
+    """
+    Get a cached feature selection.
+
+    Returns:
+        a dict with the selected features, the details and the creation time
+        or None, if the selection is not cached
+    """
+    file_path = cache_path(key)
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path) as selection_file:
+        return json.load(selection_file)
+
+
+def store(key: str, features, details: dict):
+    """
+    Cache a feature selection.
+
+    Parameter:
+        key (str): the fingerprint of the selection
+        features (list): the selected features
+        details (dict): the details of the selection, e.g. the ranking
+    """
+    file_path = cache_path(key)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temp_path = f"{file_path}.tmp-{os.getpid()}"
+    with open(temp_path, "w") as selection_file:
+        json.dump({"features": [str(feature) for feature in features],
+                   "method": FEATURE_SELECTION_METHOD,
+                   "details": details,
+                   "created_at": time.strftime("%Y-%m-%d %H:%M:%S")},
+                  selection_file, indent=2)
+    os.replace(temp_path, file_path)
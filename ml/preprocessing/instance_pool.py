@@ -0,0 +1,122 @@
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from pandas.core.frame import DataFrame
+
+from configs import FILE_TYPE, POOL_NON_REFACTORED_INSTANCES, DROP_METRICS, \
+    DROP_PROCESS_AND_AUTHORSHIP_METRICS, PROCESS_AND_AUTHORSHIP_METRICS, \
+    DROP_FAULTY_PROCESS_AND_AUTHORSHIP_METRICS
+from ml.preprocessing.row_hashes import cached_row_hashes, complete_rows, \
+    row_hashes, unique_rows
+from ml.refactoring import LowLevelRefactoring
+from utils.log import log
+
+"""
+A pool of the cleaned non-refactored instances of the current level.
+
+All refactorings of a level share their non-refactored instances. The pool
+loads and cleans them once, e.g. finds the NAs and duplicates, and hands the
+same frame and the rows to keep to all refactorings of the level. The pipeline iterates the
+refactorings level by level, thus the instances of the other levels are
+evicted, once the instances of a new level are requested.
+
+Note:
+    The pooled frames are shared, never modify them in place.
+"""
+
+# the instances and their rows to keep by
+# (level, commit threshold, datasets, file type)
+_pool = {}
+
+
+def faulty_metrics(columns: Iterable[str]) -> List[str]:
+    """
+    Get the process and authorship metrics of the columns, whose -1 values
+    are faulty, if configured, see keep_mask.
+    """
+    # ToDo: do this after the feature reduction to not drop instances which
+    # are not affected by faulty process and authorship metrics, which are
+    # not in the feature set
+    if not DROP_FAULTY_PROCESS_AND_AUTHORSHIP_METRICS or \
+            DROP_PROCESS_AND_AUTHORSHIP_METRICS:
+        return []
+    return [metric for metric in PROCESS_AND_AUTHORSHIP_METRICS
+            if metric in columns and metric not in DROP_METRICS]
+
+
+def keep_mask(instances: DataFrame) -> np.ndarray:
+    """
+    Get a mask of the instances to keep, it drops all instances with a -1
+    value in the process and authorship metrics, if configured.
+    """
+    keep = np.ones(instances.shape[0], dtype=bool)
+    for metric in faulty_metrics(instances.columns):
+        keep &= instances[metric].to_numpy() != -1
+    return keep
+
+
+def clean_instances(instances: DataFrame, sql_query: str = None) -> np.ndarray:
+    """
+    Find the instances to keep: without NAs, they will cause failures later
+    on, without faulty process metrics, see keep_mask, and without
+    duplicates. The instances are not copied, see
+    preprocessing.merge_instances.
+
+    Parameter:
+        instances (DataFrame): the instances to clean
+        sql_query (str) (optional): the query of the instances, their row
+         hashes are stored with its cache file, see row_hashes
+    Returns:
+        the positions of the rows to keep, in ascending order
+    """
+    complete = complete_rows(instances)
+    keep = complete & keep_mask(instances)
+    faulty = int(complete.sum() - keep.sum())
+    if faulty > 0:
+        log(f"Dropped {faulty} instances with faulty process metrics.")
+    hashes = row_hashes(instances) if sql_query is None \
+        else cached_row_hashes(instances, sql_query)
+    return np.flatnonzero(unique_rows(hashes, keep))
+
+
+def get_non_refactored_instances(
+        refactoring: LowLevelRefactoring,
+        datasets: Iterable[str],
+        target_count: int = None) -> Tuple[DataFrame, np.ndarray]:
+    """
+    Get the non-refactored instances for the refactoring and the positions of
+    the rows to keep, see LowLevelRefactoring.get_non_refactored_instances
+    and clean_instances.
+
+    Parameter:
+        refactoring (LowLevelRefactoring): get the instances of its level
+         and commit threshold
+        datasets (Iterable[str]): the datasets of the instances
+        target_count (int) (optional): sample the instances in the db,
+         samples are specific to a refactoring and bypass the pool
+    """
+    if target_count is not None or not POOL_NON_REFACTORED_INSTANCES:
+        instances = refactoring.get_non_refactored_instances(
+            datasets, target_count)
+        return instances, clean_instances(instances)
+
+    level = refactoring.level_number()
+    key = (level, refactoring.commit_threshold(),
+           (datasets,) if isinstance(datasets, str) else tuple(datasets),
+           FILE_TYPE)
+    if key not in _pool:
+        for evicted in [other for other in _pool if other[0] != level]:
+            log(f"Evict the non-refactored instances {evicted} from the pool.")
+            del _pool[evicted]
+        instances = refactoring.get_non_refactored_instances(datasets)
+        _pool[key] = instances, clean_instances(
+            instances, refactoring.non_refactored_instances_query(datasets))
+    return _pool[key]
+
+
+def clear():
+    """
+    Release all pooled instances.
+    """
+    _pool.clear()
@@ -0,0 +1,266 @@
+import hashlib
+import math
+import os
+from collections import Counter
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+from sklearn.preprocessing import MinMaxScaler
+
+from configs import BALANCE_DATASET, BALANCE_DATASET_STRATEGY, \
+    CACHE_SIZE_LIMIT_GB, DROP_METRICS, FETCH_BATCH_SIZE, \
+    OUT_OF_CORE_MAX_ROWS, SCALE_DATASET, SEED, TRAINING_SAMPLE_RATIO, \
+    USE_LOCAL_STORE
+from db import CacheCatalog
+from db.DBConnector import cache_query, derived_file_path
+from db.LocalStore import join_metrics
+from ml.preprocessing.instance_pool import keep_mask
+from ml.preprocessing.row_hashes import complete_rows, row_hashes
+from ml.preprocessing.sampling import perform_balancing
+from ml.preprocessing.scaling import perform_fit_scaling, perform_scaling
+from ml.refactoring import LowLevelRefactoring
+from utils.log import log
+
+"""
+Out-of-core preprocessing of the labelled instances, for datasets larger
+than the memory.
+
+The cached instances are read in batches of FETCH_BATCH_SIZE rows, never as
+a whole. The instances are sampled with a seeded hash threshold: each row
+hash, see row_hashes, is mixed with the SEED into a sample key and the rows
+with the smallest keys are kept. Thus the sample is uniform and reproducible,
+and duplicated instances are either all kept or all dropped, they are
+deduplicated within the sample.
+
+The first pass over the instances collects the smallest sample keys only,
+this defines the size of the sample. The second pass writes the sampled
+instances into a float64 matrix on disk, at most OUT_OF_CORE_MAX_ROWS rows,
+and fits the MinMaxScaler incrementally. The matrix is a derived file of the
+non-refactored cache file, <query hash>.matrix-<hash>.npy, thus it counts
+towards CACHE_SIZE_LIMIT_GB and is deleted with the cache file, e.g. by
+manage_cache.py prune. The random undersampling and the
+sample reduction are applied by sampling less non-refactored (or refactored)
+instances. The other balancing strategies are applied to the sampled matrix
+in memory.
+
+Note:
+    In order to use this feature, enable OUT_OF_CORE_PREPROCESSING in the
+    config. It requires USE_CACHE.
+"""
+
+
+def _sample_keys(hashes: np.ndarray) -> np.ndarray:
+    # mix the row hashes with the seed, the splitmix64 finalizer is a
+    # bijection, thus distinct rows have distinct keys
+    with np.errstate(over="ignore"):
+        keys = hashes + np.uint64(SEED) * np.uint64(0x9E3779B97F4A7C15)
+        keys = (keys ^ (keys >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        keys = (keys ^ (keys >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return keys ^ (keys >> np.uint64(31))
+
+
+def _batches(file_path: str, level: int):
+    """
+    Iterate the instances of a cache file in batches, see execute_query.
+    """
+    for batch in ds.dataset(file_path, format="feather").to_batches(
+            batch_size=FETCH_BATCH_SIZE):
+        instances = batch.to_pandas()
+        if "index" in instances.columns:
+            instances = instances.set_index("index")
+        if USE_LOCAL_STORE:
+            instances = join_metrics(instances, level)
+        yield instances
+
+
+def _valid_keys(instances: pd.DataFrame):
+    # the sample keys of the instances, the instances with NAs or faulty
+    # metrics are not sampled
+    keys = _sample_keys(row_hashes(instances))
+    valid = complete_rows(instances) & keep_mask(instances)
+    return keys, valid
+
+
+def _smallest_keys(file_path: str, level: int, max_count: int) -> np.ndarray:
+    """
+    Get the sorted, smallest sample keys of the valid instances,
+    at most max_count.
+    """
+    smallest = np.empty(0, dtype=np.uint64)
+    for instances in _batches(file_path, level):
+        keys, valid = _valid_keys(instances)
+        smallest = np.unique(np.concatenate([smallest, keys[valid]]))[:max_count]
+    return smallest
+
+
+class _SampleWriter:
+    """
+    Writes the sampled instances into the rows of the matrix,
+    each instance of the sample only once.
+    """
+
+    def __init__(self, matrix: np.ndarray, columns, scaler=None):
+        """
+        Parameter:
+            matrix (np.ndarray): the matrix to fill, row by row
+            columns (list): the feature columns of the matrix
+            scaler (MinMaxScaler) (optional): fit it on the written rows
+        """
+        self._matrix = matrix
+        self._columns = columns
+        self._scaler = scaler
+        self._offset = 0
+        self.index = []
+
+    def write(self, file_path: str, level: int, sample: np.ndarray):
+        written = np.zeros(len(sample), dtype=bool)
+        for instances in _batches(file_path, level):
+            keys, valid = _valid_keys(instances)
+            positions = np.searchsorted(sample, keys)
+            in_sample = valid & (positions < len(sample))
+            in_sample[in_sample] = sample[positions[in_sample]] == keys[in_sample]
+            # keep the first of the duplicated instances
+            rows = np.flatnonzero(in_sample)
+            _, first = np.unique(positions[rows], return_index=True)
+            rows = rows[first]
+            rows = rows[~written[positions[rows]]]
+            written[positions[rows]] = True
+
+            values = instances[self._columns].to_numpy(dtype=np.float64)[rows]
+            self._matrix[self._offset:self._offset + len(rows)] = values
+            self._offset += len(rows)
+            self.index.append(instances.index[rows])
+            if self._scaler is not None and len(rows) > 0:
+                # with the feature names, like the in-memory scaler
+                self._scaler.partial_fit(
+                    pd.DataFrame(values, columns=self._columns))
+
+
+def _sample_sizes(
+        refactored_count: int,
+        non_refactored_count: int,
+        is_training_data: bool):
+    """
+    Get the number of refactored and non-refactored instances to sample,
+    with the random undersampling or the sample reduction of the training data.
+    """
+    if BALANCE_DATASET and BALANCE_DATASET_STRATEGY == "random":
+        count = min(refactored_count, non_refactored_count)
+        return count, count
+    if is_training_data and not BALANCE_DATASET and \
+            0 < TRAINING_SAMPLE_RATIO < 1:
+        ratio = TRAINING_SAMPLE_RATIO
+        non_refactored_target = math.ceil(refactored_count * (1 - ratio) / ratio)
+        if non_refactored_target <= non_refactored_count:
+            return refactored_count, non_refactored_target
+        return min(refactored_count, math.ceil(
+            non_refactored_count * ratio / (1 - ratio))), non_refactored_count
+    return refactored_count, non_refactored_count
+
+
+def _matrix_path(refactored_query: str, non_refactored_query: str) -> str:
+    # a derived file of the non-refactored instances, the larger cache file,
+    # one per pair of queries
+    query_hash = hashlib.sha1(refactored_query.encode()).hexdigest()
+    return derived_file_path(
+        non_refactored_query, f"matrix-{query_hash}", "npy")
+
+
+def retrieve_labelled_instances(
+        datasets: Iterable[str],
+        refactoring: LowLevelRefactoring,
+        is_training_data: bool = True,
+        scaler=None):
+    """
+    Retrieve the labelled instances for a given refactoring and dataset,
+    like preprocessing.retrieve_labelled_instances, without loading all
+    instances into the memory.
+
+    :return:
+        x: a dataframe with the feature values, backed by the matrix on disk
+        y: the label (1=true, a refactoring has happened,
+        0=false, no refactoring has happened)
+        scaler: the scaler object used in the scaling process.
+    """
+    log(f"---- Retrieve labeled instances out-of-core for dataset: {datasets} "
+        f"and the refactoring {refactoring.name()}")
+    level = refactoring.level_number()
+    refactored_query = refactoring.refactored_instances_query(datasets)
+    non_refactored_query = refactoring.non_refactored_instances_query(datasets)
+    refactored_path = cache_query(refactored_query)
+    non_refactored_path = cache_query(non_refactored_query)
+
+    # the refactored instances are the minority, keep at least half of the
+    # rows for the non-refactored instances
+    refactored_keys = _smallest_keys(
+        refactored_path, level, OUT_OF_CORE_MAX_ROWS // 2)
+    non_refactored_keys = _smallest_keys(
+        non_refactored_path, level, OUT_OF_CORE_MAX_ROWS - len(refactored_keys))
+    log(f"refactoring instances (sampled, without NAs and duplicates): "
+        f"{len(refactored_keys)}")
+    log(f"non-refactoring with K={refactoring.commit_threshold()} instances "
+        f"(sampled, without NAs and duplicates): {len(non_refactored_keys)}")
+    if len(refactored_keys) == 0 or len(non_refactored_keys) == 0:
+        log(f"No instances found for refactoring type: {refactoring.name()} "
+            f"with threshold: {refactoring.commit_threshold()}")
+        return None, None, None
+
+    refactored_count, non_refactored_count = _sample_sizes(
+        len(refactored_keys), len(non_refactored_keys), is_training_data)
+    # the smallest keys of the smaller sample
+    refactored_keys = refactored_keys[:refactored_count]
+    non_refactored_keys = non_refactored_keys[:non_refactored_count]
+
+    columns = [column for column in next(_batches(refactored_path, level)).columns
+               if column not in DROP_METRICS]
+    row_count = len(refactored_keys) + len(non_refactored_keys)
+    file_path = _matrix_path(refactored_query, non_refactored_query)
+    log(f"Write {row_count} instances with {len(columns)} features to {file_path}")
+    temp_path = f"{file_path}.tmp-{os.getpid()}"
+    matrix = np.lib.format.open_memmap(
+        temp_path, mode="w+", dtype=np.float64, shape=(row_count, len(columns)))
+
+    # the other balancing strategies require all instances in memory,
+    # the sample is bounded, thus it fits
+    in_memory_balancing = BALANCE_DATASET and \
+        BALANCE_DATASET_STRATEGY != "random"
+    fit_scaler = MinMaxScaler() \
+        if SCALE_DATASET and scaler is None and not in_memory_balancing \
+        else None
+    writer = _SampleWriter(matrix, columns, fit_scaler)
+    writer.write(refactored_path, level, refactored_keys)
+    writer.write(non_refactored_path, level, non_refactored_keys)
+    if SCALE_DATASET and not in_memory_balancing:
+        scaler = fit_scaler or scaler
+        for start in range(0, row_count, FETCH_BATCH_SIZE):
+            matrix[start:start + FETCH_BATCH_SIZE] = scaler.transform(
+                pd.DataFrame(matrix[start:start + FETCH_BATCH_SIZE],
+                             columns=columns))
+    matrix.flush()
+    os.replace(temp_path, file_path)
+    if CACHE_SIZE_LIMIT_GB > 0:
+        CacheCatalog.evict(
+            int(CACHE_SIZE_LIMIT_GB * 1024 ** 3),
+            keep=[CacheCatalog.query_hash_of(refactored_path),
+                  CacheCatalog.query_hash_of(non_refactored_path)])
+
+    index = writer.index[0].append(writer.index[1:])
+    x = pd.DataFrame(matrix, index=index, columns=columns, copy=False)
+    y = pd.Series(np.r_[np.ones(len(refactored_keys), dtype=np.int64),
+                        np.zeros(len(non_refactored_keys), dtype=np.int64)],
+                  index=index, name="prediction")
+
+    if in_memory_balancing:
+        log("instances before balancing: {}".format(Counter(y)))
+        x, y = perform_balancing(x, y)
+        log("instances after balancing: {}".format(Counter(y)))
+        if SCALE_DATASET and scaler is None:
+            x, scaler = perform_fit_scaling(x)
+        elif SCALE_DATASET:
+            x = perform_scaling(x, scaler)
+
+    log(f"Got {x.shape[0]} instances with {x.shape[1]} features for the "
+        f"dataset: {datasets} at threshold {refactoring.commit_threshold()}.")
+    return x, y, scaler
@@ -1,15 +1,105 @@
 from collections import Counter
 from typing import Iterable
+import numpy as np
 import pandas as pd
 from configs import SCALE_DATASET, BALANCE_DATASET, DROP_METRICS, \
-    DROP_PROCESS_AND_AUTHORSHIP_METRICS, PROCESS_AND_AUTHORSHIP_METRICS,\
-    DROP_FAULTY_PROCESS_AND_AUTHORSHIP_METRICS, TRAINING_SAMPLE_RATIO
-from ml.preprocessing.sampling import perform_balancing, sample_reduction
-from ml.preprocessing.scaling import perform_scaling, perform_fit_scaling
+    TRAINING_SAMPLE_RATIO, SCALE_FROM_CACHE_STATS
+from db.ColumnStats import combine
+from db.DBConnector import get_column_stats
+from ml.preprocessing.sampling import perform_balancing, sample_reduction, \
+    negative_sample_size
+from ml.preprocessing.scaling import perform_scaling, perform_fit_scaling, \
+    scaler_from_stats
+from ml.preprocessing import instance_pool
 from ml.refactoring import LowLevelRefactoring
 from utils.log import log
 
 
+def merge_instances(
+        refactored_instances: pd.DataFrame,
+        non_refactored_instances: pd.DataFrame,
+        refactored_rows: np.ndarray,
+        non_refactored_rows: np.ndarray):
+    """
+    Merge the refactored and non-refactored instances into the features x
+    and the labels y, 1 for the refactored instances and 0 for the others.
+
+    The given rows of the features are copied once, column by column, into a
+    single float64 matrix, without the DROP_METRICS. The instance frames are
+    not modified, e.g. the pooled non-refactored instances.
+
+    Parameter:
+        refactored_rows (np.ndarray): the positions of the refactored
+         instances to keep, see instance_pool.clean_instances
+        non_refactored_rows (np.ndarray): the positions of the non-refactored
+         instances to keep
+
+    Returns:
+        x: a dataframe with the feature values, indexed by the instance ids
+        y: the labels
+    """
+    columns = [column for column in refactored_instances.columns
+               if column not in DROP_METRICS]
+    parts = [(refactored_instances, refactored_rows),
+             (non_refactored_instances, non_refactored_rows)]
+
+    # column major, each column is filled at once and the frame wraps the
+    # matrix without copying it
+    values = np.empty((len(refactored_rows) + len(non_refactored_rows),
+                       len(columns)), dtype=np.float64, order="F")
+    offset = 0
+    for instances, rows in parts:
+        for position, column in enumerate(columns):
+            values[offset:offset + len(rows), position] = \
+                instances[column].to_numpy()[rows]
+        offset += len(rows)
+    index = refactored_instances.index[refactored_rows].append(
+        non_refactored_instances.index[non_refactored_rows])
+
+    x = pd.DataFrame(values, index=index, columns=columns, copy=False)
+    y = pd.Series(np.r_[np.ones(len(refactored_rows), dtype=np.int64),
+                        np.zeros(len(non_refactored_rows), dtype=np.int64)],
+                  index=index, name="prediction")
+    return x, y
+
+
+def stats_scaler(
+        datasets: Iterable[str],
+        refactoring: LowLevelRefactoring,
+        columns):
+    """
+    Build the scaler from the column statistics of the cached refactored and
+    non-refactored instances, see scaling.scaler_from_stats. The statistics
+    cover all cached instances, not only the balanced ones. They are only
+    used if the cleaning drops no instance by its values, see
+    instance_pool.clean_instances, otherwise the dropped instances could
+    widen the range of the columns, e.g. -1 of a faulty process metric.
+    Duplicates do not change the range.
+
+    :return: the scaler or None, if the statistics are not available, e.g.
+    the instances were sampled in the db or joined from the local store, or
+    if the cleaning drops instances
+    """
+    stats = [get_column_stats(refactoring.refactored_instances_query(datasets)),
+             get_column_stats(refactoring.non_refactored_instances_query(datasets))]
+    if any(query_stats is None for query_stats in stats):
+        log("Fit the scaler, the column statistics are not available.")
+        return None
+    stats = combine(stats)
+    if any(column_stats["na_count"] > 0 for column_stats in stats.values()):
+        log("Fit the scaler, the column statistics include instances with NAs.")
+        return None
+    if any(stats[metric]["min"] is not None and stats[metric]["min"] <= -1
+           for metric in instance_pool.faulty_metrics(stats)):
+        log("Fit the scaler, the column statistics include instances with "
+            "faulty process metrics.")
+        return None
+    scaler = scaler_from_stats(stats, list(columns))
+    if scaler is None:
+        log("Fit the scaler, the column statistics miss feature columns.")
+    return scaler
+
+
 def retrieve_labelled_instances(
         datasets: Iterable[str],
         refactoring: LowLevelRefactoring,
@@ -49,93 +139,65 @@ def retrieve_labelled_instances(
     # get all refactoring examples we have in our dataset
     refactored_instances = refactoring.get_refactored_instances(
         datasets)
-    # load non-refactoring examples
-    non_refactored_instances = refactoring.get_non_refactored_instances(
-        datasets)
+    # load non-refactoring examples, only a sample of them if the balancing
+    # drops the others anyway. They are shared by all refactorings of the
+    # level and already cleaned, see instance_pool
+    non_refactored_instances, non_refactored_rows = \
+        instance_pool.get_non_refactored_instances(
+            refactoring, datasets, negative_sample_size(
+                refactored_instances.shape[0], is_training_data))
 
     log(
         f"raw number of refactoring instances:\
              {refactored_instances.shape[0]}")
     log(
-        f"raw number of non-refactoring with K={refactoring.commit_threshold()}\
-             instances: {non_refactored_instances.shape[0]}")
+        f"number of non-refactoring with K={refactoring.commit_threshold()}\
+             instances (without NAs and duplicates):\
+             {len(non_refactored_rows)}")
 
     # if there' still a row with NAs, drop it as it'll cause a failure later
-    # on.
-    refactored_instances = refactored_instances.dropna()
-    non_refactored_instances = non_refactored_instances.dropna()
+    # on, drop the duplicates as well, see instance_pool.clean_instances
+    refactored_rows = instance_pool.clean_instances(
+        refactored_instances,
+        refactoring.refactored_instances_query(datasets))
 
     # test if any refactorings were found for the given refactoring type
-    if refactored_instances.shape[0] == 0:
+    if len(refactored_rows) == 0:
         log(
             f"No refactorings found for refactoring type:\
                  {refactoring.name()}")
         return None, None, None
 
-    if non_refactored_instances.shape[0] == 0:
+    if len(non_refactored_rows) == 0:
         log(
             f"No non-refactorings found for threshold:\
                  {refactoring.commit_threshold()}")
         return None, None, None
     # test if any refactorings were found for the given refactoring type
 
-    log("refactoring instances (after dropping NA)s: {}".format(
-        refactored_instances.shape[0]))
-    log("non-refactoring instances (after dropping NA)s: {}".format(
-        non_refactored_instances.shape[0]))
+    log("refactoring instances (after dropping NAs and duplicates): {}".format(
+        len(refactored_rows)))
+    log("non-refactoring instances (after dropping NAs and duplicates): {}".format(
+        len(non_refactored_rows)))
 
-    assert non_refactored_instances.shape[0] > 0, \
+    assert len(non_refactored_rows) > 0, \
         "Found no non-refactoring instances for level: " + refactoring.level()
 
-    # set the prediction variable as true and false in the datasets
-    refactored_instances["prediction"] = 1
-    non_refactored_instances["prediction"] = 0
-
     # reduce the amount training samples, if specified, also keep the
     # specified balance
     if is_training_data and \
             0 < TRAINING_SAMPLE_RATIO < 1 and\
             not BALANCE_DATASET:
-        refactored_instances, non_refactored_instances = sample_reduction(
-            refactored_instances, non_refactored_instances,
-            TRAINING_SAMPLE_RATIO)
-
-    refactored_instances = refactored_instances.drop_duplicates()
-    non_refactored_instances = non_refactored_instances.drop_duplicates()
-    log("refactoring instances (after dropping duplicates)s: {}".format(
-        refactored_instances.shape[0]))
-    log("non-refactoring instances (after dropping duplicates)s: {}".format(
-        non_refactored_instances.shape[0]))
+        refactored_rows, non_refactored_rows = sample_reduction(
+            refactored_rows, non_refactored_rows, TRAINING_SAMPLE_RATIO)
+
     # now, combine both datasets (with both TRUE and FALSE predictions)
-    if non_refactored_instances.shape[1] != refactored_instances.shape[1]:
+    if not non_refactored_instances.columns.equals(
+            refactored_instances.columns):
         raise ImportError("Number of columns differ from both datasets.")
-    merged_dataset = pd.concat(
-        [refactored_instances, non_refactored_instances])
-    # do we want to try the models without some metrics, e.g. process and
-    # authorship metrics?
-    merged_dataset = merged_dataset.drop(DROP_METRICS, axis=1)
-
-    # Remove all instances with a -1 value
-    # in the process and authorship metrics,
-    # ToDo: do this after the feature reduction to simplify the query and do
-    # not drop instances which are not affected by faulty process and
-    # authorship metrics, which are not in the feature set
-    if DROP_FAULTY_PROCESS_AND_AUTHORSHIP_METRICS and \
-            not DROP_PROCESS_AND_AUTHORSHIP_METRICS:
-        log("Instance count before dropping faulty process metrics: {}".format(
-            len(merged_dataset.index)))
-        metrics = [
-            metric for metric in PROCESS_AND_AUTHORSHIP_METRICS
-            if metric in merged_dataset.columns.values]
-        query = " and ".join(["%s != -1" % metric for metric in metrics])
-        merged_dataset = merged_dataset.query(query)
-        log("Instance count after dropping faulty process metrics: {}".format(
-            len(merged_dataset.index)))
-
     # separate the x from the y (as required by the scikit-learn API)
-    y = merged_dataset["prediction"]
-    x = merged_dataset.drop("prediction", axis=1)
-    # y = merged_dataset["prediction"]
+    x, y = merge_instances(refactored_instances, non_refactored_instances,
+                           refactored_rows, non_refactored_rows)
     # balance the datasets, as we have way more 'non refactored examples'
     #  rather than refactoring examples
     # for now, we basically perform under sampling
@@ -150,6 +212,8 @@ def retrieve_labelled_instances(
     # data during balancing it
 
     # apply some scaling to speed up the algorithm
+    if SCALE_DATASET and scaler is None and SCALE_FROM_CACHE_STATS:
+        scaler = stats_scaler(datasets, refactoring, x.columns)
     if SCALE_DATASET and scaler is None:
         x, scaler = perform_fit_scaling(x)
     elif SCALE_DATASET and scaler is not None:
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+from pandas.core.frame import DataFrame
+
+from db.DBConnector import read_derived, write_derived
+from utils.log import log
+
+"""
+Fingerprints of the instances, to deduplicate them and to check the overlap
+of the training and validation sets.
+
+A row hash covers the feature values of an instance only, not its id, and is
+computed vectorized, column by column, like pandas.util.hash_pandas_object.
+The values are hashed as float64, thus the same instance has the same hash,
+independent of the narrowed types of the cache schema. The hashes of a cached query result are
+stored next to its cache file, <query hash>.rowhash.ftr, and invalidated with
+it, e.g. by a refresh. Afterwards, the deduplication and the overlap checks
+are operations on integer arrays.
+"""
+
+ROW_HASH = "row_hash"
+# the name of the derived file, see DBConnector.derived_file_path
+_DERIVED_NAME = "rowhash"
+
+
+def _float_values(column: pd.Series) -> np.ndarray:
+    # the values of the column as float64, only narrowed columns are copied
+    values = column.to_numpy()
+    if values.dtype != np.float64:
+        values = column.astype("float64").to_numpy()
+    return values
+
+
+def row_hashes(instances: DataFrame) -> np.ndarray:
+    """
+    Hash the feature values of each instance, the index is not hashed.
+    The column hashes are combined like hash_pandas_object(index=False) of
+    the float64 frame does, without copying the frame.
+
+    Returns:
+        an uint64 array with a hash per row
+    """
+    hashes = np.full(instances.shape[0], 0x345678, dtype=np.uint64)
+    multiplier = np.uint64(1000003)
+    column_count = instances.shape[1]
+    for position, column in enumerate(instances.columns):
+        hashes ^= pd.util.hash_array(_float_values(instances[column]))
+        hashes *= multiplier
+        multiplier += np.uint64(82520 + 2 * (column_count - position))
+    hashes += np.uint64(97531)
+    return hashes
+
+
+def complete_rows(instances: DataFrame) -> np.ndarray:
+    """
+    Get a mask of the instances without NAs.
+    """
+    complete = np.ones(instances.shape[0], dtype=bool)
+    for column in instances.columns:
+        complete &= instances[column].notna().to_numpy()
+    return complete
+
+
+def cached_row_hashes(instances: DataFrame, sql_query: str) -> np.ndarray:
+    """
+    Get the row hashes of the result of the query, stored with its cache file.
+
+    Parameter:
+        instances (DataFrame): the result of the query, see execute_query
+        sql_query (str): the query, the hashes are stored for
+    """
+    stored = read_derived(sql_query, _DERIVED_NAME)
+    if stored is not None and stored.index.equals(instances.index):
+        return stored[ROW_HASH].to_numpy()
+
+    hashes = row_hashes(instances)
+    write_derived(DataFrame({ROW_HASH: hashes}, index=instances.index),
+                  sql_query, _DERIVED_NAME)
+    return hashes
+
+
+def unique_rows(hashes: np.ndarray, keep: np.ndarray) -> np.ndarray:
+    """
+    Restrict the mask of the instances to keep to the first of all instances
+    with the same hash.
+    """
+    unique = np.zeros(len(hashes), dtype=bool)
+    _, first = np.unique(hashes[keep], return_index=True)
+    unique[np.flatnonzero(keep)[first]] = True
+    return unique
+
+
+def count_overlap(hashes: np.ndarray, other_hashes: np.ndarray) -> int:
+    """
+    Count the rows of the first hashes, which are also in the others.
+    """
+    return int(np.isin(hashes, other_hashes).sum())
+
+
+def log_overlap(train_hashes: np.ndarray, x_val: DataFrame, name: str):
+    """
+    Log the number of validation instances with the feature values of a
+    training instance.
+
+    Parameter:
+        train_hashes (np.ndarray): the row hashes of the training set
+        x_val (DataFrame): the features of the validation set
+        name (str): the name of the validation set
+    """
+    overlap = count_overlap(row_hashes(x_val), train_hashes)
+    log(f"{overlap} of the {x_val.shape[0]} instances of the validation set "
+        f"{name} are in the training set as well.")
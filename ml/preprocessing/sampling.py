@@ -1,8 +1,14 @@
+import math
+import numpy as np
 import pandas as pd
 from imblearn.over_sampling import RandomOverSampler
 from imblearn.under_sampling import RandomUnderSampler,\
     ClusterCentroids, NearMiss
-from configs import BALANCE_DATASET_STRATEGY, CORE_COUNT, SEED
+from configs import BALANCE_DATASET_STRATEGY, CORE_COUNT, SEED, \
+    BALANCE_DATASET, TRAINING_SAMPLE_RATIO, SERVER_SIDE_SAMPLING, \
+    SERVER_SIDE_SAMPLING_FACTOR, BALANCING_TIME_BUDGET, BALANCING_MAX_SAMPLES
+from ml.preprocessing.approximate_sampling import \
+    ApproximateClusterCentroids, ApproximateNearMiss
 from utils.log import log
 
 
@@ -11,37 +17,82 @@ def sample_reduction(positive_samples, negative_samples, ratio: float):
     Reduce the number of training samples in the dataset
     to the match the given ratio
     Parameter:
-        positive_samples (DataFrame):    The positive training samples
-        negative_samples (DataFrame):   The negative training samples
+        positive_samples (np.ndarray):  The rows of the positive training
+        samples
+        negative_samples (np.ndarray):  The rows of the negative training
+        samples
         ratio  (float):                 Ratio of the positive and
         negative samples for the training, e.g. 0.1 -> 10/% positive samples
     """
     # apply the lower boundary to the fraction, ensure the fraction is still
     # in range 0 - 1
-    total_count = len(positive_samples.index) + len(negative_samples.index)
-    fraction_positive = total_count * ratio / len(positive_samples.index)
-    fraction_negative = total_count * (1 - ratio) / len(negative_samples.index)
+    total_count = len(positive_samples) + len(negative_samples)
+    fraction_positive = total_count * ratio / len(positive_samples)
+    fraction_negative = total_count * (1 - ratio) / len(negative_samples)
     # positive limits
     if fraction_positive > 1.0:
-        fraction_negative = len(positive_samples.index) * \
-            ((1 - ratio) / ratio) / len(negative_samples.index)
+        fraction_negative = len(positive_samples) * \
+            ((1 - ratio) / ratio) / len(negative_samples)
         fraction_positive = 1.0
     # negative limits
     elif fraction_negative > 1.0:
-        fraction_positive = len(negative_samples.index) * \
-            (ratio / (1 - ratio)) / len(positive_samples.index)
+        fraction_positive = len(negative_samples) * \
+            (ratio / (1 - ratio)) / len(positive_samples)
         fraction_negative = 1.0
 
-    positive_samples = positive_samples.sample(frac=fraction_positive)
-    negative_samples = negative_samples.sample(frac=fraction_negative)
+    # like DataFrame.sample(frac=...)
+    positive_samples = np.random.choice(
+        positive_samples, round(fraction_positive * len(positive_samples)),
+        replace=False)
+    negative_samples = np.random.choice(
+        negative_samples, round(fraction_negative * len(negative_samples)),
+        replace=False)
     log(
         f"Reduced the number of samples to\
-             {len(positive_samples.index)}/\
-                  {len(negative_samples.index)} ({ratio}/ {1-ratio})",
-        False)
+             {len(positive_samples)}/\
+                  {len(negative_samples)} ({ratio}/ {1-ratio})")
     return positive_samples, negative_samples
 
 
+def negative_sample_size(positive_count: int, is_training_data: bool):
+    """
+    Get the number of negative samples kept by the balancing or the sample
+    reduction, in order to sample the negative instances in the db.
+
+    Parameter:
+        positive_count (int): the number of positive samples
+        is_training_data (bool): the sample reduction is only applied to the
+         training data
+    Returns:
+        the number of negative samples or None, if all negative samples are
+        required, e.g. for the cluster centroids balancing
+    """
+    if not SERVER_SIDE_SAMPLING:
+        return None
+    if BALANCE_DATASET and BALANCE_DATASET_STRATEGY == "random":
+        return positive_count
+    if is_training_data and not BALANCE_DATASET and \
+            0 < TRAINING_SAMPLE_RATIO < 1:
+        return math.ceil(
+            positive_count * (1 - TRAINING_SAMPLE_RATIO) / TRAINING_SAMPLE_RATIO)
+    return None
+
+
+def sample_fraction(sample_size: int, total_count: int) -> float:
+    """
+    Get the fraction of the instances to sample in the db, in order to get
+    about SERVER_SIDE_SAMPLING_FACTOR times the sample size. The fraction is
+    rounded up to a power of two, thus similar sample sizes share their
+    sample and its cache.
+    """
+    if total_count == 0:
+        return 1.0
+    fraction = sample_size * SERVER_SIDE_SAMPLING_FACTOR / total_count
+    if fraction >= 1 or fraction <= 0:
+        return 1.0
+    return min(1.0, 2.0 ** math.ceil(math.log2(fraction)))
+
+
 def perform_balancing(x, y, strategy=None):
     """
     Performs under/over sampling, according to the
@@ -64,6 +115,14 @@ def perform_balancing(x, y, strategy=None):
         rus = ClusterCentroids(random_state=SEED, n_jobs=CORE_COUNT)
     elif strategy == 'nearmiss':
         rus = NearMiss(version=1, n_jobs=CORE_COUNT)
+    elif strategy == 'cluster_centroids_approx':
+        rus = ApproximateClusterCentroids(
+            time_budget=BALANCING_TIME_BUDGET,
+            max_samples=BALANCING_MAX_SAMPLES, random_state=SEED)
+    elif strategy == 'nearmiss_approx':
+        rus = ApproximateNearMiss(
+            time_budget=BALANCING_TIME_BUDGET,
+            max_samples=BALANCING_MAX_SAMPLES, random_state=SEED)
     else:
         raise ValueError("algorithm not found")
 
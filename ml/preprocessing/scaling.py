@@ -21,6 +21,45 @@ def perform_fit_scaling(x):
     return x, scaler
 
 
+def scaler_from_stats(stats, columns):
+    """
+    Build a fitted MinMaxScaler from the column statistics of the cache,
+    without loading the instances, see db/ColumnStats.py.
+
+    :param stats: the statistics by column, e.g. of ColumnStats.combine
+    :param columns: the feature columns, in the order of x
+    :return: the scaler or None, if a column has no min or max
+    """
+    if any(column not in stats or stats[column]["min"] is None
+           or stats[column]["max"] is None for column in columns):
+        return None
+    # the min and max rows of all columns fit the scaler to their range
+    bounds = pd.DataFrame(
+        [[stats[column]["min"] for column in columns],
+         [stats[column]["max"] for column in columns]],
+        columns=columns)
+    return MinMaxScaler().fit(bounds)
+
+
+def select_scaler_columns(scaler, columns, selected_columns):
+    """
+    Restrict a fitted MinMaxScaler to some of its columns, e.g. after
+    features were dropped. The columns are scaled independently, thus the
+    selected columns are scaled as before.
+
+    :param scaler: the fitted scaler
+    :param columns: the columns the scaler was fit on, in their order
+    :param selected_columns: the columns to keep, in the order of x
+    :return: the restricted scaler
+    """
+    positions = [list(columns).index(column) for column in selected_columns]
+    bounds = pd.DataFrame(
+        [scaler.data_min_[positions], scaler.data_max_[positions]],
+        columns=selected_columns)
+    return MinMaxScaler(
+        feature_range=scaler.feature_range, clip=scaler.clip).fit(bounds)
+
+
 def perform_scaling(x, scaler):
     """
     Scales all the values between [0,1].\
@@ -1,7 +1,11 @@
 from typing import Iterable
-from configs import LEVEL_MAP, Level, LEVEL_Stable_Thresholds_MAP
-from db.QueryBuilder import get_level_refactorings, get_level_stable
-from db.DBConnector import execute_query
+from configs import LEVEL_MAP, Level, LEVEL_Stable_Thresholds_MAP, \
+    USE_LOCAL_STORE, COALESCE_STABLE_THRESHOLDS
+from db.QueryBuilder import get_level_refactorings, get_level_stable, \
+    get_level_stable_thresholds, get_level_stable_count
+from db.DBConnector import execute_query, cache_partitioned_query
+from db.LocalStore import join_metrics
+from ml.preprocessing.sampling import sample_fraction
 from utils.log import log
 
 
@@ -27,10 +31,21 @@ class LowLevelRefactoring:
             dataset (str) (optional): filter the refactoring instances
             for this dataset. If no dataset is specified, no filter is applied.
         """
-        return execute_query(get_level_refactorings(
-            int(self._level), self._name, datasets))
+        return self._load(self.refactored_instances_query(datasets))
 
-    def get_non_refactored_instances(self, datasets: Iterable[str]):
+    def refactored_instances_query(self, datasets: Iterable[str] = []) -> str:
+        """
+        Get the query of the refactoring instances,
+         see get_refactored_instances.
+        """
+        return get_level_refactorings(
+            int(self._level), self._name, datasets,
+            references_only=USE_LOCAL_STORE)
+
+    def get_non_refactored_instances(
+            self,
+            datasets: Iterable[str],
+            target_count: int = None):
         """
         Get all non-refactored (stable) instances of the same level of the
         refactoring, e.g. Level 2 for refactoring "Extract Method".
@@ -38,9 +53,59 @@ class LowLevelRefactoring:
         Parameter:
             dataset (str) (optional): filter the non-refactored
             for this dataset. If no dataset is specified, no filter is applied.
+            target_count (int) (optional): only a sample of about this many
+            instances is required, it is drawn in the db,
+            see ml.preprocessing.sampling.sample_fraction
+        """
+        if target_count is not None:
+            total_count = execute_query(get_level_stable_count(
+                int(self._level), self._commit_threshold, datasets)).iloc[0, 0]
+            fraction = sample_fraction(target_count, int(total_count))
+            if fraction < 1:
+                log(f"Sample {fraction} of the {total_count} non-refactored "
+                    f"instances in the db, {target_count} are required.")
+                return self._load(
+                    self.non_refactored_instances_query(datasets, fraction))
+
+        if COALESCE_STABLE_THRESHOLDS:
+            self._cache_stable_thresholds(datasets)
+        return self._load(self.non_refactored_instances_query(datasets))
+
+    def _cache_stable_thresholds(self, datasets: Iterable[str]):
+        # fetch the instances of all thresholds of this level at once, the
+        # other thresholds are cached for their refactorings
+        commit_thresholds = set(
+            LEVEL_Stable_Thresholds_MAP[self._level]) | {self._commit_threshold}
+        cache_partitioned_query(
+            lambda thresholds: get_level_stable_thresholds(
+                int(self._level), thresholds, datasets,
+                references_only=USE_LOCAL_STORE),
+            "commitThreshold",
+            {k: LowLevelRefactoring(self._name, self._level, k)
+             .non_refactored_instances_query(datasets)
+             for k in commit_thresholds})
+
+    def non_refactored_instances_query(
+            self,
+            datasets: Iterable[str],
+            fraction: float = 1.0) -> str:
+        """
+        Get the query of the non-refactored instances,
+         see get_non_refactored_instances.
+
+        Parameter:
+            dataset (str): filter the non-refactored for this dataset.
+            fraction (float) (optional): sample this fraction of the instances
         """
-        return execute_query(get_level_stable(
-            int(self._level), self._commit_threshold, datasets))
+        return get_level_stable(
+            int(self._level), self._commit_threshold, datasets,
+            references_only=USE_LOCAL_STORE, sample_fraction=fraction)
+
+    def _load(self, sql_query: str):
+        instances = execute_query(sql_query)
+        if USE_LOCAL_STORE:
+            return join_metrics(instances, int(self._level))
+        return instances
 
     def level(self) -> str:
         """
@@ -49,6 +114,13 @@ class LowLevelRefactoring:
         """
         return str(self._level)
 
+    def level_number(self) -> int:
+        """
+        Get the level of the refactoring type as number,
+        e.g. 4 for "Push Down Attribute"
+        """
+        return int(self._level)
+
     def name(self) -> str:
         """
         Get the name of the refactoring type, e.g. "Push Down Attribute"
@@ -0,0 +1,93 @@
+import math
+from typing import Iterable, List
+
+import numpy as np
+
+"""
+The distributions of the hyperparameters, see search_space of the models.
+
+Each distribution maps its values to and from the unit interval, where the
+TPE search models the good and the bad values of a hyperparameter. Float and
+Integer are uniform in the unit interval, or log-uniform with log=True, and
+Categorical holds a list of choices, e.g. None or strings.
+"""
+
+
+class Float:
+    """
+    A float uniform between low and high, or log-uniform with log=True.
+    """
+
+    def __init__(self, low: float, high: float, log: bool = False):
+        if not low < high:
+            raise ValueError(f"low {low} has to be smaller than high {high}")
+        if log and low <= 0:
+            raise ValueError(f"low {low} has to be positive with log=True")
+        self.low = low
+        self.high = high
+        self.log = log
+
+    def _bounds(self):
+        return self.low, self.high
+
+    def to_unit(self, values: Iterable) -> np.ndarray:
+        low, high = self._bounds()
+        values = np.asarray(list(values), dtype=np.float64)
+        if self.log:
+            return (np.log(values) - math.log(low)) / (math.log(high) - math.log(low))
+        return (values - low) / (high - low)
+
+    def from_unit(self, units: np.ndarray) -> List:
+        low, high = self._bounds()
+        units = np.clip(units, 0.0, 1.0)
+        if self.log:
+            values = np.exp(math.log(low) + units * (math.log(high) - math.log(low)))
+        else:
+            values = low + units * (high - low)
+        return [float(value) for value in np.clip(values, self.low, self.high)]
+
+    def sample(self, size: int, random_state: np.random.RandomState) -> List:
+        return self.from_unit(random_state.uniform(size=size))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.low}, {self.high}, log={self.log})"
+
+
+class Integer(Float):
+    """
+    An integer uniform between low and high (both inclusive), or log-uniform
+    with log=True.
+    """
+
+    def __init__(self, low: int, high: int, log: bool = False):
+        super().__init__(low, high, log)
+
+    def _bounds(self):
+        # each integer covers an interval of the same width
+        return self.low - 0.5, self.high + 0.5
+
+    def from_unit(self, units: np.ndarray) -> List:
+        return [int(min(max(round(value), self.low), self.high))
+                for value in super().from_unit(units)]
+
+
+class Categorical:
+    """
+    One of the choices, e.g. ["gini", "entropy"] or [3, 6, None].
+    """
+
+    def __init__(self, choices: Iterable):
+        self.choices = list(choices)
+        if len(self.choices) == 0:
+            raise ValueError("the choices are empty")
+
+    def indices(self, values: Iterable) -> np.ndarray:
+        return np.asarray([self.choices.index(value) for value in values],
+                          dtype=np.int64)
+
+    def sample(self, size: int, random_state: np.random.RandomState) -> List:
+        return [self.choices[index]
+                for index in random_state.randint(len(self.choices), size=size)]
+
+    def __repr__(self):
+        return f"Categorical({self.choices})"
@@ -0,0 +1,296 @@
+import math
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone, is_classifier
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import check_cv
+from sklearn.utils import _safe_indexing
+
+from ml.search.distributions import Categorical
+from utils.log import log
+
+"""
+A sequential model-based hyperparameter search with a tree-structured Parzen
+estimator (TPE), it runs offline and needs no additional dependency.
+
+The search starts with n_initial_points random candidates. Afterwards it
+splits the evaluated candidates into the best gamma fraction and the rest,
+models the values of each hyperparameter in both groups with a Parzen
+estimator and proposes the candidates with the highest ratio of the good to
+the bad density. The candidates are proposed in batches of batch_size, the
+folds of a batch are evaluated in parallel. The search stops after n_iter
+candidates or if the best score did not improve for patience batches.
+
+Like GridSearchCV it provides best_params_, best_score_, best_estimator_ and
+cv_results_.
+"""
+
+
+def _fit_and_score(estimator, params, X, y, train, test, scorer):
+    """
+    Fit the candidate on the train fold and score it on the test fold.
+    A failed fit scores nan, e.g. an invalid combination of parameters.
+
+    Returns:
+        the score and the error of a failed fit, or None
+    """
+    try:
+        estimator = clone(estimator).set_params(**params)
+        estimator.fit(_safe_indexing(X, train), _safe_indexing(y, train))
+        return scorer(estimator, _safe_indexing(X, test),
+                      _safe_indexing(y, test)), None
+    except Exception as e:
+        return np.nan, f"{type(e).__name__}: {e}"
+
+
+class TPESearchCV:
+    """
+    Search the hyperparameters of the estimator in the search space, a dict
+    of Float, Integer and Categorical distributions, with a TPE.
+    """
+
+    def __init__(
+            self,
+            estimator,
+            search_space: dict,
+            n_iter: int = 50,
+            batch_size: int = 4,
+            n_initial_points: int = 10,
+            patience: int = 5,
+            gamma: float = 0.25,
+            n_ei_candidates: int = 24,
+            cv=None,
+            scoring=None,
+            n_jobs=None,
+            random_state=None,
+            refit: bool = True):
+        """
+        Parameter:
+            estimator: the estimator to tune
+            search_space (dict): the distribution of each hyperparameter
+            n_iter (int): the maximum number of evaluated candidates
+            batch_size (int): the number of candidates evaluated in parallel
+            n_initial_points (int): the number of random candidates
+            patience (int): stop after this many batches without improvement,
+             None -> never stop early
+            gamma (float): the fraction of the candidates modeled as good
+            n_ei_candidates (int): the number of samples of the good density,
+             the best of them is proposed
+            cv: the folds, like the cv of GridSearchCV
+            scoring: the scoring, like the scoring of GridSearchCV
+            n_jobs (int): the number of parallel fits
+            random_state (int): the seed of the search
+            refit (bool): refit the best estimator on all instances
+        """
+        self.estimator = estimator
+        self.search_space = search_space
+        self.n_iter = n_iter
+        self.batch_size = batch_size
+        self.n_initial_points = n_initial_points
+        self.patience = patience
+        self.gamma = gamma
+        self.n_ei_candidates = n_ei_candidates
+        self.cv = cv
+        self.scoring = scoring
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.refit = refit
+
+    def fit(self, X, y):
+        random_state = np.random.RandomState(self.random_state)
+        cv = check_cv(self.cv, y, classifier=is_classifier(self.estimator))
+        # all candidates are evaluated on the same folds
+        splits = list(cv.split(X, y))
+        scorer = check_scoring(self.estimator, scoring=self.scoring)
+
+        candidates, fold_scores = [], []
+        best_score, stale_batches = -np.inf, 0
+        failed_fits, first_error = 0, None
+        start_time = time.time()
+        with Parallel(n_jobs=self.n_jobs) as parallel:
+            while len(candidates) < self.n_iter:
+                size = min(self.batch_size, self.n_iter - len(candidates))
+                if len(candidates) < self.n_initial_points:
+                    batch = self._random_candidates(size, random_state)
+                else:
+                    batch = self._propose(
+                        candidates, self._mean_scores(fold_scores), size,
+                        random_state)
+                results = parallel(
+                    delayed(_fit_and_score)(
+                        self.estimator, params, X, y, train, test, scorer)
+                    for params in batch for train, test in splits)
+                errors = [(position // len(splits), error)
+                          for position, (_, error) in enumerate(results)
+                          if error is not None]
+                if failed_fits == 0 and len(errors) > 0:
+                    # like the error_score warning of scikit-learn, the
+                    # following failures are only counted
+                    position, first_error = errors[0]
+                    log(f"A fit of the bayesian search failed with "
+                        f"{batch[position]}, it scores nan. {first_error}")
+                failed_fits += len(errors)
+                scores = np.asarray([score for score, _ in results],
+                                    dtype=np.float64).reshape(
+                    len(batch), len(splits))
+                candidates.extend(batch)
+                fold_scores.extend(scores)
+
+                batch_scores = self._mean_scores(scores)
+                batch_best = -np.inf if np.isnan(batch_scores).all() \
+                    else np.nanmax(batch_scores)
+                if batch_best > best_score:
+                    best_score, stale_batches = batch_best, 0
+                elif len(candidates) > self.n_initial_points:
+                    stale_batches += 1
+                log(f"Bayesian search: {len(candidates)} candidates evaluated, "
+                    f"best score {best_score}")
+                if self.patience is not None and stale_batches >= self.patience:
+                    log(f"Stopped the bayesian search, the best score did not "
+                        f"improve for {stale_batches} batches.")
+                    break
+
+        if failed_fits > 0:
+            log(f"{failed_fits} of {len(candidates) * len(splits)} fits of "
+                f"the bayesian search failed.")
+        if failed_fits == len(candidates) * len(splits):
+            raise ValueError(
+                f"All fits of the bayesian search failed, e.g. {first_error}")
+        self._set_results(candidates, np.asarray(fold_scores))
+        log(f"Bayesian search of {len(candidates)} candidates took "
+            f"{time.time() - start_time:.0f} seconds.")
+        if self.refit:
+            self.best_estimator_ = clone(self.estimator).set_params(
+                **self.best_params_)
+            self.best_estimator_.fit(X, y)
+        return self
+
+    def _mean_scores(self, fold_scores) -> np.ndarray:
+        # candidates with failed fits score nan
+        return np.asarray([np.mean(scores) for scores in fold_scores])
+
+    def _set_results(self, candidates, fold_scores: np.ndarray):
+        mean_scores = self._mean_scores(fold_scores)
+        failed = np.isnan(mean_scores)
+        if failed.all():
+            raise ValueError("All candidates of the bayesian search failed.")
+        ranked = np.where(failed, -np.inf, mean_scores)
+        self.best_index_ = int(np.argmax(ranked))
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = float(mean_scores[self.best_index_])
+        self.n_iter_ = len(candidates)
+        order = np.argsort(-ranked, kind="stable")
+        rank = np.empty(len(candidates), dtype=np.int64)
+        rank[order] = np.arange(1, len(candidates) + 1)
+        self.cv_results_ = {
+            "params": candidates,
+            "mean_test_score": mean_scores,
+            "std_test_score": np.asarray([np.std(scores) for scores in fold_scores]),
+            "rank_test_score": rank}
+        for name in self.search_space:
+            self.cv_results_[f"param_{name}"] = [params[name] for params in candidates]
+
+    def _random_candidates(self, size: int, random_state) -> list:
+        values = {name: distribution.sample(size, random_state)
+                  for name, distribution in self.search_space.items()}
+        return [{name: values[name][index] for name in values}
+                for index in range(size)]
+
+    def _propose(self, candidates, mean_scores, size: int, random_state) -> list:
+        # the best gamma fraction is good, failed candidates are bad
+        ranked = np.where(np.isnan(mean_scores), -np.inf, mean_scores)
+        order = np.argsort(-ranked, kind="stable")
+        n_good = max(1, int(math.ceil(self.gamma * len(candidates))))
+        good = [candidates[index] for index in order[:n_good]]
+        bad = [candidates[index] for index in order[n_good:]]
+
+        seen = {repr(sorted(params.items(), key=str)) for params in candidates}
+        batch = []
+        for _ in range(size):
+            samples = {}
+            log_ratio = np.zeros(self.n_ei_candidates)
+            for name, distribution in self.search_space.items():
+                good_values = [params[name] for params in good]
+                bad_values = [params[name] for params in bad]
+                samples[name], ratio = _sample_parameter(
+                    distribution, good_values, bad_values,
+                    self.n_ei_candidates, random_state)
+                log_ratio += ratio
+            proposal = None
+            for index in np.argsort(-log_ratio, kind="stable"):
+                params = {name: samples[name][index] for name in samples}
+                if repr(sorted(params.items(), key=str)) not in seen:
+                    proposal = params
+                    break
+            if proposal is None:
+                # all samples were evaluated before, e.g. a small search space
+                proposal = self._random_candidates(1, random_state)[0]
+            seen.add(repr(sorted(proposal.items(), key=str)))
+            batch.append(proposal)
+        return batch
+
+
+def _sample_parameter(distribution, good_values, bad_values, size, random_state):
+    """
+    Sample values of a hyperparameter from its density in the good
+    candidates.
+
+    Returns:
+        the values and the log ratio of their density in the good and in the
+        bad candidates
+    """
+    if isinstance(distribution, Categorical):
+        good_weights = _categorical_weights(distribution, good_values)
+        bad_weights = _categorical_weights(distribution, bad_values)
+        indices = random_state.choice(
+            len(distribution.choices), size=size, p=good_weights)
+        return [distribution.choices[index] for index in indices], \
+            np.log(good_weights[indices]) - np.log(bad_weights[indices])
+
+    good_units = distribution.to_unit(good_values)
+    bad_units = distribution.to_unit(bad_values)
+    units = _parzen_sample(good_units, size, random_state)
+    values = distribution.from_unit(units)
+    # the density of the rounded values, e.g. of integers
+    units = distribution.to_unit(values)
+    return values, np.log(_parzen_density(good_units, units)) - \
+        np.log(_parzen_density(bad_units, units))
+
+
+def _categorical_weights(distribution: Categorical, values) -> np.ndarray:
+    # the frequency of each choice, smoothed with one prior observation each
+    counts = np.bincount(distribution.indices(values),
+                         minlength=len(distribution.choices)) + 1.0
+    return counts / counts.sum()
+
+
+def _bandwidth(units: np.ndarray) -> float:
+    # scott's rule, it narrows with more observations
+    count = len(units)
+    spread = 1.06 * np.std(units) * count ** -0.2 if count > 1 else 0.0
+    return max(spread, 0.5 / (count + 1))
+
+
+def _parzen_sample(units: np.ndarray, size: int, random_state) -> np.ndarray:
+    """
+    Sample from a mixture of a gaussian at each unit and a uniform prior,
+    the prior has the weight of a single unit.
+    """
+    components = random_state.randint(len(units) + 1, size=size)
+    from_prior = components == len(units)
+    samples = random_state.uniform(size=size)
+    centers = units[components[~from_prior]]
+    samples[~from_prior] = centers + random_state.normal(
+        scale=_bandwidth(units), size=len(centers))
+    return np.clip(samples, 0.0, 1.0)
+
+
+def _parzen_density(units: np.ndarray, points: np.ndarray) -> np.ndarray:
+    if len(units) == 0:
+        return np.ones(len(points))
+    bandwidth = _bandwidth(units)
+    kernels = np.exp(-0.5 * ((points[:, None] - units[None, :]) / bandwidth) ** 2) \
+        / (bandwidth * math.sqrt(2 * math.pi))
+    return (kernels.sum(axis=1) + 1.0) / (len(units) + 1)
@@ -45,6 +45,9 @@ def log(msg):
         msg = json.dumps(msg, indent=2)
     print(msg)
     global _f
+    # tools like manage_cache.py only log to the terminal
+    if _f is None:
+        return
     _f.write(msg)
     _f.write("\n")
     _f.flush()
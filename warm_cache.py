@@ -1,7 +1,14 @@
-from configs import DATASETS, Level, VALIDATION_DATASETS, CACHE_DIR_PATH, LEVEL_MAP
-from db.QueryBuilder import get_level_stable, get_level_refactorings_count, get_level_refactorings
-from db.DBConnector import execute_query, close_connection
+from configs import DATASETS, Level, VALIDATION_DATASETS, CACHE_DIR_PATH, \
+    LEVEL_MAP, WARM_UP_CONCURRENCY, USE_LOCAL_STORE
+from db.QueryBuilder import get_level_stable, get_level_refactorings_count, get_level_refactorings, \
+    get_level_stable_thresholds, get_instance_counts, get_metrics_level, get_table_rows
+from db.DBConnector import cache_query, cache_partitioned_query, cached_row_count, close_connection, \
+    cache_file_path, cancel_futures
 from utils.log import log_init, log_close, log
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from pathlib import Path
+import threading
 import time
 import datetime
 from os import path
@@ -10,32 +17,148 @@ from os import path
 """
 The amount of samples for refactorings and non-refactorings in the database is enormous, thus caching the relevant data on your local machine can speed up the machine learning process.
 
-This class fetches the training data for refactoring instances and non-refactoring instances, as configured, from the database and stores the results of the queries in cache files. 
+This class fetches the training data for refactoring instances and non-refactoring instances, as configured, from the database and stores the results of the queries in cache files.
+
+All queries are collected up front and executed on WARM_UP_CONCURRENCY workers, the non-refactored instances of all thresholds of a level are fetched with a single query. Finished queries are recorded in a manifest in the cache directory, a rerun of an interrupted warm-up skips them.
 
 Note:
     In order to use this feature, ensure in the USE_CACHE is enabled in the config.
 """
 
-log_init(path.join(CACHE_DIR_PATH, "results", f"warm-up_cache_{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.txt"))
-log('Begin cache warm-up')
-start_time = time.time()
-
-for dataset in DATASETS + VALIDATION_DATASETS:
-    for level in [Level.Class, Level.Method, Level.Variable, Level.Field, Level.Other]:
-        log(f"-- non refactored instances for {level} for dataset: {dataset}")
-        for k in [15, 20, 25, 30, 35, 40, 45, 50, 60, 70, 80, 90, 100]:
-            log(f"---- non refactored instances with k {k} for {level} for dataset: {dataset}")
-            non_refactored = execute_query(get_level_stable(int(level), k, dataset))
-            log(str(len(non_refactored)) + " non-refactored instances were found for level: " + str(level))
-
-        log(f"-- {level} refactoring types with count for dataset: {dataset}")
-        refactorings = execute_query(get_level_refactorings_count(int(level), dataset))
-        log(refactorings.to_string())
-        for refactoring_name in LEVEL_MAP[level]:
-            log(f"---- {refactoring_name} for dataset: {dataset}")
-            execute_query(get_level_refactorings(int(level), refactoring_name, dataset))
-
-
-log('Cache warm-up took %s seconds.' % (time.time() - start_time))
-log_close()
-close_connection()
\ No newline at end of file
+# warm up the non-refactored instances for these commit thresholds
+COMMIT_THRESHOLDS = [15, 20, 25, 30, 35, 40, 45, 50, 60, 70, 80, 90, 100]
+MANIFEST_PATH = path.join(CACHE_DIR_PATH, "cache", "warm-up_manifest.txt")
+
+_manifest_lock = threading.Lock()
+
+
+def build_tasks():
+    """
+    Build all tasks of the warm-up.
+
+    Returns:
+        a list of (description, queries, build_query) tuples, a task caches its queries
+        with a single coalesced query built by build_query, if given, see cache_partitioned_query
+    """
+    # the pre-flight counts of the pipeline, see ml/preflight.py
+    tasks = [("instance counts for all datasets",
+              {None: get_instance_counts(tuple(DATASETS + VALIDATION_DATASETS))},
+              None)]
+    levels = [Level.Class, Level.Method, Level.Variable, Level.Field, Level.Other]
+    if USE_LOCAL_STORE:
+        # the instance queries only select the metric row ids, the metrics are read from the
+        # metric tables in the local store, see db/LocalStore.py
+        metric_tables = {table_name for level in levels for table_name, _ in get_metrics_level(int(level))}
+        for table_name in sorted(metric_tables):
+            tasks.append((f"metric table {table_name}", {None: get_table_rows(table_name)}, None))
+    for dataset in DATASETS + VALIDATION_DATASETS:
+        for level in levels:
+            tasks.append((f"non refactored instances with k {COMMIT_THRESHOLDS} for {level} for dataset: {dataset}",
+                          {k: get_level_stable(int(level), k, [dataset], references_only=USE_LOCAL_STORE)
+                           for k in COMMIT_THRESHOLDS},
+                          partial(get_level_stable_thresholds, int(level), dataset=[dataset],
+                                  references_only=USE_LOCAL_STORE)))
+            tasks.append((f"{level} refactoring types with count for dataset: {dataset}",
+                          {None: get_level_refactorings_count(int(level), [dataset])},
+                          None))
+            for refactoring_name in LEVEL_MAP[level]:
+                tasks.append((f"{refactoring_name} for dataset: {dataset}",
+                              {None: get_level_refactorings(int(level), refactoring_name, [dataset],
+                                                     references_only=USE_LOCAL_STORE)},
+                              None))
+    # the refactoring lists contain duplicates, e.g. Extract And Move Method
+    unique_tasks = {}
+    for description, queries, build_query in tasks:
+        unique_tasks.setdefault(tuple(queries.values()), (description, queries, build_query))
+    return list(unique_tasks.values())
+
+
+def load_manifest():
+    """
+    Load the hashes of all queries finished by previous warm-ups.
+    """
+    if not path.exists(MANIFEST_PATH):
+        return set()
+    with open(MANIFEST_PATH) as f:
+        return set(line.strip() for line in f if len(line.strip()) > 0)
+
+
+def _finish(query_hash: str):
+    with _manifest_lock:
+        with open(MANIFEST_PATH, "a") as f:
+            f.write(query_hash + "\n")
+
+
+def _query_hash(sql_query: str) -> str:
+    return Path(cache_file_path(sql_query)).stem
+
+
+def warm_task(description: str, queries, build_query=None):
+    """
+    Cache all queries of the task, if they are not cached yet, and record them in the manifest.
+
+    Returns:
+        the latency in seconds, the row count and the size of the cache file of each query,
+        the latency of a coalesced query is split by the row counts of its queries
+    """
+    coalesced_start = time.time()
+    if build_query is not None:
+        cache_partitioned_query(build_query, "commitThreshold", queries)
+    coalesced_latency = time.time() - coalesced_start
+    latencies = {}
+    for sql_query in queries.values():
+        query_start = time.time()
+        cache_query(sql_query)
+        latencies[sql_query] = time.time() - query_start
+    rows = {sql_query: cached_row_count(sql_query) for sql_query in queries.values()}
+    total_rows = sum(rows.values())
+    results = []
+    for sql_query in queries.values():
+        share = rows[sql_query] / total_rows if total_rows > 0 else 1 / len(queries)
+        results.append((sql_query, latencies[sql_query] + coalesced_latency * share,
+                        rows[sql_query], path.getsize(cache_file_path(sql_query))))
+        _finish(_query_hash(sql_query))
+    return results
+
+
+def _is_finished(queries, finished) -> bool:
+    return all(_query_hash(sql_query) in finished and path.exists(cache_file_path(sql_query))
+               for sql_query in queries.values())
+
+
+def main():
+    log_init(path.join(CACHE_DIR_PATH, "results", f"warm-up_cache_{datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.txt"))
+    log('Begin cache warm-up')
+    start_time = time.time()
+    Path(path.dirname(MANIFEST_PATH)).mkdir(parents=True, exist_ok=True)
+
+    finished = load_manifest()
+    all_tasks = build_tasks()
+    tasks = [task for task in all_tasks if not _is_finished(task[1], finished)]
+    log(f"{len(tasks)} tasks to warm up, skipped {len(all_tasks) - len(tasks)} finished tasks.")
+
+    executor = ThreadPoolExecutor(max_workers=WARM_UP_CONCURRENCY)
+    futures = {}
+    try:
+        futures = {executor.submit(warm_task, *task): task for task in tasks}
+        for done, future in enumerate(as_completed(futures), 1):
+            description, queries, _ = futures[future]
+            results = future.result()
+            log(f"---- [{done}/{len(tasks)}] {description}: {sum(rows for _, _, rows, _ in results)} rows, "
+                f"{sum(size for _, _, _, size in results)} bytes")
+            # one line per query, for benchmarking
+            for sql_query, latency, rows, size in results:
+                log(f"WARMUP,{_query_hash(sql_query)},{latency},{rows},{size},{description}")
+    except (KeyboardInterrupt):
+        log("Warm-up interrupted, rerun it to continue with the remaining queries.")
+        cancel_futures(executor, futures)
+        raise
+    finally:
+        executor.shutdown()
+        log('Cache warm-up took %s seconds.' % (time.time() - start_time))
+        log_close()
+        close_connection()
+
+
+if __name__ == "__main__":
+    main()